@@ -11,27 +11,60 @@ warnings.filterwarnings(
 )
 
 
-from .cmbagent import CMBAgent
-from .rag_utils import make_rag_agents
-from .version import __version__
 import os
-from IPython.display import Image, display, Markdown
-from autogen.cmbagent_utils import LOGO, IMG_WIDTH, cmbagent_disable_display
+import importlib
+from .version import __version__
 
+# Public api. Submodules are imported on first access (PEP 562), so that
+# `import cmbagent` does not pull in autogen, openai, pandas, cobaya, ...
+_lazy_attributes = {
+    "CMBAgent": (".cmbagent", "CMBAgent"),
+    "make_rag_agents": (".rag_utils", "make_rag_agents"),
+    "planning_and_control": (".cmbagent", "planning_and_control"),
+    "one_shot": (".cmbagent", "one_shot"),
+    "get_keywords": (".cmbagent", "get_keywords"),
+    "human_in_the_loop": (".cmbagent", "human_in_the_loop"),
+    "control": (".cmbagent", "control"),
+    "planning_and_control_context_carryover": (".cmbagent", "planning_and_control_context_carryover"),
+    "deep_research": (".cmbagent", "planning_and_control_context_carryover"),
+    "work_dir_default": (".cmbagent", "work_dir_default"),
+    "summarize_document": (".cmbagent", "summarize_document"),
+    "summarize_documents": (".cmbagent", "summarize_documents"),
+    "preprocess_task": (".cmbagent", "preprocess_task"),
+    # OCR functionality
+    "process_single_pdf": (".ocr", "process_single_pdf"),
+    "process_folder": (".ocr", "process_folder"),
+    # arXiv downloader functionality
+    "arxiv_filter": (".arxiv_downloader", "arxiv_filter"),
+}
 
+__all__ = ["__version__", "print_cmbagent_logo", *_lazy_attributes]
 
-from .cmbagent import planning_and_control, one_shot, get_keywords, human_in_the_loop, control, planning_and_control_context_carryover, work_dir_default, summarize_document, summarize_documents, preprocess_task
+_logo_printed = False
 
-from .cmbagent import planning_and_control_context_carryover as deep_research
 
-# OCR functionality
-from .ocr import process_single_pdf, process_folder
+def __getattr__(name):
+    global _logo_printed
+    if name not in _lazy_attributes:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attribute = _lazy_attributes[name]
+    value = getattr(importlib.import_module(module_name, __name__), attribute)
+    # cache it, so __getattr__ is only called once per name
+    globals()[name] = value
+    # the logo used to be displayed at import, show it on first use instead
+    if not _logo_printed:
+        _logo_printed = True
+        print_cmbagent_logo()
+    return value
 
-# arXiv downloader functionality
-from .arxiv_downloader import arxiv_filter 
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
 
 
 def print_cmbagent_logo():
+    from IPython.display import Image, display, Markdown
+    from autogen.cmbagent_utils import LOGO, IMG_WIDTH, cmbagent_disable_display
     base_dir = os.path.dirname(__file__)
     png_path = os.path.join(base_dir, "logo.png")
     # print(png_path)
@@ -59,5 +92,3 @@ def print_cmbagent_logo():
     
     # display(HTML(github_html))
     # display(HTML(youtube_html))
-
-print_cmbagent_logo()
\ No newline at end of file
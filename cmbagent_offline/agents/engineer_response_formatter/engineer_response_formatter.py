@@ -58,7 +58,7 @@ class EngineerResponseFormatterAgent(BaseAgent):
 
             # Store executed code in global variable during nested chat
             if self.python_code:
-                cmbagent.vlm_utils._last_executed_code = self.python_code  # moved to ContextVariables in post_execution_transfer
+                cmbagent.vlm_utils._last_executed_code.set(self.python_code)  # moved to ContextVariables in post_execution_transfer
 
             response_parts = [f"**Code Explanation:**\n\n{self.code_explanation}"]
 
@@ -1,8 +1,9 @@
 import os
 from cmbagent.base_agent import BaseAgent
 from pydantic import BaseModel, Field
-from typing import List, Literal, Dict, Any
+from typing import List, Literal, Dict, Any, Optional
 import json
+import re
 from pathlib import Path
 
 
@@ -12,6 +13,9 @@ class Subtasks(BaseModel):
     bullet_points: List[str] = Field(
         ..., description="A list of bullet points explaining what the sub-task should do"
     )
+    depends_on: Optional[List[int]] = Field(
+        None, description="The step numbers whose results this sub-task needs. Empty list if it needs none, null if it simply follows the previous step."
+    )
 
 class PlannerResponse(BaseModel):
     # main_task: str = Field(..., description="The exact main task to solve.")
@@ -21,6 +25,9 @@ class PlannerResponse(BaseModel):
         plan_output = ""
         for i, step in enumerate(self.sub_tasks):
             plan_output += f"\n- Step {i + 1}:\n\t* sub-task: {step.sub_task}\n\t* agent in charge: {step.sub_task_agent}\n"
+            if step.depends_on is not None:
+                depends_on = ", ".join(f"Step {j}" for j in step.depends_on) or "none"
+                plan_output += f"\t* depends on: {depends_on}\n"
             if step.bullet_points:
                 plan_output += "\n\t* instructions:\n"
                 for bullet in step.bullet_points:
@@ -89,6 +96,13 @@ def _parse_plan_string(plan_str: str) -> List[Dict[str, Any]]:
             )
             continue
 
+        # --- step dependencies (absent: follows the previous step) ---------
+        if ln_stripped.startswith("* depends on:"):
+            current["depends_on"] = [
+                int(j) for j in re.findall(r"\d+", ln_stripped.removeprefix("* depends on:"))
+            ]
+            continue
+
         # --- instructions block start --------------------------------------
         if ln_stripped.startswith("* instructions:"):
             in_instr = True
@@ -116,7 +130,8 @@ def save_final_plan(final_context: Dict[str, Any], work_dir: str) -> Path:
                 {
                     "sub_task": "...",
                     "sub_task_agent": "...",
-                    "bullet_points": [...]
+                    "bullet_points": [...],
+                    "depends_on": [...]     # optional
                 },
                 ...
             ]
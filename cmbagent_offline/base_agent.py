@@ -1,11 +1,11 @@
 import os 
 import logging
-from cobaya.yaml import yaml_load_file
-from autogen.coding import LocalCommandLineCodeExecutor
+from cmbagent.execution import ArtifactRecordingCodeExecutor, ForkServerCodeExecutor, KernelCodeExecutor
 from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
 from autogen.agentchat import UserProxyAgent
 
 from cmbagent.utils import file_search_max_num_results
+from cmbagent.manifest import load_agent_info
 from autogen.agentchat import ConversableAgent, UpdateSystemMessage
 import autogen
 import copy
@@ -42,7 +42,8 @@ class BaseAgent:
 
         self.llm_config = copy.deepcopy(llm_config)
 
-        self.info = yaml_load_file(agent_id + ".yaml")
+        # parsed yaml from the agent manifest (see manifest.py)
+        self.info = load_agent_info(agent_id)
 
         self.name = self.info["name"]
 
@@ -61,6 +62,14 @@ class BaseAgent:
 
         self.agent_type = agent_type
 
+        # "local": a new python process per code block, "forkserver": a fork of a pre-imported
+        # forkserver (see execution/forkserver.py), "kernel": a warm kernel (see execution/kernel.py)
+        self.code_executor = "local"
+        self.kernel_options = {}
+        self.forkserver_preload = None
+        self.static_check = None
+        self.execution_cache = None
+
         if cmbagent_debug:
             print('\n---------------------------------- setting name: ', self.info["name"])
             print('work_dir: ', self.work_dir)
@@ -261,6 +270,8 @@ class BaseAgent:
             }
 
 
+        self.execution_policies = execution_policies
+
         self.agent = CmbAgentSwarmAgent(
             name= self.name,
             system_message= self.info["instructions"],
@@ -270,10 +281,7 @@ class BaseAgent:
         max_consecutive_auto_reply=self.info["max_consecutive_auto_reply"],
         is_termination_msg=lambda x: x.get("content", "").rstrip().endswith("TERMINATE"),
         code_execution_config={
-            "executor": LocalCommandLineCodeExecutor(work_dir=self.work_dir,
-                                                    timeout=self.info["timeout"],
-                                                    execution_policies = execution_policies
-                                                    ),
+            "executor": self.make_code_executor(),
             "last_n_messages": 2,
         },
         cmbagent_debug=cmbagent_debug,
@@ -285,6 +293,62 @@ class BaseAgent:
 
 
 
+    def make_code_executor(self, previous=None):
+        """Build the code executor of a code agent, bound to self.work_dir.
+
+        With the kernel executor and kernel_options['persist_across_steps'], the kernel
+        of the previous executor is kept.
+        """
+        if self.code_executor == "kernel" and self.execution_policies.get("python"):
+            kernel_options = dict(self.kernel_options)
+            persist_across_steps = kernel_options.pop("persist_across_steps", False)
+            kernel = previous.take_kernel() if persist_across_steps and isinstance(previous, KernelCodeExecutor) else None
+            return KernelCodeExecutor(work_dir=self.work_dir,
+                                      timeout=self.info["timeout"],
+                                      execution_policies = self.execution_policies,
+                                      kernel = kernel,
+                                      static_check = self.static_check,
+                                      execution_cache = self.execution_cache,
+                                      **kernel_options
+                                      )
+        if self.code_executor == "forkserver":
+            return ForkServerCodeExecutor(work_dir=self.work_dir,
+                                          timeout=self.info["timeout"],
+                                          execution_policies = self.execution_policies,
+                                          preload = self.forkserver_preload,
+                                          static_check = self.static_check,
+                                          execution_cache = self.execution_cache
+                                          )
+        # records the files written by each execution, see execution/artifacts.py
+        return ArtifactRecordingCodeExecutor(work_dir=self.work_dir,
+                                             timeout=self.info["timeout"],
+                                             execution_policies = self.execution_policies,
+                                             static_check = self.static_check,
+                                             execution_cache = self.execution_cache
+                                             )
+
+    def rebind_work_dir(self, work_dir):
+        """Point an already set agent to a new work_dir.
+
+        Code agents get a fresh executor bound to the new directory, all other
+        agents only record it.
+        """
+        self.work_dir = work_dir
+
+        if hasattr(self, "execution_policies") and hasattr(self, "agent"):
+            previous = getattr(self.agent, "_code_executor", None)
+            executor = self.make_code_executor(previous=previous)
+            if isinstance(previous, KernelCodeExecutor):
+                # no-op if its kernel was handed over
+                previous.stop()
+            self.agent._code_executor = executor
+            if isinstance(self.agent._code_execution_config, dict):
+                self.agent._code_execution_config["executor"] = executor
+
+        if cmbagent_debug:
+            print(f'{self.name} rebound to work_dir: ', self.work_dir)
+
+
     def set_admin_agent(self,instructions=None):
 
         logger = logging.getLogger(self.name) 
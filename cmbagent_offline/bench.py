@@ -0,0 +1,413 @@
+# cmbagent/bench.py
+#
+# Benchmarks of the python side of the framework: everything but the LLM calls,
+# which are answered by the stand-in in stub mode (see standin.py).
+#
+# Run with `cmbagent bench`. Results are written as json, and compared with a
+# stored baseline: a benchmark whose median time grew by more than the tolerance
+# is reported as a regression (and the command exits with status 1).
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import contextlib
+import io
+
+BENCH_VERSION = 1
+
+# relative slow-down tolerated before a benchmark is reported as a regression
+DEFAULT_TOLERANCE = 0.25
+# differences below this are noise (seconds)
+NOISE_FLOOR_S = 1e-3
+
+STUB_MODEL = "gpt-4.1-mini"
+# delay of each stub answer where the number of requests is measured (seconds)
+STUB_LATENCY_S = 0.05
+
+
+def get_baseline_path():
+    """Stored baseline, in $CMBAGENT_CACHE_DIR or ~/.cache/cmbagent."""
+    cache_dir = os.environ.get("CMBAGENT_CACHE_DIR",
+                               os.path.join(os.path.expanduser("~"), ".cache", "cmbagent"))
+    return os.path.join(cache_dir, "bench_baseline.json")
+
+
+def timeit(fn, repeat=5, setup=None):
+    """Timings of fn() (setup() is run before each call, not timed). Returns the summary dict."""
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t)
+    return {"median_s": statistics.median(timings), "min_s": min(timings),
+            "mean_s": statistics.fmean(timings), "n": len(timings)}
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process, in MB."""
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the prints of the workflows while timing them."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# --- synthetic inputs
+
+def make_codebase(directory, n_files, n_functions=5):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n_files):
+        functions = "\n\n".join(
+            f"def function_{i}_{j}(x, y=1):\n    \"\"\"Compute quantity {j} of module {i}.\n\n"
+            f"    Args:\n        x (float): input.\n        y (int): order.\n    \"\"\"\n    return x * y + {j}\n"
+            for j in range(n_functions))
+        with open(os.path.join(directory, f"module_{i}.py"), "w") as f:
+            f.write(f"\"\"\"Module {i}.\"\"\"\nimport math\n\n{functions}")
+
+
+def make_data_dir(work_dir, data_dir, n_files, plot_fraction=0.2):
+    """Data directory with n_files files (a fraction of them plots), recorded in the artifact manifest."""
+    from cmbagent.execution.artifacts import manifest_filename
+    os.makedirs(data_dir, exist_ok=True)
+    records = []
+    n_plots = max(1, int(n_files * plot_fraction))
+    for i in range(n_files):
+        subdir = os.path.join(data_dir, f"run_{i // 100}")
+        os.makedirs(subdir, exist_ok=True)
+        path = os.path.join(subdir, f"plot_{i}.png" if i < n_plots else f"data_{i}.npy")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 64)
+        stat = os.stat(path)
+        records.append({"execution": 1, "path": path, "kind": "created", "size": stat.st_size, "mtime": stat.st_mtime_ns})
+    with open(os.path.join(work_dir, manifest_filename), "w") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+def make_context(n_keys=40, doc_size=200_000):
+    context = {f"key_{i}": f"value {i}" for i in range(n_keys)}
+    context["camb_context"] = "camb documentation " * (doc_size // 19)
+    context["plans"] = [f"step {i}" for i in range(10)]
+    context["previous_steps_execution_summary"] = "\n"
+    return context
+
+
+# --- benchmarks
+
+def bench_record_status(root, sizes, repeat):
+    """
+    The record_status tool of control (context updates, codebase shown to control, new plots, hand-off),
+    as registered on a planning and control roster, cold and warm codebase index.
+    """
+    from cmbagent import codebase_index
+    from cmbagent.standin import start_standin
+    results = {}
+    standin = start_standin(None, mode="stub")
+    try:
+        from autogen.agentchat.group import ContextVariables
+        from autogen.agentchat.group.group_tool_executor import GroupToolExecutor
+        from cmbagent.cmbagent import CMBAgent
+        from cmbagent.context import fork_context, shared_context
+        from cmbagent.utils import get_api_keys_from_env
+
+        with quiet():
+            cmbagent = CMBAgent(work_dir=os.path.join(root, "control"),
+                                mode="planning_and_control_context_carryover",
+                                default_llm_model=STUB_MODEL,
+                                default_formatter_model=STUB_MODEL,
+                                api_keys=get_api_keys_from_env())
+        # bound to the context variables the way a group chat binds the tools of its agents
+        context_variables = ContextVariables()
+        executor = GroupToolExecutor()
+        executor.register_agents_functions([cmbagent.get_agent_from_name("control")], context_variables)
+        record_status = executor._function_map["record_status"]
+
+        for n_files in sizes:
+            work_dir = os.path.join(root, f"work_{n_files}")
+            directory = os.path.join(work_dir, "codebase")
+            make_codebase(directory, n_files)
+            cmbagent.reset(work_dir=work_dir)
+            cmbagent.step = 1  # as set by solve() for the step being run
+            context_variables.data.clear()
+            context_variables.data.update(fork_context(shared_context), number_of_steps_in_plan=3)
+
+            def call():
+                with quiet():
+                    record_status(current_status="in progress",
+                                  current_plan_step_number=1,
+                                  current_sub_task="Compute the spectra.",
+                                  current_instructions="Use camb.",
+                                  agent_for_sub_task="engineer")
+
+            def cold():
+                codebase_index._indexes.pop(os.path.abspath(directory), None)
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(directory, codebase_index.index_filename))
+                call()
+
+            results[f"record_status_codebase_{n_files}_cold"] = timeit(cold, repeat=max(1, repeat // 2))
+            call()
+            results[f"record_status_codebase_{n_files}_warm"] = timeit(call, repeat=repeat)
+    finally:
+        standin.stop()
+    return results
+
+
+def bench_load_plots(root, sizes, repeat):
+    """
+    New plots lookup after each execution: from the artifact manifest (cold, and per turn reading the new records),
+    and the directory scan fallback; and the recording of the files written by an execution.
+    """
+    from types import SimpleNamespace
+    from autogen.coding.base import CodeBlock
+    from cmbagent.functions import load_new_plots, load_plots
+    from cmbagent.execution.artifacts import ArtifactRecordingCodeExecutor, _manifests, manifest_filename
+    results = {}
+    for n_files in sizes:
+        work_dir = os.path.join(root, f"work_{n_files}")
+        data_dir = os.path.join(work_dir, "data")
+        make_data_dir(work_dir, data_dir, n_files)
+        instance = SimpleNamespace(work_dir=work_dir)
+        context = {"database_path": "data", "displayed_images": []}
+
+        def manifest_cold():
+            _manifests.clear()
+            load_new_plots(instance, context)
+
+        results[f"load_plots_{n_files}_manifest"] = timeit(manifest_cold, repeat=repeat)
+
+        # one new plot per turn, the previous ones displayed
+        context["displayed_images"] = list(load_new_plots(instance, context))
+        new_plot = os.path.join(data_dir, "new_plot.png")
+        with open(new_plot, "wb") as f:
+            f.write(b"\0" * 64)
+        record = json.dumps({"execution": 2, "path": new_plot, "kind": "modified", "size": 64,
+                             "mtime": os.stat(new_plot).st_mtime_ns}) + "\n"
+
+        def append_record():
+            with open(os.path.join(work_dir, manifest_filename), "a") as f:
+                f.write(record)
+
+        def manifest_turn():
+            context["displayed_images"] = context["displayed_images"] + load_new_plots(instance, context)
+
+        results[f"load_plots_{n_files}_manifest_turn"] = timeit(manifest_turn, repeat=repeat, setup=append_record)
+        results[f"load_plots_{n_files}_scan"] = timeit(lambda: load_plots(data_dir), repeat=repeat)
+
+        # an execution writing one file, in a work_dir of n_files files
+        executor = ArtifactRecordingCodeExecutor(work_dir=work_dir)
+        code_blocks = [CodeBlock(code='plt.savefig("data/new_plot.png")', language="python")]
+        executor.record_artifacts(time.time_ns(), code_blocks)
+        time.sleep(0.1)
+        results[f"record_artifacts_{n_files}"] = timeit(lambda: executor.record_artifacts(time.time_ns(), code_blocks), repeat=repeat)
+    return results
+
+
+def bench_checkpoints(root, n_steps, repeat):
+    """Checkpoint of every step of a plan, and restart from the last one."""
+    from cmbagent.checkpoints import CheckpointStore
+
+    def write():
+        context_dir = os.path.join(root, "context")
+        shutil.rmtree(context_dir, ignore_errors=True)
+        checkpoints = CheckpointStore(context_dir)
+        context = make_context()
+        checkpoints.write_step(0, context)
+        for step in range(1, n_steps + 1):
+            context = dict(context)
+            context["previous_steps_execution_summary"] += f"### Step {step}\n" + "result " * 200
+            context["current_plan_step_number"] = step
+            checkpoints.write_step(step, context)
+
+    results = {"checkpoint_write": timeit(write, repeat=repeat)}
+    results["checkpoint_read"] = timeit(lambda: CheckpointStore(os.path.join(root, "context")).load_step(n_steps), repeat=repeat)
+    return results
+
+
+def bench_workflow(root, repeat):
+    """CMBAgent() construction, solve overhead per round and display_cost, against the stub LLM."""
+    from cmbagent.standin import start_standin
+    results = {}
+    standin = start_standin(None, mode="stub")
+    try:
+        from cmbagent.cmbagent import CMBAgent
+        from cmbagent.utils import get_model_config, get_api_keys_from_env
+
+        api_keys = get_api_keys_from_env()
+        researcher_config = get_model_config(STUB_MODEL, api_keys)
+
+        def make_agent(work_dir):
+            return CMBAgent(initial_agent="researcher",
+                            mode="one_shot",
+                            work_dir=work_dir,
+                            agent_llm_configs={"researcher": researcher_config},
+                            default_llm_model=STUB_MODEL,
+                            default_formatter_model=STUB_MODEL,
+                            api_keys=api_keys)
+
+        work_dir = os.path.join(root, "one_shot")
+        with quiet():
+            make_agent(work_dir)  # first one imports the agents and loads the manifest
+            results["cmbagent_construction"] = timeit(lambda: make_agent(work_dir), repeat=repeat)
+
+            cmbagent = make_agent(work_dir)
+            rounds = []
+
+            def solve():
+                cmbagent.reset()
+                cmbagent.solve("Write a one line note.", max_rounds=20, initial_agent="researcher", mode="one_shot")
+                rounds.append(max(1, len(cmbagent.chat_result.chat_history)))
+
+            solve_timing = timeit(solve, repeat=repeat)
+            n_rounds = statistics.median(rounds)
+            results["solve_per_round"] = {key: value / n_rounds if key.endswith("_s") else value
+                                          for key, value in solve_timing.items()}
+            results["solve_per_round"]["rounds"] = n_rounds
+
+            if not hasattr(cmbagent, "groupchat"):
+                cmbagent.groupchat = type("Dummy", (object,), {"new_conversable_agents": []})()
+            results["display_cost"] = timeit(cmbagent.display_cost, repeat=repeat)
+    finally:
+        standin.stop()
+    return results
+
+
+def bench_native_structured(root, repeat):
+    """
+    Rounds, LLM requests and wall time of a one_shot engineer run with the engineer_response_formatter
+    and with native structured output (no formatter, see native_structured.py), against the stub LLM.
+    """
+    from cmbagent.standin import start_standin
+    from cmbagent.cost_ledger import ledger_filename, read_ledger
+    results = {}
+    # the request saved by the native mode shows in the wall time
+    standin = start_standin(None, mode="stub", latency=STUB_LATENCY_S)
+    try:
+        import cmbagent
+
+        for mode, native_structured_agents in [("formatter", None), ("native", ["engineer"])]:
+            rounds = []
+            llm_requests = []
+            work_dir = os.path.join(root, mode)
+
+            def run():
+                output = cmbagent.one_shot("Compute the sum of the first 1000 natural numbers.",
+                                           max_rounds=20,
+                                           agent="engineer",
+                                           engineer_model=STUB_MODEL,
+                                           researcher_model=STUB_MODEL,
+                                           plot_judge_model=STUB_MODEL,
+                                           camb_context_model=STUB_MODEL,
+                                           default_llm_model=STUB_MODEL,
+                                           default_formatter_model=STUB_MODEL,
+                                           work_dir=work_dir,
+                                           clear_work_dir=True,
+                                           native_structured_agents=native_structured_agents)
+                rounds.append(len(output["chat_history"]))
+                # the formatter runs in the nested chat of the engineer, it is not a round of the main chat
+                llm_requests.append(len(read_ledger(os.path.join(work_dir, "cost", ledger_filename))))
+
+            with quiet():
+                results[f"native_structured_{mode}"] = timeit(run, repeat=repeat)
+            results[f"native_structured_{mode}"]["rounds"] = statistics.median(rounds)
+            results[f"native_structured_{mode}"]["llm_requests"] = statistics.median(llm_requests)
+    finally:
+        standin.stop()
+    return results
+
+
+# benchmark groups, as selected with `cmbagent bench --only`
+benchmark_names = ["record_status", "load_plots", "checkpoints", "workflow", "native_structured"]
+
+
+def run_benchmarks(only=None, quick=False, repeat=5, codebase_sizes=None, data_sizes=None):
+    """
+    Run the benchmarks (all, or those in only) and return the results dict.
+    codebase_sizes and data_sizes override the sizes chosen by quick.
+
+    Benchmarks that can not run here (e.g. a missing dependency) are reported as skipped.
+    """
+    codebase_sizes = codebase_sizes or ([10, 100] if quick else [10, 100, 1000])
+    data_sizes = data_sizes or ([100, 1000] if quick else [100, 1000, 10000])
+    repeat = min(repeat, 3) if quick else repeat
+    arguments = {
+        "record_status": lambda root: bench_record_status(root, codebase_sizes, repeat),
+        "load_plots": lambda root: bench_load_plots(root, data_sizes, repeat),
+        "checkpoints": lambda root: bench_checkpoints(root, 10, repeat),
+        "workflow": lambda root: bench_workflow(root, repeat),
+        "native_structured": lambda root: bench_native_structured(root, repeat),
+    }
+
+    results = {}
+    skipped = {}
+    root = tempfile.mkdtemp(prefix="cmbagent_bench_")
+    try:
+        for name in benchmark_names:
+            if only and name not in only:
+                continue
+            print(f"⏱  {name}...")
+            try:
+                results.update(arguments[name](os.path.join(root, name)))
+            except ImportError as e:
+                skipped[name] = f"{e.__class__.__name__}: {e}"
+                print(f"   skipped ({skipped[name]})")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "version": BENCH_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+        "skipped": skipped,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Benchmarks slower than in the baseline by more than tolerance.
+
+    Returns:
+        list: (name, baseline median, new median) of the regressions.
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        old, new = base["median_s"], result["median_s"]
+        if new > old * (1 + tolerance) and new - old > NOISE_FLOOR_S:
+            regressions.append((name, old, new))
+    old_rss, new_rss = baseline.get("peak_rss_mb"), report.get("peak_rss_mb")
+    if old_rss and new_rss and new_rss > old_rss * (1 + tolerance):
+        regressions.append(("peak_rss_mb", old_rss, new_rss))
+    return regressions
+
+
+def format_report(report, baseline=None):
+    lines = [f"{'benchmark':<40} {'median':>12} {'min':>12} {'baseline':>12} {'change':>8}"]
+    for name, result in report["results"].items():
+        base = (baseline or {}).get("results", {}).get(name)
+        base_str = f"{base['median_s'] * 1e3:10.3f}ms" if base else f"{'-':>12}"
+        change = f"{(result['median_s'] / base['median_s'] - 1) * 100:+7.1f}%" if base and base["median_s"] else f"{'-':>8}"
+        lines.append(f"{name:<40} {result['median_s'] * 1e3:10.3f}ms {result['min_s'] * 1e3:10.3f}ms {base_str} {change}")
+    if report.get("peak_rss_mb") is not None:
+        lines.append(f"{'peak_rss':<40} {report['peak_rss_mb']:10.1f}MB")
+    return "\n".join(lines)
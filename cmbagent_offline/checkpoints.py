@@ -0,0 +1,213 @@
+# cmbagent/checkpoints.py
+#
+# Delta checkpoint store for planning_and_control_context_carryover (deep_research).
+#
+# Instead of pickling the whole final context after every step, each step appends
+# one json line to <context_dir>/checkpoints.jsonl holding only the keys that
+# changed since the step it builds on. Large values (docs, long summaries, cost
+# tables) are written once to <context_dir>/blobs/<sha256>.json and referenced by
+# hash. Everything is plain json (dataframes included), so the context dir alone
+# is enough to resume a run on another machine.
+import os
+import json
+import time
+import hashlib
+import autogen
+from .context import is_immutable
+
+cmbagent_debug = autogen.cmbagent_debug
+
+checkpoints_filename = "checkpoints.jsonl"
+blobs_dirname = "blobs"
+
+# encoded values larger than this (in bytes) are stored as blobs
+BLOB_THRESHOLD = 4096
+
+
+def encode_value(value):
+    """Json-compatible encoding of a context value, with tags for non-json types."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: encode_value(v) for k, v in value.items()}
+        return {"__items__": [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    if isinstance(value, list):
+        return [encode_value(v) for v in value]
+    if isinstance(value, tuple):
+        return {"__tuple__": [encode_value(v) for v in value]}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": [encode_value(v) for v in value]}
+    if isinstance(value, os.PathLike):
+        return {"__path__": os.fspath(value)}
+    if type(value).__name__ == "DataFrame" and hasattr(value, "to_dict"):
+        split = value.to_dict(orient="split")
+        return {"__dataframe__": {"columns": encode_value(list(split["columns"])),
+                                  "index": encode_value(list(split["index"])),
+                                  "data": encode_value([list(row) for row in split["data"]])}}
+    if hasattr(value, "data") and type(value).__name__ == "ContextVariables":
+        return encode_value(dict(value.data))
+    if hasattr(value, "model_dump"):
+        return encode_value(value.model_dump())
+    if hasattr(value, "item"):
+        # numpy scalars
+        return encode_value(value.item())
+    # not restorable, keep a readable trace
+    return {"__repr__": repr(value)}
+
+
+def decode_value(value):
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        (tag, content), = value.items()
+        if tag == "__tuple__":
+            return tuple(decode_value(v) for v in content)
+        if tag == "__set__":
+            return set(decode_value(v) for v in content)
+        if tag == "__items__":
+            return {decode_value(k): decode_value(v) for k, v in content}
+        if tag == "__path__":
+            from pathlib import Path
+            return Path(content)
+        if tag == "__dataframe__":
+            import pandas as pd
+            return pd.DataFrame(data=decode_value(content["data"]),
+                                columns=decode_value(content["columns"]),
+                                index=decode_value(content["index"]))
+        if tag == "__repr__":
+            return content
+    return {k: decode_value(v) for k, v in value.items()}
+
+
+class CheckpointStore:
+    """
+    Append-only store of per-step context deltas.
+
+    Each record of checkpoints.jsonl is
+        {"step": k, "base": j or None, "set": {key: encoded or {"__blob__": hash}}, "removed": [keys]}
+    and the context after step k is the context after its base step with the record applied.
+    A step written twice (e.g. after a restart) is superseded by its last record.
+    """
+
+    def __init__(self, context_dir):
+        self.context_dir = str(context_dir)
+        self.path = os.path.join(self.context_dir, checkpoints_filename)
+        self.blobs_dir = os.path.join(self.context_dir, blobs_dirname)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        # last checkpointed step and its context, to compute the next delta
+        self.last_step = None
+        self._last_values = {}     # key -> value object, to skip unchanged values by identity
+        self._last_encoded = {}    # key -> encoded reference (inline value or blob ref)
+        self._blob_cache = {}
+
+    # --- blobs
+
+    def _put(self, encoded):
+        """Inline encoded value, or a blob reference if it is large."""
+        data = json.dumps(encoded, separators=(",", ":"))
+        if len(data) < BLOB_THRESHOLD:
+            return encoded
+        digest = hashlib.sha256(data.encode()).hexdigest()
+        blob_path = os.path.join(self.blobs_dir, f"{digest}.json")
+        if not os.path.exists(blob_path):
+            tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+        return {"__blob__": digest}
+
+    def _get(self, ref):
+        if isinstance(ref, dict) and len(ref) == 1 and "__blob__" in ref:
+            digest = ref["__blob__"]
+            if digest not in self._blob_cache:
+                with open(os.path.join(self.blobs_dir, f"{digest}.json")) as f:
+                    self._blob_cache[digest] = json.load(f)
+            return self._blob_cache[digest]
+        return ref
+
+    # --- writing
+
+    def write_step(self, step, context):
+        """
+        Checkpoint the context after step (0 is planning). Only the keys that differ
+        from the last checkpointed step are written. Returns the list of written keys.
+        """
+        data = getattr(context, "data", context)
+        changed = {}
+        for key, value in data.items():
+            # shared immutable values (docs, ...) are not encoded again, see context.py
+            if key in self._last_values and self._last_values[key] is value and is_immutable(value):
+                continue
+            ref = self._put(encode_value(value))
+            if key not in self._last_encoded or self._last_encoded[key] != ref:
+                changed[key] = ref
+            self._last_encoded[key] = ref
+            self._last_values[key] = value
+        removed = [key for key in self._last_encoded if key not in data]
+        for key in removed:
+            del self._last_encoded[key]
+            self._last_values.pop(key, None)
+
+        record = {"step": step, "base": self.last_step, "time": time.time(),
+                  "set": changed, "removed": removed}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.last_step = step
+
+        if cmbagent_debug:
+            print(f"checkpoint step {step}: {len(changed)} keys written, {len(removed)} removed")
+        return list(changed)
+
+    # --- reading
+
+    def records(self):
+        """Last record of every checkpointed step."""
+        records = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # interrupted write
+                        continue
+                    records[record["step"]] = record
+        except OSError:
+            pass
+        return records
+
+    def has_step(self, step):
+        return step in self.records()
+
+    def load_step(self, step):
+        """
+        Context after step, rebuilt by replaying the deltas of its chain of base steps.
+        The store then continues from that step (the next write_step builds on it).
+        """
+        records = self.records()
+        if step not in records:
+            raise KeyError(f"no checkpoint for step {step} in {self.path}")
+
+        chain = []
+        current = step
+        while current is not None:
+            chain.append(records[current])
+            current = records[current]["base"]
+
+        encoded = {}
+        for record in reversed(chain):
+            for key in record["removed"]:
+                encoded.pop(key, None)
+            encoded.update(record["set"])
+
+        context = {key: decode_value(self._get(ref)) for key, ref in encoded.items()}
+
+        self.last_step = step
+        self._last_encoded = dict(encoded)
+        self._last_values = dict(context)
+        return context
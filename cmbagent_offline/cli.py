@@ -224,6 +224,116 @@ def run_next_gui():
         sys.exit(1)
 
 
+def run_manifest(check: bool):
+    """Rebuild (or check) the precompiled agent manifest"""
+    from cmbagent.manifest import (get_manifest_path, build_agent_manifest,
+                                   write_agent_manifest, is_manifest_valid)
+    import json
+
+    manifest_path = get_manifest_path()
+
+    if check:
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            print(f"❌ No agent manifest at {manifest_path}")
+            sys.exit(1)
+        if not is_manifest_valid(manifest):
+            print(f"❌ Agent manifest at {manifest_path} is stale")
+            sys.exit(1)
+        print(f"✅ Agent manifest at {manifest_path} is up to date ({len(manifest['agents'])} agents)")
+        return
+
+    manifest = build_agent_manifest()
+    if write_agent_manifest(manifest, manifest_path) is None:
+        print(f"❌ Could not write agent manifest to {manifest_path}")
+        sys.exit(1)
+    print(f"✅ Agent manifest written to {manifest_path} ({len(manifest['agents'])} agents)")
+
+
+def run_standin(fixtures: str, record: bool, upstream: str, latency: str, host: str, port: int, strict: bool):
+    """Serve recorded LLM sessions (or record one) for offline runs"""
+    from cmbagent.standin import StandinServer
+
+    if latency is None:
+        latency_value = None
+    elif latency == "recorded":
+        latency_value = "recorded"
+    else:
+        latency_value = float(latency)
+
+    try:
+        server = StandinServer(fixtures,
+                               mode="record" if record else "replay",
+                               upstream=upstream,
+                               upstream_api_key=os.environ.get("CMBAGENT_STANDIN_UPSTREAM_KEY"),
+                               latency=latency_value,
+                               match_sequence=not strict,
+                               host=host,
+                               port=port)
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if record:
+        print(f"🔴 Recording LLM traffic to {server.store.path} (upstream: {upstream})")
+    else:
+        print(f"▶️  Replaying {len(server.store)} recorded exchanges from {server.store.path}")
+    print("Point the runs to the stand-in with:")
+    print(f"   export CMBAGENT_LLM_STANDIN={server.url}")
+    print(f"   export OPENAI_BASE_URL={server.url}")
+    print("💡 Press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Stand-in stopped")
+    finally:
+        server.server_close()
+
+
+def run_bench(output: str, baseline: str, save_baseline: bool, tolerance: float, quick: bool, only: list,
+              codebase_sizes: list = None, data_sizes: list = None):
+    """Benchmark the orchestration overhead and compare with the stored baseline"""
+    from cmbagent.bench import (run_benchmarks, compare_to_baseline, format_report,
+                                get_baseline_path)
+    import json
+
+    baseline_path = baseline or get_baseline_path()
+    report = run_benchmarks(only=only, quick=quick, codebase_sizes=codebase_sizes, data_sizes=data_sizes)
+
+    baseline_report = None
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as f:
+            baseline_report = json.load(f)
+
+    print("\n" + format_report(report, baseline_report) + "\n")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {output}")
+
+    if save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Baseline saved to {baseline_path}")
+        return
+
+    if baseline_report is None:
+        print(f"💡 No baseline at {baseline_path}, save one with: cmbagent bench --save-baseline")
+        return
+
+    regressions = compare_to_baseline(report, baseline_report, tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) over {tolerance:.0%}:")
+        for name, old, new in regressions:
+            print(f"   {name}: {old:.6g} -> {new:.6g}")
+        sys.exit(1)
+    print(f"✅ No regression over {tolerance:.0%} against {baseline_path}")
+
+
 def main():
     import argparse
     parser = argparse.ArgumentParser(
@@ -255,6 +365,102 @@ def main():
         help="Launch Streamlit GUI with deployment settings for Hugging Face Spaces"
     )
     
+    # Manifest command
+    manifest_parser = subparsers.add_parser(
+        "manifest",
+        help="Rebuild the precompiled agent manifest"
+    )
+    manifest_parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Only check that the manifest is up to date"
+    )
+
+    # Stand-in LLM command
+    standin_parser = subparsers.add_parser(
+        "standin",
+        help="Serve recorded LLM sessions (or record one) for offline, deterministic runs"
+    )
+    standin_parser.add_argument(
+        "--fixtures",
+        required=True,
+        help="Directory of the recorded exchanges"
+    )
+    standin_parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Forward the requests to --upstream and record them"
+    )
+    standin_parser.add_argument(
+        "--upstream",
+        default="https://api.openai.com",
+        help="Base url of the real API when recording (default: https://api.openai.com)"
+    )
+    standin_parser.add_argument(
+        "--latency",
+        default=None,
+        help="Delay added to every replayed response, in seconds, or 'recorded'"
+    )
+    standin_parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Only answer requests identical to recorded ones"
+    )
+    standin_parser.add_argument("--host", default="127.0.0.1")
+    standin_parser.add_argument("--port", type=int, default=8765)
+
+    # Benchmark command
+    bench_parser = subparsers.add_parser(
+        "bench",
+        help="Benchmark the orchestration overhead against a stub LLM"
+    )
+    bench_parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the results as json to this file"
+    )
+    bench_parser.add_argument(
+        "--baseline",
+        default=None,
+        help="Baseline results to compare with (default: ~/.cache/cmbagent/bench_baseline.json)"
+    )
+    bench_parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the baseline"
+    )
+    bench_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative slow-down reported as a regression (default: 0.25)"
+    )
+    bench_parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="Smaller sizes and fewer repeats"
+    )
+    bench_parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=["record_status", "load_plots", "checkpoints", "workflow", "native_structured"],
+        help="Only run these benchmarks"
+    )
+    bench_parser.add_argument(
+        "--codebase-sizes",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Number of files in the codebases of the record_status benchmark"
+    )
+    bench_parser.add_argument(
+        "--data-sizes",
+        nargs="+",
+        type=int,
+        default=None,
+        help="Number of files in the data directories of the load_plots benchmark"
+    )
+
     args = parser.parse_args()
 
     if args.command == "run":
@@ -265,5 +471,12 @@ def main():
             run_streamlit_gui(False)
     elif args.command == "deploy":
         run_streamlit_gui(True)
+    elif args.command == "manifest":
+        run_manifest(args.check)
+    elif args.command == "bench":
+        run_bench(args.output, args.baseline, args.save_baseline, args.tolerance, args.quick, args.only,
+                  args.codebase_sizes, args.data_sizes)
+    elif args.command == "standin":
+        run_standin(args.fixtures, args.record, args.upstream, args.latency, args.host, args.port, args.strict)
     else:
         parser.print_help()
@@ -1,6 +1,5 @@
 import os
 import logging
-import importlib
 import requests
 import autogen 
 import json
@@ -8,6 +7,7 @@ import sys
 import pandas as pd
 import copy
 import datetime
+import functools
 from pathlib import Path
 import time
 import pickle
@@ -25,12 +25,22 @@ from .utils import default_llm_model as default_llm_model_default
 from .utils import default_formatter_model as default_formatter_model_default
 from .utils import clean_llm_config
 
-from .utils import (path_to_assistants, path_to_apis,path_to_agents, update_yaml_preserving_format, get_model_config,
+from .utils import (path_to_assistants, path_to_apis, update_yaml_preserving_format, get_model_config,
                     default_top_p, default_temperature, default_max_round,default_llm_config_list, default_agent_llm_configs,
-                    default_agents_llm_model, camb_context_url,classy_context_url, AAS_keywords_string, get_api_keys_from_env)
+                    default_agents_llm_model, camb_context_url,classy_context_url, get_aas_keywords_string, get_api_keys_from_env)
 
 from .rag_utils import import_rag_agents, push_vector_stores
-from .hand_offs import register_all_hand_offs
+from .manifest import get_agent_entries, load_agent_class
+from .hand_offs import register_all_hand_offs, get_reachable_agents
+from .llm_cache import get_llm_cache, CacheCounter, cache_agent_client
+from .standin import route_to_standin
+from .tracing import tracing_enabled, instrument_agent, trace_agent_client, trace_run
+from .cost_ledger import CostLedger, ledger_filename, track_agent_costs
+from .summary_compaction import StepSummaryCompactor, summary_cache_filename
+from .transcripts import TranscriptWriter
+from .execution.result_cache import memoize_instructions
+from .native_structured import (get_native_structured_agents, get_native_response_format,
+                                native_structured_instructions, native_structured_key, select_native_structured)
 from .functions import register_functions_to_agents
 from .data_retriever import setup_cmbagent_data
 
@@ -39,25 +49,13 @@ from .keywords_utils import AaaiKeywords
 from .utils import unesco_taxonomy_path, aaai_keywords_path
 
 def import_non_rag_agents():
+    # agent classes are read from the precompiled manifest, see manifest.py
     imported_non_rag_agents = {}
-    for subdir in os.listdir(path_to_agents):
-        # Skip rag_agents folder and non-directories
-        if subdir == "rag_agents":
-            continue
-        subdir_path = os.path.join(path_to_agents, subdir)
-        if os.path.isdir(subdir_path):
-            for filename in os.listdir(subdir_path):
-                if filename.endswith(".py") and filename != "__init__.py" and filename[0] != ".":
-                    module_name = filename[:-3]  # Remove the .py extension
-                    class_name = ''.join([part.capitalize() for part in module_name.split('_')]) + 'Agent'
-                    # Assuming the module path is agents.<subdir>.<module_name>
-                    module_path = f"cmbagent.agents.{subdir}.{module_name}"
-                    module = importlib.import_module(module_path)
-                    agent_class = getattr(module, class_name)
-                    imported_non_rag_agents[class_name] = {
-                        'agent_class': agent_class,
-                        'agent_name': module_name,
-                    }
+    for module_name, entry in get_agent_entries(rag=False).items():
+        imported_non_rag_agents[entry['class_name']] = {
+            'agent_class': load_agent_class(entry),
+            'agent_name': module_name,
+        }
     return imported_non_rag_agents
 
 # Ollama patch
@@ -129,7 +127,39 @@ def _extract_plan_from_chat(cmbagent_instance):
 
 from autogen import cmbagent_debug
 from autogen.agentchat import initiate_group_chat
+from autogen.agentchat.group.group_utils import make_remove_function
 from cmbagent.context import shared_context as shared_context_default
+from cmbagent.context import fork_context, ContextStore
+from cmbagent.checkpoints import CheckpointStore
+from cmbagent.plan_dag import get_step_dependencies, is_sequential, critical_path, run_plan_steps, make_branch_work_dir, merge_branch_work_dir
+import threading
+import weakref
+
+# CMBAgent instances alive in this process, so that a run does not delete a
+# directory another run is working in
+active_runs = weakref.WeakSet()
+_active_runs_lock = threading.Lock()
+
+
+# every group chat registers a hook removing the hand-off (transit) messages on its agents
+_transit_hook_code = make_remove_function([]).func.__code__
+
+
+def is_transit_hook(hook):
+    """Whether hook was registered by a group chat to remove the transit messages."""
+    return isinstance(hook, functools.partial) and getattr(hook.func, "__code__", None) is _transit_hook_code
+
+
+def work_dir_in_use(work_dir):
+    """Whether a live CMBAgent works in work_dir or below it."""
+    work_dir = Path(work_dir).expanduser().resolve()
+    with _active_runs_lock:
+        runs = list(active_runs)
+    for run in runs:
+        run_dir = Path(run.work_dir).expanduser().resolve()
+        if run_dir == work_dir or work_dir in run_dir.parents:
+            return True
+    return False
 import shutil
 
 class CMBAgent:
@@ -190,6 +220,21 @@ class CMBAgent:
                  mode = "planning_and_control", # can be "one_shot" , "chat" or "planning_and_control" (default is planning and control), or "planning_and_control_context_carryover"
                  chat_agent = None,
                  api_keys = None,
+                 initial_agent = None,
+                 llm_cache = None,
+                 trace = None,
+                 budget = None,
+                 step_budget = None,
+                 cost_ledger = None,
+                 history_compaction = None,
+                 transcript_compression = None,
+                 code_executor = "local",
+                 kernel_options = None,
+                 forkserver_preload = None,
+                 rule_based_routing = False,
+                 local_formatting = False,
+                 static_check = None,
+                 execution_cache = None,
                 #  make_new_rag_agents = False, ## can be a list of names for new rag agents to be created
                  **kwargs):
         """
@@ -205,6 +250,48 @@ class CMBAgent:
             agent_list (list of strings, optional): List of agents to include in the conversation. Defaults to all agents.
             chunking_strategy (dict, optional): Chunking strategy for vector stores. Defaults to None.
             make_new_rag_agents (list of strings, optional): List of names for new rag agents to be created. Defaults to False.
+            initial_agent (str or list of strings, optional): Agent(s) the conversations will start from. If set, only the agents
+                reachable from them through the hand-offs and registered functions are built, the others are built on first use.
+                Defaults to None, i.e., all agents are built.
+            agent_llm_configs (dict, optional): LLM config of each agent. With 'native_structured_output': True, the engineer,
+                planner, researcher or summarizer is called with the response format of its formatter when its provider
+                supports it (openai, gemini, ollama), and the formatter is skipped (see native_structured.py).
+            llm_cache (bool, str or LLMResponseCache, optional): On-disk cache of the LLM responses, see llm_cache.py.
+                True for the default path, or a path. Defaults to None, i.e., set by $CMBAGENT_LLM_CACHE (no cache if unset).
+            trace (bool, optional): Trace the agent turns, LLM requests, function calls and code executions of each solve,
+                exported to work_dir/traces (see tracing.py). Defaults to None, i.e., set by $CMBAGENT_TRACE (off if unset).
+            budget (dict or Budget, optional): Limits on the tokens, dollars and wall time of the run, e.g.,
+                {'max_tokens': 2_000_000, 'max_cost': 5.0, 'max_seconds': 3600}. When one is exceeded, the chat hands off
+                to the terminator. Defaults to None, i.e., no limit.
+            step_budget (dict or Budget, optional): Same, for each solve() call (each plan step in the control phase).
+            cost_ledger (CostLedger, optional): Ledger shared with other CMBAgent instances of the same run, see cost_ledger.py.
+                Defaults to None, i.e., a ledger in work_dir/cost with budget and step_budget.
+            history_compaction (bool or dict, optional): Compact the older messages of the chat history seen by engineer, control
+                and researcher (see message_transforms.py). True for the defaults, or a dict of ChatHistoryCompactor arguments,
+                e.g., {'keep_last': 8}. Defaults to None, i.e., they see the full history.
+            transcript_compression (str, optional): Compression of the chat transcript written to work_dir/chats as the
+                messages come (see transcripts.py): None, "gzip" or "zstd". Defaults to None.
+            code_executor (str, optional): "local" to run each python code block in a new process, "forkserver" to run it in a
+                fork of a process with the scientific stack already imported (see execution/forkserver.py), or "kernel" to run
+                them in a warm kernel kept across attempts (see execution/kernel.py, needs the jupyter extra). Defaults to "local".
+            kernel_options (dict, optional): Options of the kernel executor: memory_limit_mb, clean_namespace,
+                persist_across_steps (keep the kernel when the roster is reused for the next step). Defaults to None.
+            forkserver_preload (list, optional): Modules and pyproject extras ("local", "astro", ...) imported by the forkserver.
+                Defaults to None, i.e., the local and astro extras.
+            rule_based_routing (bool, optional): Route the code execution results to the next agent by rules (success, missing
+                module, camb/classy error, python error, timeout), the executor_response_formatter LLM is only called for
+                the unclear cases (see execution_routing.py). Defaults to False.
+            local_formatting (bool, optional): Have the engineer, planner and reviewer response formatters parse the reply
+                locally into their response format, their LLM is only called when that fails (see local_formatting.py).
+                Defaults to False.
+            static_check (bool or dict, optional): Fix and check the python code blocks in-process before they are executed
+                (indentation, data paths, syntax, undefined names, imports of modules that are not installed); the blocks
+                that fail are not run and their diagnostics go back to the engineer (see execution/static_check.py).
+                True, or a dict of StaticCheck arguments, e.g. {'database_path': 'data/'}. Defaults to None.
+            execution_cache (bool or dict, optional): Replay the output and files of an identical execution (same code, same
+                data files) instead of running it again, and tell the engineer about cmbagent.memo.memoize for expensive
+                intermediate results (see execution/result_cache.py). True, or a dict of ExecutionCache arguments,
+                e.g. {'max_entry_mb': 100}. Defaults to None.
             
             **kwargs: Additional keyword arguments.
 
@@ -244,7 +331,8 @@ class CMBAgent:
 
         # self.non_rag_agents = ['engineer', 'planner', 'executor', 'admin', 'summarizer', 'rag_software_formatter']
 
-        self.agent_list = agent_list
+        # own copy, the default list is shared by all instances
+        self.agent_list = list(agent_list) if agent_list is not None else None
 
         self.skip_memory = skip_memory
 
@@ -252,6 +340,14 @@ class CMBAgent:
 
         self.mode = mode
         self.chat_agent = chat_agent
+        self.initial_agent = initial_agent
+
+        self.agent_instructions = agent_instructions
+        self.agent_descriptions = agent_descriptions
+        self.agent_temperature = agent_temperature
+        self.agent_top_p = agent_top_p
+        self.chunking_strategy = chunking_strategy
+        self.default_formatter_model = default_formatter_model
 
         if not self.skip_memory and 'memory' not in agent_list:
             self.agent_list.append('memory')
@@ -263,7 +359,8 @@ class CMBAgent:
         if work_dir != work_dir_default:
             # delete work_dir_default as it wont be used
             # exception if we are working within work_dir_default, i.e., work_dir is a subdirectory of work_dir_default
-            if not work_dir_default.resolve() in work_dir.resolve().parents:
+            # or if another run of this process is using it
+            if not work_dir_default.resolve() in Path(work_dir).resolve().parents and not work_dir_in_use(work_dir_default):
                 shutil.rmtree(work_dir_default, ignore_errors=True)
             # shutil.rmtree(work_dir_default, ignore_errors=True)
 
@@ -272,14 +369,18 @@ class CMBAgent:
         if clear_work_dir:
             self.clear_work_dir()
         
-        # add the work_dir to the python path so we can import modules from it
-        sys.path.append(self.work_dir)
+        # the work_dir is not added to the process-wide sys.path: code runs in a
+        # subprocess with cwd=work_dir, and concurrent runs would see each other's modules
+        # sys.path.append(self.work_dir)
+        with _active_runs_lock:
+            active_runs.add(self)
 
         self.path_to_assistants = path_to_assistants
 
         self.logger.info(f"Autogen version: {autogen.__version__}")
 
-        llm_config_list = default_llm_config_list.copy()
+        # deep copy, the api key/type below must not leak into the module default
+        llm_config_list = copy.deepcopy(default_llm_config_list)
 
         if llm_api_key is not None:
             llm_config_list[0]['api_key'] = llm_api_key
@@ -287,6 +388,10 @@ class CMBAgent:
         if llm_api_type is not None:
             llm_config_list[0]['api_type'] = llm_api_type
 
+        # the group manager uses this config too, see standin.py
+        if os.environ.get("CMBAGENT_LLM_STANDIN"):
+            llm_config_list[0] = route_to_standin(llm_config_list[0])
+
         self.llm_api_key = llm_config_list[0]['api_key']
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
 
@@ -294,6 +399,30 @@ class CMBAgent:
 
         self.cache_seed = cache_seed
 
+        # shared by the runs of the process using the same path, each agent counts its own hits/misses
+        self.llm_cache = get_llm_cache(llm_cache)
+
+        self.trace = tracing_enabled(trace)
+
+        self.history_compaction = {} if history_compaction is True else (history_compaction or None)
+
+        self.transcript_compression = transcript_compression
+
+        self.code_executor = code_executor
+        self.kernel_options = kernel_options or {}
+        self.forkserver_preload = forkserver_preload
+
+        self.rule_based_routing = rule_based_routing
+        self.local_formatting = local_formatting
+        self.static_check = static_check
+        self.execution_cache = execution_cache
+
+        # every completion is appended as it arrives, see cost_ledger.py
+        self.owns_cost_ledger = cost_ledger is None
+        if cost_ledger is None:
+            cost_ledger = CostLedger(os.path.join(self.work_dir, "cost", ledger_filename), budget=budget, step_budget=step_budget)
+        self.cost_ledger = cost_ledger
+
         self.llm_config = {
                         "cache_seed": self.cache_seed,  # change the cache_seed for different trials
                         "temperature": temperature,
@@ -324,6 +453,11 @@ class CMBAgent:
         self.agent_llm_configs = default_agent_llm_configs.copy()
         self.agent_llm_configs.update(agent_llm_configs)
 
+        # agents called with the response format of their formatter, see native_structured.py
+        self.native_structured_agents = get_native_structured_agents(self.agent_llm_configs, self.llm_config['config_list'][0])
+        if self.native_structured_agents and (self.verbose or cmbagent_debug):
+            print("Agents with native structured output (no formatter): ", sorted(self.native_structured_agents))
+
         
         # Denario SR fix
         # if api_keys is not None:
@@ -372,69 +506,7 @@ class CMBAgent:
 
         # then we set the agents, note that self.agents is set in init_agents
         for agent in self.agents:
-
-            agent.agent_type = self.agent_type
-            if cmbagent_debug:
-                print(f"\t- {agent.name}")
-
-            instructions = agent_instructions[agent.name] if agent_instructions and agent.name in agent_instructions else None
-            description = agent_descriptions[agent.name] if agent_descriptions and agent.name in agent_descriptions else None
-            agent_kwargs = {}
-
-            if instructions is not None:
-                agent_kwargs['instructions'] = instructions
-
-            if description is not None:
-                agent_kwargs['description'] = description
-           
-
-            if agent.name not in self.non_rag_agent_names: ## loop over all rag agents 
-                if self.skip_rag_agents:
-                    continue
-                vector_ids = self.vector_store_ids[agent.name] if self.vector_store_ids and agent.name in self.vector_store_ids else None
-                temperature = agent_temperature[agent.name] if agent_temperature and agent.name in agent_temperature else None
-                top_p = agent_top_p[agent.name] if agent_top_p and agent.name in agent_top_p else None
-
-                if vector_ids is not None:
-                    agent_kwargs['vector_store_ids'] = vector_ids
-
-                if temperature is not None:
-                    agent_kwargs['agent_temperature'] = temperature
-                else:
-                    agent_kwargs['agent_temperature'] = default_temperature
-
-                if top_p is not None:
-                    agent_kwargs['agent_top_p'] = top_p
-                else:
-                    agent_kwargs['agent_top_p'] = default_top_p
-
-                # cmbagent debug --> removed this option, pass in make_vector_stores=True in kwargs
-                # #### the files list is appended twice to the instructions.... TBD!!!
-                setagent = agent.set_agent(**agent_kwargs)
-
-                if setagent == 1:
-
-                    if cmbagent_debug:
-                        print(f"setting make_vector_stores=['{agent.name.removesuffix('_agent')}'],")
-                    
-                    push_vector_stores(self, [agent.name.removesuffix('_agent')], chunking_strategy, verbose = verbose)
-
-                    agent_kwargs['vector_store_ids'] = self.vector_store_ids[agent.name] 
-
-                    
-                    agent.set_agent(**agent_kwargs) 
-
-                # else:
-                # see above for trick on how to make vector store if it is not found. 
-                # agent.set_agent(**agent_kwargs)
-
-            else: ## set all non-rag agents
-                
-                agent.set_agent(**agent_kwargs)
-
-            ## debug print to help debug
-            #print('in cmbagent.py self.agents instructions: ',instructions)
-            #print('in cmbagent.py self.agents description: ',description)
+            self.set_agent(agent)
 
         if self.verbose or cmbagent_debug:
             print("Planner instructions:")
@@ -465,19 +537,98 @@ class CMBAgent:
         if cmbagent_debug:
             print('\nfunctions added to agents...')
 
-        self.shared_context = shared_context_default
+        # agents built from now on register their own hand-offs and functions
+        self.hand_offs_registered = True
+
+        # per-run context, the module default is never mutated
+        self.shared_context = fork_context(shared_context_default)
         if shared_context is not None:
-            self.shared_context.update(shared_context)
+            self.shared_context.update(fork_context(shared_context))
 
         if cmbagent_debug:
             print('\nshared_context: ', self.shared_context)
 
+    def set_agent(self, agent):
+        """Set an instantiated agent with its instructions, description and, for rag agents, vector stores."""
+
+        agent.agent_type = self.agent_type
+        if cmbagent_debug:
+            print(f"\t- {agent.name}")
+
+        instructions = self.agent_instructions[agent.name] if self.agent_instructions and agent.name in self.agent_instructions else None
+        description = self.agent_descriptions[agent.name] if self.agent_descriptions and agent.name in self.agent_descriptions else None
+        agent_kwargs = {}
+
+        if instructions is not None:
+            agent_kwargs['instructions'] = instructions
+
+        if description is not None:
+            agent_kwargs['description'] = description
+       
+
+        if agent.name not in self.non_rag_agent_names: ## loop over all rag agents 
+            if self.skip_rag_agents:
+                return
+            vector_ids = self.vector_store_ids[agent.name] if self.vector_store_ids and agent.name in self.vector_store_ids else None
+            temperature = self.agent_temperature[agent.name] if self.agent_temperature and agent.name in self.agent_temperature else None
+            top_p = self.agent_top_p[agent.name] if self.agent_top_p and agent.name in self.agent_top_p else None
+
+            if vector_ids is not None:
+                agent_kwargs['vector_store_ids'] = vector_ids
+
+            if temperature is not None:
+                agent_kwargs['agent_temperature'] = temperature
+            else:
+                agent_kwargs['agent_temperature'] = default_temperature
+
+            if top_p is not None:
+                agent_kwargs['agent_top_p'] = top_p
+            else:
+                agent_kwargs['agent_top_p'] = default_top_p
+
+            # cmbagent debug --> removed this option, pass in make_vector_stores=True in kwargs
+            # #### the files list is appended twice to the instructions.... TBD!!!
+            setagent = agent.set_agent(**agent_kwargs)
+
+            if setagent == 1:
+
+                if cmbagent_debug:
+                    print(f"setting make_vector_stores=['{agent.name.removesuffix('_agent')}'],")
+                
+                push_vector_stores(self, [agent.name.removesuffix('_agent')], self.chunking_strategy, verbose = self.verbose)
+
+                agent_kwargs['vector_store_ids'] = self.vector_store_ids[agent.name] 
+
+                
+                agent.set_agent(**agent_kwargs) 
+
+            # else:
+            # see above for trick on how to make vector store if it is not found. 
+            # agent.set_agent(**agent_kwargs)
+
+        else: ## set all non-rag agents
+            
+            agent.set_agent(**agent_kwargs)
+
+        if hasattr(agent, "agent"):
+            self.wrap_agent_client(agent.agent)
+
+        if self.trace and hasattr(agent, "agent"):
+            instrument_agent(agent.agent)
+
+        ## debug print to help debug
+        #print('in cmbagent.py self.agents instructions: ',instructions)
+        #print('in cmbagent.py self.agents description: ',description)
+
+
     def display_cost(self, name_append = None):
         """Display a full cost report as a right‑aligned Markdown table with $ and a
         rule above the total row. Also saves the cost data as JSON in the workdir."""
         import json
 
         cost_dict = defaultdict(list)
+        # row of each agent name in cost_dict
+        rows_by_name = {}
 
         # --- collect per‑agent costs ------------------------------------------------
         all_agents = [a.agent for a in self.agents]
@@ -485,6 +636,10 @@ class CMBAgent:
             all_agents += self.groupchat.new_conversable_agents
 
         for agent in all_agents:
+            client_cache = getattr(getattr(agent, "client", None), "_cmbagent_llm_cache", None)
+            cache_hits = client_cache.hits if isinstance(client_cache, CacheCounter) else 0
+            cache_misses = client_cache.misses if isinstance(client_cache, CacheCounter) else 0
+
             if hasattr(agent, "cost_dict") and agent.cost_dict.get("Agent"):
                 name = (
                     agent.cost_dict["Agent"][0]
@@ -498,22 +653,35 @@ class CMBAgent:
                 summed_total  = int(sum(agent.cost_dict["Total Tokens"]))
 
                 model_name = agent.cost_dict["Model"][0]
-                
+            elif cache_hits:
+                # all its responses came from the cache: nothing was charged
+                name = agent.name.replace("_", " ")
+                summed_cost, summed_prompt, summed_comp, summed_total = 0.0, 0, 0, 0
+                model_name = agent.client._config_list[0].get("model", "") if agent.client._config_list else ""
+            else:
+                continue
 
-                if name in cost_dict["Agent"]:
-                    i = cost_dict["Agent"].index(name)
-                    cost_dict["Cost ($)"][i]          += summed_cost
-                    cost_dict["Prompt Tokens"][i]     += summed_prompt
-                    cost_dict["Completion Tokens"][i] += summed_comp
-                    cost_dict["Total Tokens"][i]      += summed_total
-                    cost_dict["Model"][i]             += model_name
-                else:
-                    cost_dict["Agent"].append(name)
-                    cost_dict["Cost ($)"].append(summed_cost)
-                    cost_dict["Prompt Tokens"].append(summed_prompt)
-                    cost_dict["Completion Tokens"].append(summed_comp)
-                    cost_dict["Total Tokens"].append(summed_total)
-                    cost_dict["Model"].append(model_name)
+            if name in rows_by_name:
+                i = rows_by_name[name]
+                cost_dict["Cost ($)"][i]          += summed_cost
+                cost_dict["Prompt Tokens"][i]     += summed_prompt
+                cost_dict["Completion Tokens"][i] += summed_comp
+                cost_dict["Total Tokens"][i]      += summed_total
+                cost_dict["Model"][i]             += model_name
+                if self.llm_cache is not None:
+                    cost_dict["Cache Hits"][i]    += cache_hits
+                    cost_dict["Cache Misses"][i]  += cache_misses
+            else:
+                rows_by_name[name] = len(cost_dict["Agent"])
+                cost_dict["Agent"].append(name)
+                cost_dict["Cost ($)"].append(summed_cost)
+                cost_dict["Prompt Tokens"].append(summed_prompt)
+                cost_dict["Completion Tokens"].append(summed_comp)
+                cost_dict["Total Tokens"].append(summed_total)
+                cost_dict["Model"].append(model_name)
+                if self.llm_cache is not None:
+                    cost_dict["Cache Hits"].append(cache_hits)
+                    cost_dict["Cache Misses"].append(cache_misses)
 
         # --- build DataFrame & totals ----------------------------------------------
         df = pd.DataFrame(cost_dict)
@@ -524,8 +692,9 @@ class CMBAgent:
         # --- string formatting for display ------------------------------------------------------
         df_str = df.copy()
         df_str["Cost ($)"] = df_str["Cost ($)"].map(lambda x: f"${x:.8f}")
-        for col in ["Prompt Tokens", "Completion Tokens", "Total Tokens"]:
-            df_str[col] = df_str[col].astype(int).astype(str)
+        for col in ["Prompt Tokens", "Completion Tokens", "Total Tokens", "Cache Hits", "Cache Misses"]:
+            if col in df_str.columns:
+                df_str[col] = df_str[col].astype(int).astype(str)
 
         columns = df_str.columns.tolist()
         rows = df_str.fillna("").values.tolist()
@@ -604,14 +773,70 @@ class CMBAgent:
                     shutil.rmtree(item_path)
 
 
-    def solve(self, task, 
+    def reset(self, work_dir=None, clear_work_dir=False):
+        """
+        Give an already built roster clean state so it can be reused for another solve() call.
+
+        Agents, hand-offs and registered functions are kept as they are. Chat histories and
+        per-agent cost records are cleared, and the roster is rebound to ``work_dir`` if given.
+
+        Args:
+            work_dir (str, optional): New working directory. Defaults to the current one.
+            clear_work_dir (bool, optional): Whether the next solve() call clears the work_dir.
+        """
+        if work_dir is not None and os.path.expanduser(work_dir) != self.work_dir:
+            self.work_dir = os.path.expanduser(work_dir)
+            for agent in self.agents:
+                agent.rebind_work_dir(self.work_dir)
+            if self.owns_cost_ledger:
+                self.cost_ledger = CostLedger(os.path.join(self.work_dir, "cost", ledger_filename),
+                                              budget=self.cost_ledger.budget, step_budget=self.cost_ledger.step_budget)
+
+        self.clear_work_dir_bool = clear_work_dir
+
+        for agent in self.agents:
+            try:
+                agent.agent.reset()
+            except:
+                pass
+            # costs are reported per solve() call, so start from an empty record
+            cost_dict = getattr(agent.agent, "cost_dict", None)
+            if isinstance(cost_dict, dict):
+                for key in cost_dict:
+                    cost_dict[key] = []
+            client_cache = getattr(getattr(agent.agent, "client", None), "_cmbagent_llm_cache", None)
+            if isinstance(client_cache, CacheCounter):
+                client_cache.reset_counts()
+            # the next group chat registers its own
+            hooks = agent.agent.hook_lists["process_all_messages_before_reply"]
+            hooks[:] = [hook for hook in hooks if not is_transit_hook(hook)]
+            history_compactor = getattr(agent, "history_compactor", None)
+            if history_compactor is not None:
+                history_compactor.turns.clear()
+            execution_router = getattr(agent, "execution_router", None)
+            if execution_router is not None:
+                execution_router.counts.clear()
+            local_formatter = getattr(agent, "local_formatter", None)
+            if local_formatter is not None:
+                local_formatter.counts.clear()
+
+        for attr in ("final_context", "chat_result", "last_agent", "step"):
+            if hasattr(self, attr):
+                delattr(self, attr)
+
+        if cmbagent_debug:
+            print(f'\nroster reset, work_dir: {self.work_dir}, clear_work_dir: {clear_work_dir}')
+
+
+    def solve(self, task,
               initial_agent='task_improver', 
               shared_context=None,
               mode = "default", # can be "one_shot" or "default" (default is planning and control)
               step = None,
               max_rounds=10):
         self.step = step ## record the step for the context carryover workflow 
-        this_shared_context = copy.deepcopy(self.shared_context)
+        # immutable values (docs, summaries, ...) are shared, see context.py
+        this_shared_context = fork_context(self.shared_context)
         
         if mode == "one_shot" or mode == "chat":
             one_shot_shared_context = {'final_plan': "Step 1: solve the main task.",
@@ -657,8 +882,9 @@ class CMBAgent:
         database_full_path = os.path.join(self.work_dir, this_shared_context.get("database_path", "data"))
         codebase_full_path = os.path.join(self.work_dir, this_shared_context.get("codebase_path", "codebase"))
 
-        # add the codebase to the python path so we can import modules from it
-        sys.path.append(codebase_full_path)
+        # the codebase is not added to the process-wide sys.path: scripts saved in it are
+        # run from there by the executor, so their sibling modules are importable
+        # sys.path.append(codebase_full_path)
 
         chat_full_path = os.path.join(self.work_dir, "chats")
         time_full_path = os.path.join(self.work_dir, "time")
@@ -682,9 +908,16 @@ class CMBAgent:
         this_shared_context['improved_main_task'] = task # initialize improved main task
 
         this_shared_context['work_dir'] = self.work_dir
+        # a step budget exceeded in a previous step does not carry over
+        this_shared_context['budget_exceeded'] = None
         # print('this_shared_context: ', this_shared_context)
         # sys.exit()
 
+        # make sure every agent the chat can reach is part of the group
+        # (and the terminator, that the agents hand off to when over budget)
+        over_budget_target = ['terminator'] if self.cost_ledger.budget or self.cost_ledger.step_budget else []
+        self.build_agents([initial_agent] + over_budget_target)
+
         context_variables = ContextVariables(data=this_shared_context)
 
         # Create the pattern
@@ -696,30 +929,60 @@ class CMBAgent:
                                       "name": "main_cmbagent_chat"},
             )
 
-        chat_result, context_variables, last_agent = initiate_group_chat(
-            pattern=agent_pattern,
-            messages=this_shared_context['main_task'],
-            # user_agent=self.get_agent_from_name("admin"),
-            max_rounds = max_rounds,
-        )
+        def end_chat(reason):
+            # the next agent hands off to the terminator, see hand_offs.register_budget_hand_offs
+            context_variables.set("budget_exceeded", reason)
+
+        # every message is appended to work_dir/chats/transcript.jsonl as it comes
+        transcript = TranscriptWriter(chat_full_path, compression=self.transcript_compression)
+        self.transcript_path = transcript.path
+
+        trace_name = f"step_{step}" if step is not None else mode
+        with trace_run(trace_name, self.work_dir, enabled=self.trace), \
+             self.cost_ledger.track(step, on_exceeded=end_chat), \
+             transcript.record(step if step is not None else mode):
+            chat_result, context_variables, last_agent = initiate_group_chat(
+                pattern=agent_pattern,
+                messages=this_shared_context['main_task'],
+                # user_agent=self.get_agent_from_name("admin"),
+                max_rounds = max_rounds,
+            )
 
-        self.final_context = copy.deepcopy(context_variables)
+        # the chat is over, a shallow copy is enough to detach it
+        self.final_context = ContextVariables(data=dict(context_variables.data))
 
         self.last_agent = last_agent
         self.chat_result = chat_result
 
+        execution_router = getattr(self.find_agent_object('executor_response_formatter'), 'execution_router', None)
+        if execution_router is not None and execution_router.counts:
+            print(f"post-execution routing: {execution_router.summary()}")
+        for agent in self.agents:
+            local_formatter = getattr(agent, "local_formatter", None)
+            if local_formatter is not None and local_formatter.counts:
+                print(f"{agent.name}: {local_formatter.summary()}")
+            execution_cache = getattr(getattr(getattr(agent, "agent", None), "_code_executor", None), "execution_cache", None)
+            if execution_cache is not None and execution_cache.hits + execution_cache.misses:
+                print(f"{agent.name}: {execution_cache.summary()}")
+
 
     def get_agent_object_from_name(self,name):
-        for agent in self.agents:
-            if agent.info['name'] == name:
-                return agent
+        agent = self.find_agent_object(name)
+        if agent is None and self.get_agent_class_name(name) is not None:
+            self.build_agents([name])
+            agent = self.find_agent_object(name)
+        if agent is not None:
+            return agent
         print(f"get_agent_object_from_name: agent {name} not found")
         sys.exit()
 
     def get_agent_from_name(self,name):
-        for agent in self.agents:
-            if agent.info['name'] == name:
-                return agent.agent
+        agent = self.find_agent_object(name)
+        if agent is None and self.get_agent_class_name(name) is not None:
+            self.build_agents([name])
+            agent = self.find_agent_object(name)
+        if agent is not None:
+            return agent.agent
         print(f"get_agent_from_name: agent {name} not found")
         sys.exit()
 
@@ -798,34 +1061,20 @@ class CMBAgent:
             print('self.llm_config: ', self.llm_config)
 
 
-        for agent_name  in self.agent_classes:
-            agent_class = self.agent_classes[agent_name]
-
-            if cmbagent_debug:
-                print('instantiating agent: ', agent_name)
-
-            if agent_name in agent_llm_configs:
-                llm_config = copy.deepcopy(self.llm_config)
-                llm_config['config_list'][0].update(agent_llm_configs[agent_name])
-                clean_llm_config(llm_config)
-                
-                if cmbagent_debug:
-                    print('in cmbagent.py: found agent_llm_configs for: ', agent_name)
-                    print('in cmbagent.py: llm_config updated to: ', llm_config)
-            else:
-                llm_config = copy.deepcopy(self.llm_config)
-
-            if cmbagent_debug:
-                print('in cmbagent.py BEFORE agent_instance: llm_config: ', llm_config)
-
-            agent_instance = agent_class(llm_config=llm_config,agent_type=self.agent_type, work_dir=self.work_dir)
-
-            if cmbagent_debug:
-                print('agent_type: ', agent_instance.agent_type)
-
-            # setattr(self, agent_name, agent_instance)
-
-            self.agents.append(agent_instance)
+        if self.initial_agent is None or not self.skip_rag_agents:
+            agents_to_build = list(self.agent_classes)
+        else:
+            # only build the agents that can be reached from the initial agent(s),
+            # the others are built on first use, see build_agents
+            reachable_agents = get_reachable_agents(self.initial_agent,
+                                                    self.mode,
+                                                    chat_agent=self.chat_agent,
+                                                    skip_rag_agents=self.skip_rag_agents,
+                                                    native_structured_agents=self.native_structured_agents)
+            agents_to_build = [agent_name for agent_name in self.agent_classes if agent_name in reachable_agents]
+
+        for agent_name in agents_to_build:
+            self.agents.append(self.instantiate_agent(agent_name))
 
         if self.skip_rag_agents:
             self.agents = [agent for agent in self.agents if agent.name.replace('_agent', '') not in self.rag_agent_names]
@@ -843,24 +1092,6 @@ class CMBAgent:
                 print('agent.llm_config: ', agent.llm_config)
                 print('\n\n')
 
-        for agent in self.agents:
-
-            if "formatter" in agent.name:
-
-                # print("="*10)
-                # print('\n\nagent.name BEFORE: ', agent.name)
-                # print('agent.llm_config: ', agent.llm_config)
-                # print('\n\n')
-
-                agent.llm_config['config_list'][0].update(get_model_config(default_formatter_model, self.api_keys))
-                
-                # print('\n\nagent.name AFTER: ', agent.name)
-                # print('agent.llm_config: ', agent.llm_config)
-                # print('\n\n')
-            # make sure the llm config doesnt have inconsistent parameters
-            clean_llm_config(agent.llm_config)
-
-
         if self.verbose or cmbagent_debug:
 
             print("Using following agents: ", self.agent_names)
@@ -869,6 +1100,148 @@ class CMBAgent:
                 print(f"{agent.name}: {agent.llm_config['config_list'][0]['model']}")
             print()
 
+    def instantiate_agent(self, agent_name):
+        """Instantiate the agent of class self.agent_classes[agent_name] with its llm_config."""
+        agent_class = self.agent_classes[agent_name]
+
+        if cmbagent_debug:
+            print('instantiating agent: ', agent_name)
+
+        if agent_name in self.agent_llm_configs:
+            llm_config = copy.deepcopy(self.llm_config)
+            llm_config['config_list'][0].update(self.agent_llm_configs[agent_name])
+            # not a client parameter
+            llm_config['config_list'][0].pop(native_structured_key, None)
+            clean_llm_config(llm_config)
+            
+            if cmbagent_debug:
+                print('in cmbagent.py: found agent_llm_configs for: ', agent_name)
+                print('in cmbagent.py: llm_config updated to: ', llm_config)
+        else:
+            llm_config = copy.deepcopy(self.llm_config)
+
+        if agent_name in self.native_structured_agents:
+            llm_config['config_list'][0]['response_format'] = get_native_response_format(agent_name)
+
+        if cmbagent_debug:
+            print('in cmbagent.py BEFORE agent_instance: llm_config: ', llm_config)
+
+        agent_instance = agent_class(llm_config=llm_config,agent_type=self.agent_type, work_dir=self.work_dir)
+        if agent_name in self.native_structured_agents:
+            agent_instance.info["instructions"] += native_structured_instructions[agent_name]
+        agent_instance.code_executor = self.code_executor
+        agent_instance.kernel_options = self.kernel_options
+        agent_instance.forkserver_preload = self.forkserver_preload
+        agent_instance.static_check = self.static_check
+        agent_instance.execution_cache = self.execution_cache
+        if self.execution_cache and agent_name == 'engineer':
+            agent_instance.info["instructions"] += memoize_instructions
+
+        if cmbagent_debug:
+            print('agent_type: ', agent_instance.agent_type)
+
+        if "formatter" in agent_instance.name:
+
+            agent_instance.llm_config['config_list'][0].update(get_model_config(self.default_formatter_model, self.api_keys))
+
+        # make sure the llm config doesnt have inconsistent parameters
+        clean_llm_config(agent_instance.llm_config)
+
+        return agent_instance
+
+
+    def get_agent_class_name(self, name):
+        """Key of self.agent_classes for the agent called name (rag agents are stored without the _agent suffix)."""
+        if name in self.agent_classes:
+            return name
+        if name.removesuffix('_agent') in self.rag_agent_names and name.removesuffix('_agent') in self.agent_classes:
+            if self.skip_rag_agents:
+                return None
+            return name.removesuffix('_agent')
+        return None
+
+
+    def find_agent_object(self, name):
+        """Return the agent object called name if it has been built, None otherwise."""
+        for agent in self.agents:
+            if agent.info['name'] == name:
+                return agent
+        return None
+
+
+    def build_agents(self, names):
+        """
+        Build the agents in names and all the agents they can hand off to, if not built yet.
+
+        Agents built after the roster has been set up get their hand-offs and functions
+        registered here.
+        """
+        reachable_agents = get_reachable_agents(names,
+                                                self.mode,
+                                                chat_agent=self.chat_agent,
+                                                skip_rag_agents=self.skip_rag_agents,
+                                                native_structured_agents=self.native_structured_agents)
+
+        new_agents = []
+        for name in sorted(reachable_agents):
+            if self.find_agent_object(name) is not None:
+                continue
+            agent_class_name = self.get_agent_class_name(name)
+            if agent_class_name is None:
+                continue
+            agent = self.instantiate_agent(agent_class_name)
+            self.agents.append(agent)
+            self.agent_names.append(agent.name)
+            new_agents.append(agent)
+
+        if not new_agents:
+            return
+
+        if cmbagent_debug:
+            print('\nbuilding agents on first use: ', [agent.name for agent in new_agents])
+
+        for agent in new_agents:
+            self.set_agent(agent)
+
+        if getattr(self, "hand_offs_registered", False):
+            new_agent_names = [agent.name for agent in new_agents]
+            register_all_hand_offs(self, agent_names=new_agent_names)
+            register_functions_to_agents(self, agent_names=new_agent_names)
+
+
+    def wrap_agent_client(self, agent):
+        """
+        Cost tracking, LLM cache and (with trace) request spans on the client of an autogen agent.
+        Autogen builds a new client whenever tools are registered (also when the group chat is
+        prepared), so the client is wrapped again, if needed, before each request.
+        """
+        if getattr(agent, "_cmbagent_client_wrapped", False):
+            return
+        agent._cmbagent_client_wrapped = True
+        # one counter per agent, kept across the rebuilt clients
+        cache_counter = CacheCounter(self.llm_cache) if self.llm_cache is not None else None
+
+        def wrap():
+            track_agent_costs(agent)
+            if cache_counter is not None:
+                # in front of the cost tracking, so replayed responses are not charged
+                cache_agent_client(agent, cache_counter)
+            if self.trace:
+                # outermost, the span covers what the agent waits for
+                trace_agent_client(agent)
+
+        generate_from_client = agent._generate_oai_reply_from_client
+
+        @functools.wraps(generate_from_client)
+        def generate_from_wrapped_client(llm_client, messages, cache):
+            if llm_client is agent.client:
+                wrap()
+            return generate_from_client(llm_client, messages, cache)
+
+        agent._generate_oai_reply_from_client = generate_from_wrapped_client
+        wrap()
+
+
     def create_assistant(self, client, agent):
 
         if cmbagent_debug:
@@ -1076,6 +1449,22 @@ def planning_and_control_context_carryover(
                             restart_at_step = -1,   ## if -1 or 0, do not restart. if 1, restart from step 1, etc.
                             clear_work_dir = False,
                             researcher_filename = shared_context_default['researcher_filename'],
+                            warm_roster = True, ## if True, the control agents are built once and reset between plan steps
+                            max_parallel_steps = 4, ## plan steps whose dependencies are done run concurrently, at most this many at a time (1: one after the other)
+                            budget = None, ## limits on the tokens/dollars/wall time of the whole run, e.g. {'max_cost': 5.0}, see cost_ledger.py
+                            step_budget = None, ## same, for the planning phase and for each plan step
+                            max_summary_tokens = None, ## token budget of previous_steps_execution_summary (None: all step summaries verbatim), see summary_compaction.py
+                            keep_recent_summaries = 2, ## number of most recent step summaries kept verbatim within max_summary_tokens
+                            history_compaction = None, ## compact the older messages seen by engineer/control/researcher in each step (True or dict), see message_transforms.py
+                            transcript_compression = None, ## None, "gzip" or "zstd": compression of the chat transcripts, see transcripts.py
+                            code_executor = "local", ## "forkserver" or "kernel" to run the engineer code in a pre-imported fork or a warm kernel, see execution/
+                            kernel_options = None, ## e.g. {'memory_limit_mb': 8000, 'clean_namespace': False, 'persist_across_steps': True}
+                            forkserver_preload = None, ## e.g. ['local', 'astro', 'data'], see execution/forkserver.py
+                            rule_based_routing = False, ## route the execution results by rules, without the executor_response_formatter llm call when clear, see execution_routing.py
+                            local_formatting = False, ## parse the engineer/planner/reviewer replies locally, without the formatter llm call when they parse, see local_formatting.py
+                            native_structured_agents = None, ## e.g. ['engineer', 'planner']: these agents answer in structured output, without their formatter, see native_structured.py
+                            static_check = None, ## True: check the code (syntax, undefined names, missing modules) before running it, see execution/static_check.py
+                            execution_cache = None, ## True: replay identical executions (same code and data files) from a cache, see execution/result_cache.py
                             ):
 
     # Create work directory if it doesn't exist
@@ -1090,6 +1479,23 @@ def planning_and_control_context_carryover(
 
     print("Created context directory: ", context_dir)
 
+    # per-step context deltas, see checkpoints.py
+    checkpoints = CheckpointStore(context_dir)
+
+    # older step summaries are compressed once and cached in the context dir, see summary_compaction.py
+    summary_compactor = None
+    if max_summary_tokens is not None:
+        summary_compactor = StepSummaryCompactor(max_tokens = max_summary_tokens,
+                                                 keep_recent = keep_recent_summaries,
+                                                 cache_path = context_dir / summary_cache_filename)
+
+    def join_step_summaries():
+        if summary_compactor is None:
+            return "\n\n".join(step_summaries[j] for j in sorted(step_summaries))
+        return summary_compactor.compact(step_summaries)
+
+    # one ledger for the planning and all the plan steps, so the run budget covers them all
+    cost_ledger = CostLedger(os.path.join(work_dir, ledger_filename), budget = budget, step_budget = step_budget)
 
     if api_keys is None:
         api_keys = get_api_keys_from_env()
@@ -1111,13 +1517,16 @@ def planning_and_control_context_carryover(
     
 
         cmbagent = CMBAgent(work_dir = planning_dir,
+                            initial_agent = "plan_setter",
                             default_llm_model = default_llm_model,
                             default_formatter_model = default_formatter_model,
-                            agent_llm_configs = {
+                            agent_llm_configs = select_native_structured({
                                 'planner': planner_config,
                                 'plan_reviewer': plan_reviewer_config,
-                            },
-                            api_keys = api_keys
+                            }, native_structured_agents),
+                            api_keys = api_keys,
+                            cost_ledger = cost_ledger,
+                            local_formatting = local_formatting
                             )
         end_time = time.time()
         initialization_time_planning = end_time - start_time
@@ -1148,7 +1557,7 @@ def planning_and_control_context_carryover(
         # Now call display_cost without triggering the AttributeError
         cmbagent.display_cost()
 
-        planning_output = copy.deepcopy(cmbagent.final_context)
+        planning_output = ContextVariables(data=dict(cmbagent.final_context.data))
         
         # OLLAMA FIX: If final_plan is None, extract from chat history
         if planning_output.get('final_plan') is None or planning_output.get('number_of_steps_in_plan') is None:
@@ -1170,11 +1579,11 @@ def planning_and_control_context_carryover(
         print(f"\nStructured plan written to {outfile}")
         print(f"\nPlanning took {execution_time_planning:.4f} seconds\n")
 
-        context_path = os.path.join(context_dir, "context_step_0.pkl") # save the initial context (0: planning)
-        # with open(context_path, 'w') as f:
-        #     json.dump(current_context, f, indent=2)
-        with open(context_path, 'wb') as f:
-            pickle.dump(cmbagent.final_context, f)
+        # save the initial context (0: planning)
+        # context_path = os.path.join(context_dir, "context_step_0.pkl")
+        # with open(context_path, 'wb') as f:
+        #     pickle.dump(cmbagent.final_context, f)
+        checkpoints.write_step(0, cmbagent.final_context)
         # Save timing report as JSON
         timing_report = {
             'initialization_time_planning': initialization_time_planning,
@@ -1214,7 +1623,20 @@ def planning_and_control_context_carryover(
 
     # current_context = copy.deepcopy(planning_output) if restart_at_step <= 0 else load_context(os.path.join(context_dir, f"context_step_{restart_at_step-1}.pkl"))
     # number_of_steps_in_plan = current_context['number_of_steps_in_plan']
-    current_context = copy.deepcopy(planning_output) if restart_at_step <= 0 else load_context(os.path.join(context_dir, f"context_step_{restart_at_step-1}.pkl"))
+    # copy-on-write store: steps fork it and commit back only the keys that changed
+    if restart_at_step <= 0:
+        restart_context = planning_output
+    elif checkpoints.has_step(restart_at_step - 1):
+        # replay the deltas up to the last step checkpointed before restart_at_step
+        # (steps run concurrently can finish, and be checkpointed, out of order)
+        checkpoint_records = checkpoints.records()
+        restart_from = max((j for j in checkpoint_records if j < restart_at_step),
+                           key = lambda j: checkpoint_records[j]["time"])
+        restart_context = checkpoints.load_step(restart_from)
+    else:
+        # run checkpointed with pickles
+        restart_context = load_context(os.path.join(context_dir, f"context_step_{restart_at_step-1}.pkl"))
+    current_context = ContextStore(restart_context)
     number_of_steps_in_plan = current_context.get('number_of_steps_in_plan')
     
     # OLLAMA FIX: If number_of_steps is None, try to recover from final_plan.json
@@ -1243,12 +1665,39 @@ def planning_and_control_context_carryover(
                 print("This is likely due to the local model not properly calling recording functions.")
                 raise ValueError("Planning phase completed but no plan was recorded. Try using a model with better function calling support.")
     
-    step_summaries = []  
+    # steps whose dependencies are done can run side by side, see plan_dag.py
+    plan_input = load_plan(os.path.join(work_dir, "planning/final_plan.json"))["sub_tasks"]
+    plan_input = (plan_input + [{}] * number_of_steps_in_plan)[:number_of_steps_in_plan]
+    step_dependencies = get_step_dependencies(plan_input)
+    # a plan without independent steps runs as before: one step after the other, in control_dir
+    branched = max_parallel_steps > 1 and not is_sequential(step_dependencies)
+    if branched:
+        longest_chain, _ = critical_path(step_dependencies)
+        print(f"Plan steps run concurrently (at most {max_parallel_steps} at a time), longest chain of dependent steps: {longest_chain}")
+        if restart_at_step <= 0:
+            clean_work_dir(control_dir)
+
+    step_summaries = {}
+    step_results = {}
+    # control rosters that are not running a step, reused by the next steps when warm_roster is True
+    idle_rosters = []
+    rosters_lock = threading.Lock()
     # print("in cmbagent.py: current_context before step loop: ", current_context)
     initial_step = 1 if restart_at_step <= 0 else restart_at_step
-    for step in range(initial_step, number_of_steps_in_plan + 1):
-        clear_work_dir = True if step == 1 and restart_at_step <= 0 else False ## not fully sure what is the best thing to do, but this is OK for now.
-        starter_agent = "control" if step == 1 else "control_starter"
+
+    # data and codebase folders of the steps run concurrently, see plan_dag.py
+    shared_dirs = [current_context['database_path'], current_context['codebase_path']]
+
+    def run_control_step(step):
+        if branched:
+            # own chats/cost/time/context, with links to the data and codebase of the steps it depends on
+            step_dir = make_branch_work_dir(control_dir / "branches" / f"step_{step}", control_dir, shared_dirs)
+            clear_work_dir = False
+            starter_agent = "control"
+        else:
+            step_dir = control_dir
+            clear_work_dir = True if step == 1 and restart_at_step <= 0 else False ## not fully sure what is the best thing to do, but this is OK for now.
+            starter_agent = "control" if step == 1 else "control_starter"
         # print(f"in cmbagent.py: step: {step}/{number_of_steps_in_plan}")
         # print("\n\n")
         # print("current_context['previous_steps_execution_summary']: ", current_context['previous_steps_execution_summary'] )
@@ -1256,22 +1705,39 @@ def planning_and_control_context_carryover(
 
 
         start_time = time.time()
-        cmbagent = CMBAgent(
-            work_dir = control_dir,
-            clear_work_dir = clear_work_dir,
-            default_llm_model = default_llm_model,
-            default_formatter_model = default_formatter_model,
-            agent_llm_configs = {
-                                'engineer': engineer_config,
-                                'researcher': researcher_config,
-                                'idea_maker': idea_maker_config,
-                                'idea_hater': idea_hater_config,
-                                'camb_context': camb_context_config,
-                                'plot_judge': plot_judge_config,
-            },
-            mode = "planning_and_control_context_carryover",
-            api_keys = api_keys
-            )
+        with rosters_lock:
+            cmbagent = idle_rosters.pop() if warm_roster and idle_rosters else None
+        if cmbagent is not None:
+            # reuse the agents and hand-offs built for a previous step
+            cmbagent.reset(work_dir = step_dir, clear_work_dir = clear_work_dir)
+        else:
+            cmbagent = CMBAgent(
+                initial_agent = ["control", "control_starter"],
+                work_dir = step_dir,
+                clear_work_dir = clear_work_dir,
+                default_llm_model = default_llm_model,
+                default_formatter_model = default_formatter_model,
+                agent_llm_configs = select_native_structured({
+                                    'engineer': engineer_config,
+                                    'researcher': researcher_config,
+                                    'idea_maker': idea_maker_config,
+                                    'idea_hater': idea_hater_config,
+                                    'camb_context': camb_context_config,
+                                    'plot_judge': plot_judge_config,
+                }, native_structured_agents),
+                mode = "planning_and_control_context_carryover",
+                api_keys = api_keys,
+                cost_ledger = cost_ledger,
+                history_compaction = history_compaction,
+                transcript_compression = transcript_compression,
+                code_executor = code_executor,
+                kernel_options = kernel_options,
+                forkserver_preload = forkserver_preload,
+                rule_based_routing = rule_based_routing,
+                local_formatting = local_formatting,
+                static_check = static_check,
+                execution_cache = execution_cache
+                )
         
 
         # print(f"in cmbagent.py: idea_maker_config: {idea_maker_config}")
@@ -1280,9 +1746,8 @@ def planning_and_control_context_carryover(
         end_time = time.time()
         initialization_time_control = end_time - start_time
         
-        if step == 1:
-            plan_input = load_plan(os.path.join(work_dir, "planning/final_plan.json"))["sub_tasks"]
-            agent_for_step = plan_input[0]['sub_task_agent']
+        if step == 1 or branched:
+            agent_for_step = plan_input[step - 1]['sub_task_agent']
         else:
             agent_for_step = current_context['agent_for_sub_task']
         
@@ -1291,11 +1756,19 @@ def planning_and_control_context_carryover(
         # import sys 
         # sys.exit()
 
-        parsed_context = copy.deepcopy(current_context)
+        # the step commits back only what it changed since this snapshot
+        with current_context.lock:
+            context_base = current_context.snapshot()
+            parsed_context = current_context.fork()
 
         parsed_context["agent_for_sub_task"] = agent_for_step
         parsed_context["current_plan_step_number"] = step
         parsed_context["n_attempts"] = 0 ## reset number of failures for each step. 
+        if branched:
+            # control starts the step from the plan, not from the status left by the previous step
+            parsed_context["current_status"] = "in progress"
+            parsed_context["current_sub_task"] = plan_input[step - 1].get('sub_task', parsed_context.get('current_sub_task'))
+            parsed_context["current_instructions"] = "\n".join(f"- {bullet}" for bullet in plan_input[step - 1].get('bullet_points', []))
         # print(f"\nin cmbagent.py: agent_for_step {step}: {agent_for_step}")
         # print("xo"*100+"\n\n")
         # print("in cmbagent.py: parsed_context: ", parsed_context["final_plan"])
@@ -1318,6 +1791,23 @@ def planning_and_control_context_carryover(
         end_time = time.time()
         execution_time_control = end_time - start_time
 
+        return {'cmbagent': cmbagent,
+                'step_dir': step_dir,
+                'agent_for_step': agent_for_step,
+                'context_base': context_base,
+                'initialization_time_control': initialization_time_control,
+                'execution_time_control': execution_time_control}
+
+    def finish_control_step(step, step_output):
+        cmbagent = step_output['cmbagent']
+        agent_for_step = step_output['agent_for_step']
+        initialization_time_control = step_output['initialization_time_control']
+        execution_time_control = step_output['execution_time_control']
+
+        if branched:
+            # the files written by the step go to control_dir, for the steps that depend on it
+            merge_branch_work_dir(step_output['step_dir'], control_dir, shared_dirs)
+
         # number of failures:
 
         number_of_failures = cmbagent.final_context['n_attempts']
@@ -1325,10 +1815,15 @@ def planning_and_control_context_carryover(
         
         results = {'chat_history': cmbagent.chat_result.chat_history,
                    'final_context': cmbagent.final_context}
+        # only the results of the last step of the plan are returned (steps can finish out of order):
+        # the histories of the other steps are not kept in memory, they are in the transcript
+        if not step_results or step > max(step_results):
+            step_results.clear()
+            step_results[step] = results
         
         if number_of_failures >= cmbagent.final_context['max_n_attempts']:
             print(f"in cmbagent.py: number of failures: {number_of_failures} >= max_n_attempts: {cmbagent.final_context['max_n_attempts']}. Exiting.")
-            break
+            return False
         # print("_"*100+"\n\n")
         # print("in cmbagent.py: collecting step summaries for step: ", step)
         for msg in results['chat_history'][::-1]:
@@ -1342,12 +1837,22 @@ def planning_and_control_context_carryover(
                     this_step_execution_summary = msg['content']
                     # build this step’s summary
                     summary = f"### Step {step}\n{this_step_execution_summary.strip()}"
-                    step_summaries.append(summary)  
-                    cmbagent.final_context['previous_steps_execution_summary'] = "\n\n".join(step_summaries)
+                    step_summaries[step] = summary
+                    # in dependency order (a step only depends on earlier steps), whatever order the steps finished in
+                    cmbagent.final_context['previous_steps_execution_summary'] = join_step_summaries()
                     break
         # print("in cmbagent.py: step_summaries: ", step_summaries)
         # print("_"*100+"\n\n")
-        current_context = copy.deepcopy(cmbagent.final_context)
+        if branched:
+            # steps that ran side by side each commit only their own changes
+            with current_context.lock:
+                context_delta = current_context.commit(cmbagent.final_context, base = step_output['context_base'])
+                current_context['previous_steps_execution_summary'] = join_step_summaries() or current_context.get('previous_steps_execution_summary')
+                current_context['work_dir'] = str(control_dir)
+        else:
+            context_delta = current_context.commit(cmbagent.final_context)
+        if cmbagent_debug:
+            print(f"step {step} changed context keys: {list(context_delta)}")
 
         
         results['initialization_time_control'] = initialization_time_control
@@ -1364,7 +1869,7 @@ def planning_and_control_context_carryover(
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         
         # Save to JSON file in workdir
-        timing_path = os.path.join(current_context['work_dir'], f"time/timing_report_step_{step}_{timestamp}.json")
+        timing_path = os.path.join(cmbagent.final_context['work_dir'], f"time/timing_report_step_{step}_{timestamp}.json")
         with open(timing_path, 'w') as f:
             json.dump(timing_report, f, indent=2)
         
@@ -1379,21 +1884,30 @@ def planning_and_control_context_carryover(
         # Now call display_cost without triggering the AttributeError
         cmbagent.display_cost(name_append = f"step_{step}")
 
-        ## save the chat history and the final context
-        chat_full_path = os.path.join(current_context['work_dir'], "chats")
-        os.makedirs(chat_full_path, exist_ok=True)
-        chat_output_path = os.path.join(chat_full_path, f"chat_history_step_{step}.json")
-        with open(chat_output_path, 'w') as f:
-            json.dump(results['chat_history'], f, indent=2)
-        context_path = os.path.join(context_dir, f"context_step_{step}.pkl")
-        # with open(context_path, 'w') as f:
-        #     json.dump(current_context, f, indent=2)
-        with open(context_path, 'wb') as f:
-            pickle.dump(cmbagent.final_context, f)
+        # the chat history was written to the transcript as the messages came, see transcripts.py
+        print(f"\nChat history of step {step} saved to: {cmbagent.transcript_path}\n")
+        # checkpointed as soon as the step is done, with the steps done before it
+        checkpoints.write_step(step, current_context)
+
+        with rosters_lock:
+            idle_rosters.append(cmbagent)
+
+        if cost_ledger.exceeded is not None:
+            print(f"in cmbagent.py: {cost_ledger.exceeded}. No further plan steps are started.")
+            return False
 
         # if step == 4:
         #     break
 
+    run_plan_steps(step_dependencies,
+                   run_control_step,
+                   on_step_done = finish_control_step,
+                   max_parallel_steps = max_parallel_steps if branched else 1,
+                   done = range(1, initial_step))
+
+    # results of the last step of the plan
+    results = step_results[max(step_results)] if step_results else None
+
     ## delete empty folders during planning
     database_full_path = os.path.join(current_context['work_dir'], current_context['database_path'])
     codebase_full_path = os.path.join(current_context['work_dir'], current_context['codebase_path'])
@@ -1450,6 +1964,7 @@ def planning_and_control(
     plan_reviewer_config = get_model_config(plan_reviewer_model, api_keys)
     
     cmbagent = CMBAgent(work_dir = planning_dir,
+                        initial_agent = "plan_setter",
                         default_llm_model = default_llm_model,
                         default_formatter_model = default_formatter_model,
                         agent_llm_configs = {
@@ -1489,7 +2004,7 @@ def planning_and_control(
     # Now call display_cost without triggering the AttributeError
     cmbagent.display_cost()
 
-    planning_output = copy.deepcopy(cmbagent.final_context)
+    planning_output = ContextVariables(data=dict(cmbagent.final_context.data))
     outfile = save_final_plan(planning_output, planning_dir)
     print(f"Structured plan written to {outfile}")
     print(f"Planning took {execution_time_planning:.4f} seconds")
@@ -1529,6 +2044,7 @@ def planning_and_control(
 
     start_time = time.time()
     cmbagent = CMBAgent(
+        initial_agent = "control",
         work_dir = control_dir,
         default_llm_model = default_llm_model,
         default_formatter_model = default_formatter_model,
@@ -1711,7 +2227,9 @@ def summarize_document(markdown_document_path,
                        work_dir = work_dir_default, 
                        clear_work_dir = True,
                        summarizer_model = default_agents_llm_model['summarizer'],
-                       summarizer_response_formatter_model = default_agents_llm_model['summarizer_response_formatter']):
+                       summarizer_response_formatter_model = default_agents_llm_model['summarizer_response_formatter'],
+                       default_llm_model = default_llm_model_default,
+                       default_formatter_model = default_formatter_model_default):
     
     api_keys = get_api_keys_from_env()
     # load the document from the document_path to markdown file:
@@ -1728,11 +2246,14 @@ def summarize_document(markdown_document_path,
     summarizer_config = get_model_config(summarizer_model, api_keys)
     summarizer_response_formatter_config = get_model_config(summarizer_response_formatter_model, api_keys)
     cmbagent = CMBAgent(
+        initial_agent = "summarizer",
         work_dir = work_dir,
         agent_llm_configs = {
                             'summarizer': summarizer_config,
                             'summarizer_response_formatter': summarizer_response_formatter_config,
         },
+        default_llm_model = default_llm_model,
+        default_formatter_model = default_formatter_model,
         api_keys = api_keys,
     )
 
@@ -2089,6 +2610,7 @@ def control(
 
     start_time = time.time()
     cmbagent = CMBAgent(
+        initial_agent = "control",
         work_dir = control_dir,
         agent_llm_configs = {
                             'engineer': engineer_config,
@@ -2169,6 +2691,10 @@ def one_shot(
             evaluate_plots = False,
             max_n_plot_evals = 1,
             inject_wrong_plot: bool | str = False,
+            budget = None, # limits on the tokens/dollars/wall time, e.g. {'max_cost': 1.0}, see cost_ledger.py
+            native_structured_agents = None, # e.g. ['engineer']: these agents answer in structured output, without their formatter, see native_structured.py
+            static_check = None, # True: check the code (syntax, undefined names, missing modules) before running it, see execution/static_check.py
+            execution_cache = None, # True: replay identical executions (same code and data files) from a cache, see execution/result_cache.py
             ):
     start_time = time.time()
     work_dir = os.path.expanduser(work_dir)
@@ -2184,19 +2710,23 @@ def one_shot(
 
     
     cmbagent = CMBAgent(
+        initial_agent = agent,
         mode = "one_shot",
         work_dir = work_dir,
-        agent_llm_configs = {
+        agent_llm_configs = select_native_structured({
                             'engineer': engineer_config,
                             'researcher': researcher_config,
                             'plot_judge': plot_judge_config,
                             'camb_context': camb_context_config,    
-        },
+        }, native_structured_agents),
         clear_work_dir = clear_work_dir,
         api_keys = api_keys,
 
         default_llm_model = default_llm_model,
         default_formatter_model = default_formatter_model,
+        budget = budget,
+        static_check = static_check,
+        execution_cache = execution_cache,
         )
         
     end_time = time.time()
@@ -2318,6 +2848,7 @@ def human_in_the_loop(task,
     researcher_config = get_model_config(researcher_model, api_keys)
 
     cmbagent = CMBAgent(
+        initial_agent = agent,
         work_dir = work_dir,
         agent_llm_configs = {
                             'engineer': engineer_config,
@@ -2450,7 +2981,7 @@ def get_keywords(input_text: str, n_keywords: int = 5,
 
 def get_keywords_from_aaai(input_text, n_keywords=6, work_dir=work_dir_default, api_keys=get_api_keys_from_env()):
     start_time = time.time()
-    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys)
+    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys, initial_agent = 'aaai_keywords_finder')
     end_time = time.time()
     initialization_time = end_time - start_time
 
@@ -2514,7 +3045,7 @@ def get_keywords_from_aaai(input_text, n_keywords=6, work_dir=work_dir_default,
 
 def get_keywords_from_string(input_text,keywords_string, n_keywords, work_dir, api_keys):
     start_time = time.time()
-    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys)
+    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys, initial_agent = 'list_keywords_finder')
     end_time = time.time()
     initialization_time = end_time - start_time
 
@@ -2586,7 +3117,7 @@ def get_aas_keywords(input_text: str, n_keywords: int = 5,
         dict: Dictionary of keywords
     """
     start_time = time.time()
-    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys)
+    cmbagent = CMBAgent(work_dir = work_dir, api_keys = api_keys, initial_agent = 'aas_keyword_finder')
     end_time = time.time()
     initialization_time = end_time - start_time
 
@@ -2600,7 +3131,7 @@ def get_aas_keywords(input_text: str, n_keywords: int = 5,
             mode = "one_shot",
             shared_context={
             'text_input_for_AAS_keyword_finder': PROMPT,
-            'AAS_keywords_string': AAS_keywords_string,
+            'AAS_keywords_string': get_aas_keywords_string(),
             'N_AAS_keywords': n_keywords,
                             }
             )
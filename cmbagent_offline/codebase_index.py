@@ -0,0 +1,168 @@
+# cmbagent/codebase_index.py
+#
+# Incremental docstring index of the codebase directory.
+#
+# record_status and record_status_starter show the functions available in the
+# codebase to control at every turn. Instead of re-reading and parsing every
+# module each time, the parsed docstrings and the rendered fragment of each
+# module are kept in an index (in memory and in <codebase>/.codebase_index.json)
+# keyed by path, mtime, size and content hash. Only files that changed are parsed.
+import os
+import json
+import hashlib
+import threading
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+# bump this when the layout of the index or of the fragments changes
+INDEX_VERSION = 1
+
+index_filename = ".codebase_index.json"
+
+# in-memory indexes, keyed by codebase directory
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def render_module_docstrings(module, info):
+    """Fragment of current_codebase for one module."""
+    output_str = ""
+    output_str += "-----------\n"
+    output_str += f"Filename: {module}.py\n"
+    output_str += f"File path: {info['file_path']}\n\n"
+
+    # Show parse errors (if any) ✨
+    if "error" in info:
+        output_str += f"⚠️  Parse error: {info['error']}\n\n"
+
+    output_str += "Available functions:\n"
+
+    if info["functions"]:                          # non-empty dict
+        for func, doc in info["functions"].items():
+            output_str += f"function name: {func}\n"
+            output_str += "````\n"
+            output_str += f"{doc or '(no docstring)'}\n"
+            output_str += "````\n\n"
+    else:
+        output_str += "(none)\n\n"
+    return output_str
+
+
+class CodebaseIndex:
+    """Docstrings and rendered fragments of the modules of a codebase directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, index_filename)
+        # file name -> {"mtime", "size", "hash", "info", "fragment"}
+        self.entries = {}
+        # plan steps run concurrently share the index of their codebase
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get("version") == INDEX_VERSION:
+            self.entries = index["entries"]
+
+    def save(self):
+        with self.lock:
+            # plan steps run concurrently can share the codebase
+            tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump({"version": INDEX_VERSION, "entries": self.entries}, f)
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                if cmbagent_debug:
+                    print(f"could not write codebase index {self.index_path}: {e}")
+
+    def parse(self, file_path, content):
+        from .functions import extract_functions_docstrings_from_file
+        try:
+            return extract_functions_docstrings_from_file(file_path, source=content.decode("utf-8"))
+        except Exception as err:
+            return {
+                "file_path": file_path,
+                "functions": {},               # ALWAYS a dict
+                "error": f"{err.__class__.__name__}: {err}",
+            }
+
+    def update(self):
+        """Bring the index up to date with the directory. Returns the number of re-parsed files."""
+        with self.lock:
+            n_parsed = 0
+            changed = False
+            seen = []
+
+            with os.scandir(self.directory) as it:
+                for dir_entry in it:
+                    file = dir_entry.name
+                    if not file.endswith(".py") or file.startswith("__") or not dir_entry.is_file():
+                        continue
+                    seen.append(file)
+                    stat = dir_entry.stat()
+                    entry = self.entries.get(file)
+
+                    if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                        continue
+
+                    with open(dir_entry.path, "rb") as f:
+                        content = f.read()
+                    content_hash = hashlib.sha256(content).hexdigest()
+                    changed = True
+
+                    # touched but unchanged
+                    if entry is not None and entry["hash"] == content_hash:
+                        entry["mtime"] = stat.st_mtime_ns
+                        entry["size"] = stat.st_size
+                        continue
+
+                    info = self.parse(dir_entry.path, content)
+                    self.entries[file] = {
+                        "mtime": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "hash": content_hash,
+                        "info": info,
+                        "fragment": render_module_docstrings(file[:-3], info),
+                    }
+                    n_parsed += 1
+
+            # keep the directory order, as os.listdir did
+            if list(self.entries) != seen:
+                changed = True
+                self.entries = {file: self.entries[file] for file in seen}
+
+            if changed:
+                self.save()
+
+            if cmbagent_debug:
+                print(f"codebase index {self.directory}: {len(seen)} modules, {n_parsed} re-parsed")
+
+            return n_parsed
+
+    def docstrings(self):
+        """Same as load_docstrings: module name -> {"file_path", "functions"[, "error"]}."""
+        with self.lock:
+            return {file[:-3]: entry["info"] for file, entry in self.entries.items()}
+
+    def render(self):
+        """The current_codebase string."""
+        with self.lock:
+            return "".join(entry["fragment"] for entry in self.entries.values())
+
+
+def get_codebase_index(directory):
+    """Up-to-date index of directory, kept in memory across control turns."""
+    key = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CodebaseIndex(directory)
+    index.update()
+    return index
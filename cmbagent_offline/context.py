@@ -1,3 +1,6 @@
+import copy
+import threading
+
 shared_context = {
 
     "plans": [],
@@ -55,6 +58,7 @@ shared_context = {
 
     "n_attempts": 0, ## the number of failed attempts
     "max_n_attempts": 3,
+    "budget_exceeded": None, ## set to the reason when a cost/time budget is exceeded, see cost_ledger.py
 
 
     "camb_context": None,
@@ -75,3 +79,125 @@ shared_context = {
     "plot_fixes": [],
     "vlm_plot_structured_feedback": None,
 }
+
+
+# Copy-on-write helpers for the shared context.
+#
+# The context can hold large values (camb_context/classy_context docs, step
+# summaries, plans, cost tables). Immutable values are shared by reference
+# between copies of the context; only mutable containers are copied, and only
+# their structure (the strings they hold are shared).
+
+_immutable_types = (str, bytes, int, float, complex, bool, type(None), frozenset, range)
+
+
+def is_immutable(value):
+    if isinstance(value, _immutable_types):
+        return True
+    if type(value) is tuple:
+        return all(is_immutable(v) for v in value)
+    return False
+
+
+def copy_context_value(value):
+    """Copy of a context value that can be mutated without affecting the original."""
+    if is_immutable(value):
+        return value
+    if type(value) is list:
+        return [copy_context_value(v) for v in value]
+    if type(value) is dict:
+        return {k: copy_context_value(v) for k, v in value.items()}
+    if type(value) is tuple:
+        return tuple(copy_context_value(v) for v in value)
+    if type(value) is set:
+        return set(value)
+    # dataframes, pydantic models, ...
+    return copy.deepcopy(value)
+
+
+def fork_context(context):
+    """
+    Mutable copy of a context (dict or ContextVariables) as a dict.
+    Immutable values are shared with the original.
+    """
+    data = getattr(context, "data", context)
+    return {key: copy_context_value(value) for key, value in data.items()}
+
+
+def _unchanged(old, new):
+    if old is new:
+        return True
+    if is_immutable(new):
+        # an equal value rebuilt by the step (a str, a large int, ...), cheap to compare
+        return type(old) is type(new) and old == new
+    try:
+        return bool(old == new)
+    except Exception: # e.g. dataframes
+        return False
+
+
+class ContextStore:
+    """
+    Committed context of a multi-step run.
+
+    Steps work on fork()s of the store and commit() their final context back.
+    The store never mutates the values it holds, so forks only copy the mutable
+    values and a commit only replaces the keys that changed.
+
+    Steps run side by side fork from worker threads while the finished ones commit:
+    hold lock to take a snapshot() and a fork() of the same committed values.
+    """
+
+    def __init__(self, context=None):
+        self.data = {}
+        self.version = 0
+        self.lock = threading.RLock()
+        if context is not None:
+            self.commit(context)
+
+    def fork(self):
+        with self.lock:
+            return fork_context(self.data)
+
+    def snapshot(self):
+        """The committed values as they are now, to commit() a fork against later."""
+        with self.lock:
+            return dict(self.data)
+
+    def commit(self, context, base=None):
+        """
+        Take the values of context that changed. Returns them as a dict (the delta).
+
+        With base (a snapshot() taken when context was forked), only the keys that
+        changed since base are taken, so forks run side by side do not undo each
+        other's commits.
+        """
+        data = getattr(context, "data", context)
+        with self.lock:
+            reference = self.data if base is None else base
+            delta = {key: value for key, value in data.items()
+                     if key not in reference or not _unchanged(reference[key], value)}
+            for key in [key for key in reference if key not in data]:
+                self.data.pop(key, None)
+            self.data.update(delta)
+            self.version += 1
+        return delta
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = value
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def keys(self):
+        return self.data.keys()
+
+    def items(self):
+        return self.data.items()
@@ -0,0 +1,251 @@
+# cmbagent/cost_ledger.py
+#
+# Append-only cost ledger: one json line per completion, written as it arrives
+# (LLM requests of the agents, and the external VLM/LLM calls accounted for by
+# vlm_utils.account_for_external_api_calls), with live aggregates per agent,
+# per model and per plan step.
+#
+# Budgets (tokens, dollars, wall time) are checked at every record, for the run
+# and for the current step. When one is exceeded, the budget_exceeded context
+# variable is set, and the next agent to speak hands off to the terminator (see
+# hand_offs.register_budget_hand_offs), which ends the chat cleanly.
+import os
+import json
+import time
+import threading
+import functools
+import contextvars
+import contextlib
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+ledger_filename = "cost_ledger.jsonl"
+
+# (ledger, step tracker) of the chat running in this thread
+_active = contextvars.ContextVar("cmbagent_cost_ledger", default=None)
+
+
+class Budget:
+    """Limits on the tokens, dollars and wall time (s) of a run or a step. None: no limit."""
+
+    def __init__(self, max_tokens=None, max_cost=None, max_seconds=None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.max_seconds = max_seconds
+
+    @classmethod
+    def from_value(cls, value):
+        """Budget from None, a Budget or a dict of its arguments."""
+        if value is None or isinstance(value, Budget):
+            return value
+        return cls(**value)
+
+    def exceeded(self, totals, seconds):
+        """Reason the budget is exceeded, or None."""
+        if self.max_tokens is not None and totals["total_tokens"] > self.max_tokens:
+            return f"token budget exceeded: {totals['total_tokens']} > {self.max_tokens} tokens"
+        if self.max_cost is not None and totals["cost"] > self.max_cost:
+            return f"cost budget exceeded: ${totals['cost']:.4f} > ${self.max_cost:.4f}"
+        if self.max_seconds is not None and seconds > self.max_seconds:
+            return f"time budget exceeded: {seconds:.0f} s > {self.max_seconds:.0f} s"
+        return None
+
+    def __repr__(self):
+        return f"Budget(max_tokens={self.max_tokens}, max_cost={self.max_cost}, max_seconds={self.max_seconds})"
+
+
+def new_totals():
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+
+
+def add_record(totals, record):
+    totals["calls"] += 1
+    totals["prompt_tokens"] += record["prompt_tokens"]
+    totals["completion_tokens"] += record["completion_tokens"]
+    totals["total_tokens"] += record["total_tokens"]
+    totals["cost"] += record["cost"]
+
+
+def aggregate_records(records):
+    """Totals, per agent, per model and per step, of ledger records."""
+    summary = {"totals": new_totals(), "by_agent": {}, "by_model": {}, "by_step": {}}
+    for record in records:
+        add_record(summary["totals"], record)
+        add_record(summary["by_agent"].setdefault(record["agent"], new_totals()), record)
+        add_record(summary["by_model"].setdefault(record["model"], new_totals()), record)
+        add_record(summary["by_step"].setdefault(record.get("step"), new_totals()), record)
+    return summary
+
+
+def read_ledger(path):
+    """Records of a ledger file (a truncated last line, from a crash, is skipped)."""
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+class _StepTracker:
+    """Totals of one chat (a solve call), and what to do when a budget is exceeded."""
+
+    def __init__(self, step, on_exceeded):
+        self.step = step
+        self.on_exceeded = on_exceeded
+        self.start = time.monotonic()
+        self.totals = new_totals()
+        self.exceeded = None
+
+
+class CostLedger:
+    """
+    Cost ledger of a run, shared by its chats (plan steps included, also when they run concurrently).
+
+    Args:
+        path (str): JSONL file the records are appended to.
+        budget (Budget or dict, optional): Limits for the whole run.
+        step_budget (Budget or dict, optional): Limits for each chat, i.e., each plan step in the control phase.
+    """
+
+    def __init__(self, path, budget=None, step_budget=None):
+        self.path = str(path)
+        self.budget = Budget.from_value(budget)
+        self.step_budget = Budget.from_value(step_budget)
+        self.start = time.monotonic()
+        self.totals = new_totals()
+        self.by_agent = {}
+        self.by_model = {}
+        self.by_step = {}
+        self.exceeded = None
+        self._trackers = set()
+        self._lock = threading.Lock()
+
+    def record(self, agent, model, prompt_tokens, completion_tokens, cost, total_tokens=None, kind="llm"):
+        """Append a completion to the ledger, update the aggregates and check the budgets."""
+        active = _active.get()
+        tracker = active[1] if active is not None and active[0] is self else None
+        record = {"time": time.time(),
+                  "step": tracker.step if tracker is not None else None,
+                  "kind": kind,
+                  "agent": agent,
+                  "model": model,
+                  "prompt_tokens": int(prompt_tokens or 0),
+                  "completion_tokens": int(completion_tokens or 0),
+                  "total_tokens": int(total_tokens if total_tokens is not None else (prompt_tokens or 0) + (completion_tokens or 0)),
+                  "cost": float(cost or 0.0)}
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line)
+            add_record(self.totals, record)
+            add_record(self.by_agent.setdefault(agent, new_totals()), record)
+            add_record(self.by_model.setdefault(model, new_totals()), record)
+            add_record(self.by_step.setdefault(record["step"], new_totals()), record)
+            if tracker is not None:
+                add_record(tracker.totals, record)
+        self.check(tracker)
+        return record
+
+    def check(self, tracker=None):
+        """Check the run budget, and the step budget of tracker. Returns the reason a budget is exceeded, or None."""
+        fire = []
+        with self._lock:
+            if self.exceeded is None and self.budget is not None:
+                self.exceeded = self.budget.exceeded(self.totals, time.monotonic() - self.start)
+                if self.exceeded is not None:
+                    # every chat of the run stops
+                    for other in self._trackers:
+                        if other.exceeded is None:
+                            other.exceeded = self.exceeded
+                            fire.append(other)
+            if tracker is not None and tracker.exceeded is None:
+                tracker.exceeded = self.exceeded
+                if tracker.exceeded is None and self.step_budget is not None:
+                    tracker.exceeded = self.step_budget.exceeded(tracker.totals, time.monotonic() - tracker.start)
+                if tracker.exceeded is not None:
+                    fire.append(tracker)
+        for exceeded_tracker in fire:
+            print(f"\n💸 {exceeded_tracker.exceeded} (step {exceeded_tracker.step}), ending the chat.\n")
+            if exceeded_tracker.on_exceeded is not None:
+                exceeded_tracker.on_exceeded(exceeded_tracker.exceeded)
+        return tracker.exceeded if tracker is not None else self.exceeded
+
+    @contextlib.contextmanager
+    def track(self, step=None, on_exceeded=None):
+        """
+        Attribute the records made in the block to step, and call on_exceeded(reason) once if
+        the run or step budget is exceeded. Yields the step tracker.
+        """
+        tracker = _StepTracker(step, on_exceeded)
+        with self._lock:
+            self._trackers.add(tracker)
+        token = _active.set((self, tracker))
+        try:
+            # a run already over budget stops its next chats right away
+            self.check(tracker)
+            yield tracker
+        finally:
+            _active.reset(token)
+            with self._lock:
+                self._trackers.discard(tracker)
+
+    def summary(self):
+        """Live aggregates of the run."""
+        with self._lock:
+            return {"totals": dict(self.totals),
+                    "by_agent": {name: dict(totals) for name, totals in self.by_agent.items()},
+                    "by_model": {name: dict(totals) for name, totals in self.by_model.items()},
+                    "by_step": {step: dict(totals) for step, totals in self.by_step.items()},
+                    "elapsed_s": time.monotonic() - self.start,
+                    "exceeded": self.exceeded}
+
+
+def get_ledger():
+    """Ledger of the chat running in this thread, or None."""
+    active = _active.get()
+    return active[0] if active is not None else None
+
+
+def record_external_call(agent, model, prompt_tokens, completion_tokens, total_tokens, cost, kind):
+    """Record a call made outside of autogen (VLM, plot debugger, ...) in the ledger of the current chat, if any."""
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.record(agent, model, prompt_tokens, completion_tokens, cost, total_tokens=total_tokens, kind=kind)
+
+
+def track_agent_costs(agent):
+    """
+    Record every completion of an autogen agent in the ledger of the current chat.
+    The wrapper is set on the instance, and does nothing outside of a tracked chat.
+    """
+    client = getattr(agent, "client", None)
+    if client is None or not hasattr(client, "create") or getattr(client, "_cmbagent_cost_tracked", False):
+        return agent
+    create = client.create
+
+    @functools.wraps(create)
+    def create_and_record(*args, **kwargs):
+        response = create(*args, **kwargs)
+        ledger = get_ledger()
+        if ledger is not None:
+            usage = getattr(response, "usage", None)
+            ledger.record(agent.name,
+                          getattr(response, "model", None),
+                          getattr(usage, "prompt_tokens", 0),
+                          getattr(usage, "completion_tokens", 0),
+                          # set by autogen's OpenAIWrapper from its price table
+                          getattr(response, "cost", 0.0),
+                          total_tokens=getattr(usage, "total_tokens", None))
+        return response
+
+    client.create = create_and_record
+    client._cmbagent_cost_tracked = True
+    return agent
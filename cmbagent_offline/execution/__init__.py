@@ -0,0 +1,17 @@
+"""
+Execution module for CMBAgent.
+
+Contains the code executors used by the code agents (a new process per code
+block, a fork of a pre-imported forkserver, or a warm kernel), the static check
+of the code before it is run, the cache of their results, and the artifact
+manifest they write.
+"""
+
+from .artifacts import ArtifactRecordingCodeExecutor, ArtifactManifest, get_artifact_manifest
+from .forkserver import ForkServerCodeExecutor
+from .kernel import KernelCodeExecutor
+from .static_check import StaticCheck
+from .result_cache import ExecutionCache
+
+__all__ = ["ArtifactRecordingCodeExecutor", "ArtifactManifest", "get_artifact_manifest", "ForkServerCodeExecutor", "KernelCodeExecutor",
+           "StaticCheck", "ExecutionCache"]
@@ -0,0 +1,393 @@
+"""
+Artifact manifest for CMBAgent code executors.
+
+After each execution, the executor records the files that the code created or
+modified in an append-only manifest (one json line per file) at
+<work_dir>/.artifacts.jsonl. The orchestrator reads the manifest incrementally
+to find new plots, instead of walking the whole data directory at every turn.
+
+The executor does not stat every file of the work_dir after each execution: the
+listing of a directory is kept until its mtime changes (a file was created,
+removed or renamed in it), and in the directories that did not change only the
+files named by the code (string literals, f-string prefixes and suffixes) are
+checked, for the files it rewrote in place. Files rewritten in place under a
+name the code does not spell out are not recorded; when the code cannot be
+analysed (other languages, or a kernel keeping its namespace) every file is
+checked.
+"""
+
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding import LocalCommandLineCodeExecutor
+from autogen.coding.base import CommandLineCodeResult
+from typing import List
+import ast
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+from ..tracing import span
+from .static_check import get_static_check
+from .result_cache import get_execution_cache
+
+logger = logging.getLogger(__name__)
+
+manifest_filename = ".artifacts.jsonl"
+
+image_extensions = ('.png', '.jpg', '.jpeg', '.gif')
+
+_filename_line = re.compile(r"^\s*#\s*filename:\s*(.+?)\s*$")
+
+# file systems with coarse timestamps can date a file slightly before the
+# execution started
+MTIME_MARGIN_NS = 50_000_000
+
+# in-memory readers, keyed by manifest path
+_manifests = {}
+
+
+def _scan(directory, skip=(manifest_filename,), follow_links=True):
+    """
+    Yield (path, stat) for every file below directory, skipping hidden entries.
+    Links to directories are followed at the top level only. Links to files are
+    followed (the data and codebase files of the steps a concurrent plan step depends
+    on are links, see plan_dag.py), so they are only reported when written through.
+    """
+    try:
+        it = os.scandir(directory)
+    except OSError:
+        return
+    with it:
+        for entry in it:
+            if entry.name.startswith(".") or entry.name in skip:
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False) or (follow_links and entry.is_symlink() and entry.is_dir()):
+                    yield from _scan(entry.path, skip, follow_links=False)
+                elif entry.is_file():
+                    yield entry.path, entry.stat()
+            except OSError:
+                continue
+
+
+def written_names(code_blocks):
+    """
+    Names of the files the code blocks may write: (basenames, [(prefix, suffix), ...]) from their
+    string literals and f-strings, or None if they cannot be analysed.
+    """
+    names = set()
+    patterns = []
+    for code_block in code_blocks:
+        if code_block.language.lower() not in PYTHON_VARIANTS:
+            return None
+        try:
+            tree = ast.parse(code_block.code)
+        except (SyntaxError, ValueError):
+            return None
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and node.value:
+                names.add(os.path.basename(node.value))
+            elif isinstance(node, ast.JoinedStr) and node.values:
+                first, last = node.values[0], node.values[-1]
+                prefix = first.value if isinstance(first, ast.Constant) else ""
+                suffix = last.value if isinstance(last, ast.Constant) and last is not first else ""
+                if "/" in suffix:
+                    # f"{folder}/name.png"
+                    prefix, suffix = "", suffix.rsplit("/", 1)[1]
+                patterns.append((os.path.basename(prefix), suffix))
+    return names, patterns
+
+
+def _named_files(files, written):
+    """Paths of files (name -> path) named in written, see written_names."""
+    names, patterns = written
+    paths = [files[name] for name in names if name in files]
+    if patterns:
+        paths.extend(path for name, path in files.items() if name not in names
+                     and any(name.startswith(prefix) and name.endswith(suffix) for prefix, suffix in patterns))
+    return paths
+
+
+class ArtifactRecordingCodeExecutor(LocalCommandLineCodeExecutor):
+    """
+    LocalCommandLineCodeExecutor that appends the files created or modified by
+    each execution to the artifact manifest of its work_dir.
+
+    With static_check (True or a dict of StaticCheck arguments, see
+    execution/static_check.py), the python blocks are checked before they are run.
+    With execution_cache (True or a dict of ExecutionCache arguments, see
+    execution/result_cache.py), identical executions are replayed from a cache.
+    """
+
+    def __init__(self, *args, static_check=None, execution_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.static_check = get_static_check(static_check)
+        self.execution_cache = get_execution_cache(execution_cache, self.work_dir)
+        self._n_executions = 0
+        # path -> mtime_ns of the files already in the manifest
+        self._known = None
+        # directory -> (mtime_ns, {name: path} of the files, subdirectories) at the previous scan
+        self._listings = {}
+        self._scan_ns = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(str(self.work_dir), manifest_filename)
+
+    def _load_known(self):
+        self._known = {}
+        for record in read_manifest_records(self.manifest_path):
+            self._known[record["path"]] = record["mtime"]
+
+    def _scan_changed(self, written):
+        """
+        Yield (path, stat) for the files of the work_dir that may have changed since the previous scan,
+        with the same rules as _scan. written: see written_names, None to check every file.
+        """
+        previous_ns = self._scan_ns
+        self._scan_ns = time.time_ns()
+        stack = [(str(self.work_dir), True)]
+        while stack:
+            directory, follow_links = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._listings.pop(directory, None)
+                continue
+            listing = self._listings.get(directory)
+            # changed within the timestamp resolution of the previous scan: may have entries it did not see
+            unchanged = (listing is not None and listing[0] == mtime
+                         and previous_ns is not None and mtime < previous_ns - MTIME_MARGIN_NS)
+            if unchanged:
+                _, files, subdirectories = listing
+            else:
+                files, subdirectories = {}, []
+                try:
+                    with os.scandir(directory) as it:
+                        for entry in it:
+                            if entry.name.startswith(".") or entry.name == manifest_filename:
+                                continue
+                            try:
+                                if entry.is_dir(follow_symlinks=False) or (follow_links and entry.is_symlink() and entry.is_dir()):
+                                    subdirectories.append(entry.path)
+                                elif entry.is_file():
+                                    files[entry.name] = entry.path
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+                self._listings[directory] = (mtime, files, subdirectories)
+            # files rewritten in place do not change the mtime of their directory
+            paths = _named_files(files, written) if unchanged and written is not None else files.values()
+            for path in paths:
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+            stack.extend((subdirectory, False) for subdirectory in subdirectories)
+
+    def record_artifacts(self, start_ns: int, code_blocks=None) -> List[dict]:
+        """Append the files changed since start_ns (by code_blocks, if given) to the manifest and return their records."""
+        if self._known is None:
+            self._load_known()
+
+        # names written through a kernel namespace can come from earlier code
+        written = written_names(code_blocks) if code_blocks is not None and not self.namespace_persists else None
+        self._n_executions += 1
+        records = []
+        for path, stat in self._scan_changed(written):
+            if stat.st_mtime_ns < start_ns - MTIME_MARGIN_NS:
+                continue
+            if self._known.get(path) == stat.st_mtime_ns:
+                continue
+            records.append({
+                "execution": self._n_executions,
+                "path": path,
+                "kind": "modified" if path in self._known else "created",
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+            })
+            self._known[path] = stat.st_mtime_ns
+
+        if records:
+            records.sort(key=lambda record: record["mtime"])
+            # a single append per execution, so concurrent executors sharing
+            # the work_dir do not interleave lines
+            with open(self.manifest_path, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+
+        return records
+
+    def save_script(self, code, extension="py"):
+        """Save the code like LocalCommandLineCodeExecutor does. Returns its path."""
+        first_line = code.lstrip().split("\n", 1)[0]
+        match = _filename_line.match(first_line)
+        work_dir = os.path.abspath(str(self.work_dir))
+        if match is not None:
+            path = os.path.abspath(os.path.join(work_dir, match.group(1)))
+            if os.path.commonpath([path, work_dir]) != work_dir:
+                raise ValueError(f"Filename {match.group(1)} is out of the working directory.")
+        else:
+            path = os.path.join(work_dir, f"tmp_code_{hashlib.md5(code.encode()).hexdigest()}.{extension}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(code)
+        return path
+
+    def run_code_blocks(self, code_blocks) -> CommandLineCodeResult:
+        """Run the code blocks, in a new process each (see execution/kernel.py for a warm kernel)."""
+        return super().execute_code_blocks(code_blocks)
+
+    @property
+    def namespace_persists(self) -> bool:
+        """Whether the names defined by an execution are available to the next one."""
+        return False
+
+    def execute_code_blocks(self, code_blocks) -> CommandLineCodeResult:
+        start_ns = time.time_ns()
+        with span("code execution", "code", n_blocks=len(code_blocks)) as execution_span:
+            cache_key = snapshot = records = None
+            # a warm kernel keeping its namespace can give another result for the same code
+            if self.execution_cache is not None and not self.namespace_persists:
+                cache_key = self.execution_cache.code_key(code_blocks)
+            try:
+                if self.static_check is not None:
+                    code_blocks, result = self.static_check.check_code_blocks(code_blocks, self.work_dir,
+                                                                              namespace_persists=self.namespace_persists)
+                    if result is not None:
+                        if execution_span is not None:
+                            execution_span.attributes["static_check"] = "failed"
+                            execution_span.attributes["exit_code"] = result.exit_code
+                        return result
+                if cache_key is not None:
+                    snapshot = self.execution_cache.snapshot_inputs(code_blocks)
+                    result = self.execution_cache.replay(cache_key, snapshot)
+                    if result is not None:
+                        # the scripts are saved as when they are run, later code may import them
+                        for code_block in code_blocks:
+                            self.save_script(code_block.code)
+                        if execution_span is not None:
+                            execution_span.attributes["cache"] = "hit"
+                            execution_span.attributes["exit_code"] = result.exit_code
+                        return result
+                result = self.run_code_blocks(code_blocks)
+                if execution_span is not None:
+                    execution_span.attributes["exit_code"] = result.exit_code
+            finally:
+                try:
+                    records = self.record_artifacts(start_ns, code_blocks)
+                except OSError as e:
+                    logger.warning(f"could not record artifacts in {self.manifest_path}: {e}")
+            if cache_key is not None and result.exit_code == 0 and records is not None:
+                try:
+                    self.execution_cache.store(cache_key, snapshot, result, records)
+                except OSError as e:
+                    logger.warning(f"could not cache the execution in {self.execution_cache.cache_dir}: {e}")
+            return result
+
+
+def read_manifest_records(manifest_path, offset=0):
+    """Records of the manifest from byte offset on. Returns a list (empty if there is no manifest)."""
+    records, _ = _read_manifest(manifest_path, offset)
+    return records
+
+
+def _read_manifest(manifest_path, offset):
+    try:
+        with open(manifest_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return [], offset
+    # only consume complete lines, a concurrent append may be half written
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records, offset + end
+
+
+class ArtifactManifest:
+    """
+    Incremental reader of the artifact manifest of a work_dir.
+
+    Each call to update() only reads the records appended since the previous call.
+    """
+
+    def __init__(self, work_dir):
+        self.work_dir = str(work_dir)
+        self.manifest_path = os.path.join(self.work_dir, manifest_filename)
+        self.offset = 0
+        self.file_id = None
+        # image path -> mtime_ns, in order of last modification
+        self.images = {}
+        # images recorded since the previous new_plots(), and those it returned not displayed yet
+        self._new_images = []
+        self._pending_images = []
+
+    def exists(self) -> bool:
+        return os.path.exists(self.manifest_path)
+
+    def update(self) -> List[dict]:
+        """Read the new records, returns them."""
+        try:
+            stat = os.stat(self.manifest_path)
+            file_id, size = stat.st_ino, stat.st_size
+        except OSError:
+            file_id, size = None, 0
+        # the work_dir was cleared
+        if file_id != self.file_id or size < self.offset:
+            self.file_id = file_id
+            self.offset = 0
+            self.images = {}
+            self._new_images = []
+            self._pending_images = []
+
+        records, self.offset = _read_manifest(self.manifest_path, self.offset)
+        for record in records:
+            path = record["path"]
+            if path.lower().endswith(image_extensions) and '.ipynb_checkpoints' not in path:
+                # move re-written images to the end, as load_plots sorted by mtime
+                self.images.pop(path, None)
+                self.images[path] = record["mtime"]
+                self._new_images.append(path)
+        return records
+
+    def plots(self, directory=None) -> List[str]:
+        """Image files recorded so far (optionally below directory), oldest first."""
+        self.update()
+        if directory is None:
+            return list(self.images)
+        directory = os.path.join(os.path.abspath(directory), "")
+        return [path for path in self.images if os.path.abspath(path).startswith(directory)]
+
+    def new_plots(self, directory=None, displayed=()) -> List[str]:
+        """
+        Image files recorded (optionally below directory) that are not displayed, oldest first.
+        Only the records appended since the previous call are read, the images returned are
+        kept until they are displayed.
+        """
+        self.update()
+        paths = self._pending_images + self._new_images
+        self._new_images = []
+        # an image re-written in between is listed once, at its last position
+        paths = list(dict.fromkeys(reversed(paths)))[::-1]
+        if directory is not None:
+            directory = os.path.join(os.path.abspath(directory), "")
+            paths = [path for path in paths if os.path.abspath(path).startswith(directory)]
+        self._pending_images = [path for path in paths if path not in displayed and os.path.exists(path)]
+        return list(self._pending_images)
+
+
+def get_artifact_manifest(work_dir) -> ArtifactManifest:
+    """Reader of the artifact manifest of work_dir, kept in memory across turns."""
+    key = os.path.join(os.path.abspath(str(work_dir)), manifest_filename)
+    manifest = _manifests.get(key)
+    if manifest is None:
+        manifest = _manifests[key] = ArtifactManifest(work_dir)
+    return manifest
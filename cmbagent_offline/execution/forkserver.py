@@ -0,0 +1,228 @@
+"""
+Pre-imported forkserver executor for CMBAgent code agents.
+
+LocalCommandLineCodeExecutor runs each code block as `python <script>`, which
+re-imports numpy, scipy, matplotlib, camb, ... on every executor turn.
+ForkServerCodeExecutor keeps the process isolation of each execution, but runs
+the script in a fresh fork of a warm multiprocessing forkserver, in which the
+scientific stack is already imported.
+
+- The preloaded modules are given by module name or by pyproject extra
+  (``local``, ``astro``, ``data``, ``materials``, ``biochem``); the modules
+  that are not installed are skipped.
+- The forkserver is started when the executor is created, so the imports run
+  while the LLM writes the code.
+- As for LocalCommandLineCodeExecutor: the script is saved in the work_dir,
+  run from the work_dir with the work_dir on the python path and the warnings
+  ignored, its output (stdout and stderr) is printed live, and an execution
+  that takes longer than the timeout is killed (exit code 124).
+- Other languages (sh, bash) are run by LocalCommandLineCodeExecutor.
+
+A multiprocessing program has a single forkserver, so the modules preloaded
+are those of the first executor created.
+"""
+
+from autogen.code_utils import PYTHON_VARIANTS, TIMEOUT_MSG
+from autogen.coding.base import CommandLineCodeResult
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import runpy
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import warnings
+
+from .artifacts import ArtifactRecordingCodeExecutor
+
+logger = logging.getLogger(__name__)
+
+# exit code of a timed out execution, as for LocalCommandLineCodeExecutor
+TIMEOUT_EXIT_CODE = 124
+
+# period at which the output of a running script is printed (s)
+POLL_INTERVAL = 0.05
+
+# modules imported by the forkserver for each pyproject extra
+preload_groups = {
+    "local": ["numpy", "scipy", "scipy.integrate", "scipy.interpolate", "scipy.optimize", "matplotlib", "matplotlib.pyplot", "sklearn"],
+    "astro": ["camb", "astropy", "astropy.units", "astropy.io.fits", "healpy", "emcee"],
+    "data": ["xarray", "h5py", "statsmodels.api", "seaborn"],
+    "materials": ["pymatgen.core", "ase"],
+    "biochem": ["Bio", "MDAnalysis"],
+}
+
+default_preload = ["local", "astro"]
+
+_forkserver_lock = threading.Lock()
+_forkserver_preload = None
+
+
+def resolve_preload(preload):
+    """Module names of a list of module names and pyproject extras (see preload_groups)."""
+    modules = []
+    for name in preload:
+        for module in preload_groups.get(name, [name]):
+            if module not in modules:
+                modules.append(module)
+    # the child processes unpickle _run_script from this module
+    modules.append(__name__)
+    return modules
+
+
+def get_forkserver_context(preload=None):
+    """The forkserver context, with its server started and importing the preload modules."""
+    global _forkserver_preload
+    modules = resolve_preload(default_preload if preload is None else preload)
+    with _forkserver_lock:
+        context = multiprocessing.get_context("forkserver")
+        if _forkserver_preload is None:
+            context.set_forkserver_preload(modules)
+            # the server imports the modules in the background
+            multiprocessing.forkserver.ensure_running()
+            _forkserver_preload = modules
+        elif set(modules) - set(_forkserver_preload):
+            logger.warning(f"the forkserver is already running with {_forkserver_preload}, "
+                           f"{sorted(set(modules) - set(_forkserver_preload))} will be imported at each execution")
+    return context
+
+
+def _run_script(path, cwd, log_path, env):
+    """Run path as `python path` would, in the forked process, with stdout and stderr going to log_path."""
+    fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    for stream in (sys.stdout, sys.stderr):
+        stream.flush()
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.reconfigure(line_buffering=True)
+        except AttributeError:
+            pass
+
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(cwd)
+    sys.argv = [path]
+    sys.path[:0] = [os.path.dirname(path), cwd]
+    warnings.simplefilter("ignore")
+    # the processes of the script (e.g. a multiprocessing.Pool) are started as with `python path`,
+    # not from the forkserver, which would import the script again without a __main__ guard
+    multiprocessing.set_start_method(None, force=True)
+
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit:
+        raise
+    except BaseException as e:
+        # traceback from the script on, as python would print it
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        sys.exit(1)
+
+
+class ForkServerCodeExecutor(ArtifactRecordingCodeExecutor):
+    """
+    Code executor running each python block in a fresh fork of a forkserver with the scientific stack imported.
+
+    Args:
+        work_dir (str): Working directory, where the scripts are saved and run from.
+        timeout (int): Timeout of each code block (s).
+        execution_policies (dict, optional): As for LocalCommandLineCodeExecutor.
+        preload (list, optional): Modules and pyproject extras imported by the forkserver. Defaults to default_preload.
+        static_check (bool or dict, optional): Check the python blocks before running them, see execution/static_check.py.
+        execution_cache (bool or dict, optional): Replay identical executions, see execution/result_cache.py.
+    """
+
+    def __init__(self, work_dir, timeout=60, execution_policies=None, preload=None, static_check=None,
+                 execution_cache=None):
+        super().__init__(work_dir=work_dir, timeout=timeout, execution_policies=execution_policies,
+                         static_check=static_check, execution_cache=execution_cache)
+        self.preload = preload
+        self._context = get_forkserver_context(preload)
+
+    def _run_python(self, code_file):
+        """Run the script in a new fork. Returns (exit_code, output)."""
+        env = os.environ.copy()
+        env["PYTHONWARNINGS"] = "ignore"
+        env["PYTHONPATH"] = str(self.work_dir) + os.pathsep + env.get("PYTHONPATH", "")
+        log_fd, log_path = tempfile.mkstemp(prefix="cmbagent_exec_", suffix=".log")
+        os.close(log_fd)
+        # not daemonic, so that the script can start processes itself (e.g. a multiprocessing.Pool)
+        process = self._context.Process(target=_run_script,
+                                        args=(code_file, os.path.abspath(str(self.work_dir)), log_path, env))
+        try:
+            process.start()
+            output = "\n"
+            print("\n code being executed....\n")
+            deadline = time.monotonic() + float(self._timeout)
+            with open(log_path, "r", encoding="utf-8", errors="replace") as log:
+                while True:
+                    process.join(POLL_INTERVAL)
+                    new_output = log.read()
+                    if new_output:
+                        print(new_output, end='')
+                        output += new_output
+                    if process.exitcode is not None:
+                        output += log.read()
+                        break
+                    if time.monotonic() > deadline:
+                        process.kill()
+                        process.join()
+                        output += log.read() + "\n" + TIMEOUT_MSG
+                        print("\n")
+                        return TIMEOUT_EXIT_CODE, output
+            print("\n")
+            # killed by a signal (negative exitcode), e.g. out of memory
+            exit_code = process.exitcode if process.exitcode >= 0 else 128 - process.exitcode
+            return exit_code, output
+        finally:
+            # e.g. interrupted: do not leave the script running
+            if process.is_alive():
+                process.kill()
+            if process.pid is not None:
+                process.join()
+            try:
+                os.remove(log_path)
+            except OSError:
+                pass
+
+    def run_code_blocks(self, code_blocks) -> CommandLineCodeResult:
+        output = ""
+        exit_code = 0
+        code_file = None
+        for code_block in code_blocks:
+            lang = code_block.language.lower()
+            if lang not in PYTHON_VARIANTS:
+                result = super().run_code_blocks([code_block])
+                output += result.output
+                exit_code = result.exit_code
+                code_file = code_file or result.code_file
+                if exit_code != 0:
+                    break
+                continue
+
+            try:
+                path = self.save_script(code_block.code)
+            except ValueError:
+                return CommandLineCodeResult(exit_code=1, output="Filename is not in the workspace")
+            code_file = code_file or path
+            if not self.execution_policies.get("python", False):
+                output += f"Content saved to {path}\n"
+                continue
+
+            try:
+                exit_code, block_output = self._run_python(path)
+            except OSError as e:
+                exit_code, block_output = 1, f"\nException: {e}\n"
+            output += block_output
+            if exit_code != 0:
+                break
+
+        return CommandLineCodeResult(exit_code=exit_code, output=output, code_file=code_file)
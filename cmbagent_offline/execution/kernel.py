@@ -0,0 +1,264 @@
+"""
+Warm Python kernel executor for CMBAgent code agents.
+
+LocalCommandLineCodeExecutor starts a new Python process for every code block,
+so each retry of the engineer re-imports numpy, scipy, matplotlib, camb, ... and
+recomputes everything. KernelCodeExecutor runs the code blocks in a local
+Jupyter kernel (jupyter_client + ipykernel, see the ``jupyter`` extra) that is
+kept alive across the attempts of a step, and optionally across steps.
+
+- The scripts are still saved in the work_dir (``# filename:`` first line), and
+  the files they write are recorded in the artifact manifest.
+- ``memory_limit_mb`` caps the address space of the kernel process.
+- A kernel that dies (crash, out of memory) is restarted, and the execution is
+  reported as failed.
+- ``clean_namespace`` resets the variables of the kernel before each execution;
+  the imported modules stay loaded, so imports remain fast.
+"""
+
+from autogen.coding.base import CommandLineCodeResult
+from queue import Empty
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+
+from .artifacts import ArtifactRecordingCodeExecutor
+
+logger = logging.getLogger(__name__)
+
+# exit code of a timed out execution, as for LocalCommandLineCodeExecutor
+TIMEOUT_EXIT_CODE = 124
+
+# polling period of the kernel messages, also the delay to notice a dead kernel (s)
+POLL_INTERVAL = 0.5
+
+_ansi_escape = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+# kernels still running, shut down at exit
+_live_kernels = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown_kernels():
+    for kernel in list(_live_kernels):
+        kernel.shutdown()
+
+
+def require_jupyter():
+    try:
+        import jupyter_client  # noqa: F401
+        import ipykernel  # noqa: F401
+    except ImportError:
+        raise ImportError("the kernel executor needs jupyter_client and ipykernel (pip install 'cmbagent[jupyter]')")
+
+
+class WarmKernel:
+    """A local ipykernel and its client."""
+
+    def __init__(self, cwd, memory_limit_mb=None, kernel_name="python3", startup_timeout=60):
+        require_jupyter()
+        from jupyter_client import KernelManager
+        self.memory_limit_mb = memory_limit_mb
+        # figures are saved to files, never shown
+        env = dict(os.environ, MPLBACKEND="Agg")
+        self.manager = KernelManager(kernel_name=kernel_name)
+        self.manager.start_kernel(cwd=str(cwd), env=env)
+        self.client = self.manager.client()
+        self.client.start_channels()
+        self.client.wait_for_ready(timeout=startup_timeout)
+        self.cwd = None
+        self.n_executions = 0
+        _live_kernels.add(self)
+        setup = "import os, sys"
+        if memory_limit_mb is not None:
+            setup += (f"\nimport resource"
+                      f"\nresource.setrlimit(resource.RLIMIT_AS, ({int(memory_limit_mb) * 1024**2}, {int(memory_limit_mb) * 1024**2}))")
+        self.run_silently(setup)
+        self.chdir(cwd)
+
+    def is_alive(self):
+        return self.manager.is_alive()
+
+    def run(self, code, timeout):
+        """
+        Run code in the kernel.
+
+        Returns:
+            tuple: (status, output) with status "ok", "error", "timeout" or "dead".
+        """
+        msg_id = self.client.execute(code, store_history=False, allow_stdin=False)
+        outputs = []
+        deadline = time.monotonic() + timeout
+        status = None
+        while True:
+            try:
+                msg = self.client.get_iopub_msg(timeout=POLL_INTERVAL)
+            except Empty:
+                if not self.is_alive():
+                    return "dead", "".join(outputs)
+                if time.monotonic() > deadline:
+                    return "timeout", "".join(outputs)
+                continue
+            if msg["parent_header"].get("msg_id") != msg_id:
+                continue
+            msg_type, content = msg["msg_type"], msg["content"]
+            if msg_type == "stream":
+                outputs.append(content["text"])
+            elif msg_type == "error":
+                status = "error"
+                outputs.append(_ansi_escape.sub("", "\n".join(content["traceback"])) + "\n")
+            elif msg_type in ("execute_result", "display_data"):
+                text = content.get("data", {}).get("text/plain")
+                if text and msg_type == "execute_result":
+                    outputs.append(text + "\n")
+            elif msg_type == "status" and content["execution_state"] == "idle":
+                break
+        # consume the execute reply, so that the replies do not pile up in the shell channel
+        try:
+            while self.client.get_shell_msg(timeout=POLL_INTERVAL)["parent_header"].get("msg_id") != msg_id:
+                pass
+        except Empty:
+            pass
+        self.n_executions += 1
+        return status or "ok", "".join(outputs)
+
+    def run_silently(self, code, timeout=30):
+        status, output = self.run(code, timeout)
+        if status != "ok":
+            logger.warning(f"kernel setup failed ({status}): {output}")
+        return status
+
+    def chdir(self, cwd):
+        cwd = os.path.abspath(str(cwd))
+        if cwd != self.cwd:
+            self.run_silently(f"os.chdir({cwd!r})")
+            self.cwd = cwd
+
+    def reset_namespace(self):
+        """Forget the variables, keep the imported modules (in sys.modules)."""
+        self.run_silently("get_ipython().run_line_magic('reset', '-f')\nimport os, sys")
+
+    def interrupt(self, timeout=5):
+        """Interrupt the running code. Returns False if the kernel is still busy afterwards."""
+        self.manager.interrupt_kernel()
+        try:
+            return self.run("pass", timeout)[0] == "ok"
+        except Exception:
+            return False
+
+    def shutdown(self):
+        try:
+            self.client.stop_channels()
+            self.manager.shutdown_kernel(now=True)
+        except Exception as e:
+            logger.debug(f"kernel shutdown: {e}")
+        _live_kernels.discard(self)
+
+
+class KernelCodeExecutor(ArtifactRecordingCodeExecutor):
+    """
+    Code executor running the python blocks in a warm kernel, started on first use.
+
+    Args:
+        work_dir (str): Working directory, where the scripts are saved and run from.
+        timeout (int): Timeout of each code block (s).
+        execution_policies (dict, optional): As for LocalCommandLineCodeExecutor; only python is run in the kernel.
+        memory_limit_mb (int, optional): Address space limit of the kernel process. Defaults to None, no limit.
+        clean_namespace (bool): Whether the variables are reset before each execution. Defaults to False:
+            the objects computed by an attempt are available to the next one.
+        kernel (WarmKernel, optional): Kernel of a previous executor to keep using (see take_kernel).
+        kernel_name (str): Jupyter kernel spec. Defaults to "python3".
+        static_check (bool or dict, optional): Check the python blocks before running them, see execution/static_check.py.
+        execution_cache (bool or dict, optional): Replay identical executions, see execution/result_cache.py
+            (only with clean_namespace).
+    """
+
+    def __init__(self, work_dir, timeout=60, execution_policies=None, memory_limit_mb=None,
+                 clean_namespace=False, kernel=None, kernel_name="python3", static_check=None, execution_cache=None):
+        require_jupyter()
+        super().__init__(work_dir=work_dir, timeout=timeout, execution_policies=execution_policies,
+                         static_check=static_check, execution_cache=execution_cache)
+        self.memory_limit_mb = memory_limit_mb
+        self.clean_namespace = clean_namespace
+        self.kernel_name = kernel_name
+        self._kernel = kernel
+        self._lock = threading.Lock()
+
+    @property
+    def namespace_persists(self) -> bool:
+        return not self.clean_namespace
+
+    def _get_kernel(self):
+        if self._kernel is None or not self._kernel.is_alive():
+            if self._kernel is not None:
+                self._kernel.shutdown()
+            self._kernel = WarmKernel(self.work_dir, memory_limit_mb=self.memory_limit_mb, kernel_name=self.kernel_name)
+        self._kernel.chdir(self.work_dir)
+        return self._kernel
+
+    def _restart_kernel(self):
+        if self._kernel is not None:
+            self._kernel.shutdown()
+        self._kernel = None
+
+    def take_kernel(self):
+        """Detach the kernel from this executor, to hand it over to the executor of the next step."""
+        with self._lock:
+            kernel, self._kernel = self._kernel, None
+        return kernel
+
+    def stop(self):
+        with self._lock:
+            self._restart_kernel()
+
+    def run_code_blocks(self, code_blocks) -> CommandLineCodeResult:
+        outputs = []
+        code_file = None
+        with self._lock:
+            for code_block in code_blocks:
+                lang = code_block.language.lower()
+                if lang not in ("python", "py", "python3"):
+                    outputs.append(f"Unsupported language {lang} for the kernel executor.\n")
+                    return CommandLineCodeResult(exit_code=1, output="".join(outputs), code_file=code_file)
+                try:
+                    code_file = self.save_script(code_block.code)
+                except ValueError as e:
+                    return CommandLineCodeResult(exit_code=1, output=str(e), code_file=None)
+                if not self.execution_policies.get("python", True):
+                    outputs.append(f"Code saved to {code_file}\n")
+                    continue
+
+                try:
+                    kernel = self._get_kernel()
+                except Exception as e:
+                    return CommandLineCodeResult(exit_code=1, output=f"Could not start the kernel: {e}", code_file=code_file)
+                if self.clean_namespace:
+                    kernel.reset_namespace()
+                # the script runs as if launched as `python <code_file>`: own __file__, siblings importable
+                script_dir = os.path.dirname(code_file)
+                kernel.run_silently(f"__file__ = {code_file!r}\nsys.path.insert(0, {script_dir!r}) if {script_dir!r} not in sys.path else None")
+
+                status, output = kernel.run(code_block.code, self._timeout)
+                outputs.append(output)
+                if status in ("ok", "error"):
+                    # stale figures of a failed attempt would be saved again by the next one
+                    kernel.run_silently("if 'matplotlib.pyplot' in sys.modules: sys.modules['matplotlib.pyplot'].close('all')")
+
+                if status == "timeout":
+                    outputs.append("\nTimeout")
+                    if not kernel.interrupt():
+                        self._restart_kernel()
+                    return CommandLineCodeResult(exit_code=TIMEOUT_EXIT_CODE, output="".join(outputs), code_file=code_file)
+                if status == "dead":
+                    limit = f" (memory limit: {self.memory_limit_mb} MB)" if self.memory_limit_mb else ""
+                    outputs.append(f"\nThe kernel died{limit} and was restarted: the variables of the previous executions are lost.\n")
+                    self._restart_kernel()
+                    return CommandLineCodeResult(exit_code=1, output="".join(outputs), code_file=code_file)
+                if status == "error":
+                    return CommandLineCodeResult(exit_code=1, output="".join(outputs), code_file=code_file)
+
+        return CommandLineCodeResult(exit_code=0, output="".join(outputs), code_file=code_file)
@@ -0,0 +1,276 @@
+"""
+Execution result cache for CMBAgent code executors.
+
+On retries and plot-fix loops, the engineer often resubmits code that has
+already been run. ExecutionCache keeps the result of each successful execution
+in a content-addressed store at <work_dir>/.execution_cache:
+
+- an execution is keyed by the hash of its normalised code (the ast of the
+  python blocks, so comments and formatting do not matter) and of the
+  `# filename:` line of each block, where the script is saved,
+- and, for that code, by the hashes of its inputs: the files under the
+  database_path and the local modules the code imports, as they were before it
+  ran (leaving out the files it wrote),
+- the output and the files written by the execution (from the artifact
+  manifest records) are stored, the files as blobs named by their sha256.
+
+When the same code is submitted with the same inputs, the output is replayed
+and the files are restored without running anything. Only executions that
+succeeded are cached. Cached code should not depend on anything else (network,
+randomness without a seed, files outside the data folder).
+
+memo.py offers generated code a memoize decorator for expensive intermediate
+results, when part of the code changes between attempts.
+"""
+
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding.base import CommandLineCodeResult
+import ast
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import warnings
+
+logger = logging.getLogger(__name__)
+
+cache_dirname = ".execution_cache"
+
+_filename_line = re.compile(r"^\s*#\s*filename:\s*(.+?)\s*$")
+
+# appended to the instructions of the engineer when the cache is on
+memoize_instructions = """
+Identical code is not run again: its output and files are replayed from a cache.
+When only part of the code changes between attempts, wrap the expensive computations (e.g. camb runs over a grid,
+large data loads, mcmc chains) in functions decorated with memoize (from cmbagent.memo import memoize),
+their results (numpy arrays or picklable objects) are then reused across attempts. The result must only depend on the arguments.
+"""
+
+
+def normalize_code(code):
+    """Normalised python code: the ast, without comments, blank lines and formatting (the code itself if it does not parse)."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", SyntaxWarning)
+            return ast.dump(ast.parse(code))
+    except (SyntaxError, ValueError):
+        return code
+
+
+def _sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _local_modules(code, search_dirs):
+    """Paths of the local modules (files) imported by code."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return []
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split(".")[0])
+    paths = []
+    for module in sorted(modules):
+        for directory in search_dirs:
+            path = os.path.join(directory, module + ".py")
+            if os.path.isfile(path):
+                paths.append(path)
+                break
+            if os.path.isdir(os.path.join(directory, module)):
+                for root, dirs, files in os.walk(os.path.join(directory, module)):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith((".", "__pycache__")))
+                    paths.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(".py"))
+                break
+    return paths
+
+
+class ExecutionCache:
+    """
+    Content-addressed cache of the results of successful executions.
+
+    Args:
+        work_dir (str): Work directory of the executor.
+        database_path (str): Folder of the data, relative to work_dir, whose files are inputs of the code. Defaults to "data/".
+        cache_dir (str, optional): Folder of the cache. Defaults to <work_dir>/.execution_cache.
+        max_entry_mb (float): Executions that write more than this are not cached. Defaults to 512.
+    """
+
+    def __init__(self, work_dir, database_path="data/", cache_dir=None, max_entry_mb=512):
+        self.work_dir = os.path.abspath(str(work_dir))
+        self.database_path = database_path
+        self.cache_dir = cache_dir or os.path.join(self.work_dir, cache_dirname)
+        self.max_entry_mb = max_entry_mb
+        # path -> (size, mtime_ns, sha256), so unchanged files are not hashed again
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known is not None and known[:2] == (stat.st_size, stat.st_mtime_ns):
+            return known[2]
+        digest = _sha256_file(path)
+        self._digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def code_key(self, code_blocks):
+        """Key of the normalised code blocks and their filenames, None if they cannot be cached (other languages than python)."""
+        h = hashlib.sha256()
+        for code_block in code_blocks:
+            if code_block.language.lower() not in PYTHON_VARIANTS:
+                return None
+            # the comment is dropped by normalize_code, but says where the script is saved
+            match = _filename_line.match(code_block.code.lstrip().split("\n", 1)[0])
+            h.update((match.group(1) if match else "").encode() + b"\0")
+            h.update(normalize_code(code_block.code).encode() + b"\0")
+        return h.hexdigest()
+
+    def snapshot_inputs(self, code_blocks):
+        """Relative path -> sha256 of the files under the database_path and of the local modules imported by the code."""
+        from .artifacts import _scan
+
+        inputs = {}
+        data_dir = os.path.join(self.work_dir, self.database_path)
+        for path, _ in _scan(data_dir):
+            inputs[os.path.relpath(path, self.work_dir)] = path
+        search_dirs = [self.work_dir, os.path.join(self.work_dir, "codebase")]
+        for code_block in code_blocks:
+            for path in _local_modules(code_block.code, search_dirs):
+                inputs[os.path.relpath(path, self.work_dir)] = path
+
+        snapshot = {}
+        for relpath, path in inputs.items():
+            try:
+                snapshot[relpath] = self.file_digest(path)
+            except OSError:
+                continue
+        return snapshot
+
+    @staticmethod
+    def _inputs_key(snapshot, outputs):
+        inputs = sorted((path, digest) for path, digest in snapshot.items() if path not in outputs)
+        return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+    def _entry_dir(self, code_key):
+        return os.path.join(self.cache_dir, "entries", code_key)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    def lookup(self, code_key, snapshot):
+        """The cached entry of the code for the current inputs, or None."""
+        entry_dir = self._entry_dir(code_key)
+        try:
+            names = sorted(os.listdir(entry_dir))
+        except OSError:
+            return None
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(entry_dir, name)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            outputs = {artifact["path"] for artifact in entry["artifacts"]}
+            if self._inputs_key(snapshot, outputs) == entry["inputs_key"]:
+                return entry
+        return None
+
+    def restore(self, entry):
+        """Write back the files of a cached entry. Returns False if a blob is missing."""
+        for artifact in entry["artifacts"]:
+            blob = self._blob_path(artifact["sha256"])
+            if not os.path.exists(blob):
+                return False
+        for artifact in entry["artifacts"]:
+            path = os.path.join(self.work_dir, artifact["path"])
+            try:
+                if os.path.exists(path) and self.file_digest(path) == artifact["sha256"]:
+                    continue
+            except OSError:
+                pass
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+            os.close(fd)
+            shutil.copyfile(self._blob_path(artifact["sha256"]), tmp_path)
+            os.replace(tmp_path, path)
+        return True
+
+    def store(self, code_key, snapshot, result, records):
+        """Cache a successful execution: its output and the files of its artifact records."""
+        artifacts = []
+        total_size = 0
+        for record in records:
+            path = record["path"]
+            relpath = os.path.relpath(path, self.work_dir)
+            if relpath.startswith("..") or not os.path.isfile(path):
+                continue
+            total_size += os.path.getsize(path)
+            artifacts.append((relpath, path))
+        if total_size > self.max_entry_mb * 1024 ** 2:
+            logger.info(f"execution not cached, it wrote {total_size / 1024 ** 2:.0f} MB")
+            return None
+
+        entry_artifacts = []
+        for relpath, path in artifacts:
+            digest = self.file_digest(path)
+            # recorded (within the mtime margin of the manifest) but not changed by the execution: an input
+            if snapshot.get(relpath) == digest:
+                continue
+            blob = self._blob_path(digest)
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob), prefix=".tmp_")
+                os.close(fd)
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, blob)
+            entry_artifacts.append({"path": relpath, "sha256": digest})
+
+        outputs = {artifact["path"] for artifact in entry_artifacts}
+        inputs_key = self._inputs_key(snapshot, outputs)
+        entry = {"exit_code": result.exit_code, "output": result.output, "inputs_key": inputs_key,
+                 "artifacts": entry_artifacts}
+        entry_dir = self._entry_dir(code_key)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, prefix=".tmp_")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, os.path.join(entry_dir, inputs_key[:32] + ".json"))
+        return entry
+
+    def replay(self, code_key, snapshot):
+        """The CommandLineCodeResult of a cached identical execution (its files restored), or None."""
+        entry = self.lookup(code_key, snapshot)
+        if entry is None or not self.restore(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        print("\n replaying the output of an identical execution from the cache....\n")
+        print(entry["output"])
+        return CommandLineCodeResult(exit_code=entry["exit_code"], output=entry["output"])
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def summary(self):
+        return f"{self.hits}/{self.hits + self.misses} executions replayed from the cache"
+
+
+def get_execution_cache(execution_cache, work_dir):
+    """ExecutionCache from the execution_cache option: None/False (no cache), True (defaults) or a dict of ExecutionCache arguments."""
+    if not execution_cache:
+        return None
+    return ExecutionCache(work_dir, **(execution_cache if isinstance(execution_cache, dict) else {}))
@@ -0,0 +1,340 @@
+"""
+Static check of the code blocks before they are executed.
+
+Many failed executions could be told without running anything: an
+IndentationError, a name that is never defined, the import of a module that is
+not installed. StaticCheck runs in-process before the executor starts a
+process (or a fork, or a kernel cell) for a python block:
+
+- the indentation errors of LLM structured output are fixed when a single
+  re-indented line compiles (``fix_indentation``, from the engineer formatter of
+  the old package), and the "./data", "../data" paths are pointed to the
+  database_path (``fix_data_paths``);
+- the code must then compile;
+- the names loaded but never bound anywhere in the script (nor builtins) are
+  reported, as pyflakes would (conservatively: scopes are not told apart);
+- the top-level modules imported outside of try blocks must be found in the
+  execution environment, or be local modules of the codebase.
+
+When one of these fails, the code is not executed and the executor returns the
+diagnostics as a failed execution, starting with ``static_check_marker`` (see
+execution_routing.py, which sends them back to the engineer).
+"""
+
+from autogen.code_utils import PYTHON_VARIANTS
+from autogen.coding.base import CodeBlock, CommandLineCodeResult
+import ast
+import builtins
+import importlib.util
+import logging
+import os
+import re
+import sys
+import warnings
+
+logger = logging.getLogger(__name__)
+
+# first words of the output of a code block stopped by the static check
+static_check_marker = "Static check failed"
+
+_filename_line = re.compile(r"^\s*#\s*filename:\s*(.+?)\s*$")
+
+# module-level names defined by the interpreter
+_module_names = {"__file__", "__name__", "__builtins__", "__doc__", "__spec__", "__loader__", "__package__",
+                 "__path__", "__annotations__", "__cached__"}
+
+# calls that can define names dynamically, the undefined names are not checked when they are used
+_dynamic_calls = {"exec", "eval", "globals", "locals", "vars", "__import__"}
+
+
+def fix_indentation(code, max_attempts=10):
+    """
+    Fix the indentation errors introduced by LLM structured output (typically one extra space at the start of a line).
+
+    For each line reported by compile(), the indentation of the nearest line above (one level deeper
+    if it opens a block, one level shallower), of the nearest line below, and zero are tried in turn;
+    the first one that compiles is kept. Up to max_attempts lines are fixed.
+
+    Returns:
+        (str, list): The code, unchanged if it has another syntax error or no candidate works, and the fixed line numbers.
+    """
+    fixed_lines = []
+    for attempt in range(max_attempts):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", SyntaxWarning)
+                compile(code, "<string>", "exec")
+            return code, fixed_lines
+        except IndentationError as exc:
+            lines = code.splitlines()
+            if exc.lineno is None or not 0 < exc.lineno <= len(lines):
+                return code, fixed_lines
+            bad_idx = exc.lineno - 1
+            bad_content = lines[bad_idx].lstrip()
+            if not bad_content:
+                return code, fixed_lines
+
+            candidates = []
+            for i in range(bad_idx - 1, -1, -1):
+                stripped = lines[i].lstrip()
+                if stripped and not stripped.startswith("#"):
+                    above_indent = lines[i][: len(lines[i]) - len(stripped)]
+                    candidates.append(above_indent)
+                    if stripped.rstrip().endswith(":"):
+                        candidates.append(above_indent + "    ")
+                    if len(above_indent) >= 4:
+                        candidates.append(above_indent[:-4])
+                    break
+            for i in range(bad_idx + 1, len(lines)):
+                stripped = lines[i].lstrip()
+                if stripped and not stripped.startswith("#"):
+                    candidates.append(lines[i][: len(lines[i]) - len(stripped)])
+                    break
+            candidates.append("")
+            candidates = list(dict.fromkeys(candidates))
+
+            for candidate in candidates:
+                trial_lines = lines[:]
+                trial_lines[bad_idx] = candidate + bad_content
+                trial_code = "\n".join(trial_lines)
+                try:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", SyntaxWarning)
+                        compile(trial_code, "<string>", "exec")
+                except SyntaxError:
+                    continue
+                code = trial_code
+                break
+            else:
+                # no candidate compiles on its own, the best guess may still let a later line be fixed
+                best = candidates[-2] if len(candidates) >= 2 else candidates[0]
+                lines[bad_idx] = best + bad_content
+                code = "\n".join(lines)
+            fixed_lines.append(exc.lineno)
+        except SyntaxError:
+            # not an indentation issue
+            return code, fixed_lines
+    return code, fixed_lines
+
+
+def fix_data_paths(code, database_path="data/"):
+    """
+    Point the hardcoded "./data", "../data" (and data_dir = "data") paths of the code to database_path.
+
+    Returns:
+        (str, list): The code and a description of each fix.
+    """
+    db_path_clean = database_path.rstrip("/")
+    fixes = []
+
+    def fix_data_dir(match):
+        prefix, quote, old_path = match.group(1), match.group(2), match.group(3)
+        if old_path.rstrip("/") != db_path_clean:
+            fixes.append(f"data_dir assignment: {old_path!r} -> {database_path!r}")
+            return prefix + quote + database_path + quote
+        return match.group(0)
+
+    def fix_path_in_call(match):
+        prefix, quote, bad_prefix, rest = match.group(1), match.group(2), match.group(3), match.group(4) or ""
+        fixes.append(f"path in function call: {bad_prefix + rest!r} -> {database_path + rest.lstrip('/')!r}")
+        return prefix + quote + database_path + rest.lstrip("/") + quote
+
+    def fix_concat_path(match):
+        fixes.append(f"concatenated path: {match.group(3)!r} -> {database_path!r}")
+        return match.group(1) + match.group(2) + database_path + match.group(2) + match.group(5)
+
+    def fix_save_load(match):
+        func, quote, bad_prefix, filename = match.group(1), match.group(2), match.group(3), match.group(4)
+        fixes.append(f"{func} path: {bad_prefix + filename!r} -> {database_path + filename!r}")
+        return func + "(" + quote + database_path + filename + quote
+
+    code = re.sub(r'''(data_dir\s*=\s*)(['"])(\.{0,2}/?data/?)\2''', fix_data_dir, code)
+    code = re.sub(r'''(os\.path\.join\s*\(\s*|open\s*\(\s*)(['"])(\.{1,2}/data)(/[^'"]*)?\2''', fix_path_in_call, code)
+    code = re.sub(r'''(\+\s*)(['"])(\.{1,2}/data/?)(\2)(\s*\+)''', fix_concat_path, code)
+    code = re.sub(r'''(savefig|np\.save|np\.load|pd\.to_csv|pd\.read_csv|to_csv|read_csv|save|load)\s*\(\s*(['"])(\.{1,2}/data/)([^'"]+)\2''',
+                  fix_save_load, code)
+    return code, fixes
+
+
+def _bound_names(tree):
+    """Every name bound anywhere in tree, whatever its scope."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.alias):
+            names.add(node.asname or node.name.split(".")[0])
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def undefined_names(tree):
+    """
+    (line, name) of the names loaded in tree that are bound nowhere in it and are not builtins.
+    Nothing is reported for code with star imports or calls that can define names (exec, globals, ...).
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == "*" for alias in node.names):
+            return []
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _dynamic_calls:
+            return []
+    defined = _bound_names(tree) | set(dir(builtins)) | _module_names
+    undefined = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in defined:
+            undefined.setdefault(node.id, node.lineno)
+    return sorted((line, name) for name, line in undefined.items())
+
+
+def _try_bodies(tree):
+    """ids of the statements in the body of a try block (optional imports)."""
+    ids = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Try, getattr(ast, "TryStar", ast.Try))):
+            for statement in node.body:
+                ids.update(id(child) for child in ast.walk(statement))
+    return ids
+
+
+def _is_available(module, search_dirs):
+    for directory in search_dirs:
+        if os.path.exists(os.path.join(directory, module + ".py")) or os.path.isdir(os.path.join(directory, module)):
+            return True
+    if module in sys.builtin_module_names:
+        return True
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def missing_imports(tree, search_dirs=()):
+    """
+    (line, module) of the top-level modules imported in tree (outside of try blocks) that are neither
+    local (a module or package in search_dirs) nor found in the current environment.
+    """
+    optional = _try_bodies(tree)
+    missing = {}
+    for node in ast.walk(tree):
+        if id(node) in optional:
+            continue
+        if isinstance(node, ast.Import):
+            modules = [alias.name.split(".")[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules = [node.module.split(".")[0]]
+        else:
+            continue
+        for module in modules:
+            if module not in missing and not _is_available(module, search_dirs):
+                missing[module] = node.lineno
+    return sorted((line, module) for module, line in missing.items())
+
+
+class StaticCheck:
+    """
+    Static check of the python blocks of an executor, before they are run.
+
+    Args:
+        database_path (str): Folder of the data, relative to the work_dir, the "./data" paths are fixed to. Defaults to "data/".
+        fix_indentation (bool): Whether the indentation errors are fixed.
+        fix_data_paths (bool): Whether the data paths are fixed.
+        check_undefined_names (bool): Whether the undefined names are reported.
+        check_imports (bool): Whether the imports of modules that are not installed are reported.
+    """
+
+    def __init__(self, database_path="data/", fix_indentation=True, fix_data_paths=True,
+                 check_undefined_names=True, check_imports=True):
+        self.database_path = database_path
+        self.fix_indentation = fix_indentation
+        self.fix_data_paths = fix_data_paths
+        self.check_undefined_names = check_undefined_names
+        self.check_imports = check_imports
+
+    def check_code(self, code, work_dir, filename=None, namespace_persists=False):
+        """
+        Fix and check the code of a python block.
+
+        Args:
+            code (str): The code.
+            work_dir (str): Work directory the code is run from.
+            filename (str, optional): Path of the script relative to work_dir (its `# filename:` line).
+            namespace_persists (bool): Whether the names of previous executions are defined (warm kernel),
+                the undefined names are then not reported.
+
+        Returns:
+            (str, list): The fixed code and the diagnostics (empty if the code can be run).
+        """
+        if self.fix_indentation:
+            code, fixed_lines = fix_indentation(code)
+            if fixed_lines:
+                logger.info(f"static check: fixed the indentation of line(s) {fixed_lines} of {filename}")
+        if self.fix_data_paths:
+            code, fixes = fix_data_paths(code, self.database_path)
+            for fix in fixes:
+                logger.info(f"static check: fixed {fix} in {filename}")
+
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", SyntaxWarning)
+                tree = ast.parse(code, filename or "<string>")
+        except SyntaxError as exc:
+            location = f"line {exc.lineno}: " if exc.lineno else ""
+            text = f"\n      {exc.text.strip()}" if exc.text and exc.text.strip() else ""
+            return code, [f"{location}{type(exc).__name__}: {exc.msg}{text}"]
+
+        diagnostics = []
+        if self.check_undefined_names and not namespace_persists:
+            diagnostics += [f"line {line}: NameError: name '{name}' is not defined" for line, name in undefined_names(tree)]
+        if self.check_imports:
+            work_dir = os.path.abspath(str(work_dir))
+            search_dirs = [work_dir, os.path.join(work_dir, "codebase")]
+            if filename is not None:
+                search_dirs.insert(0, os.path.dirname(os.path.join(work_dir, filename)))
+            diagnostics += [f"line {line}: ModuleNotFoundError: No module named '{module}' in the execution environment"
+                            for line, module in missing_imports(tree, search_dirs)]
+        return code, diagnostics
+
+    def check_code_blocks(self, code_blocks, work_dir, namespace_persists=False):
+        """
+        Fix and check the python blocks.
+
+        Returns:
+            (list, CommandLineCodeResult): The fixed code blocks, and the failed result to return instead
+            of running them (None if they can be run).
+        """
+        checked_blocks = []
+        for code_block in code_blocks:
+            if code_block.language.lower() not in PYTHON_VARIANTS:
+                checked_blocks.append(code_block)
+                continue
+            first_line = code_block.code.lstrip().split("\n", 1)[0]
+            match = _filename_line.match(first_line)
+            filename = match.group(1) if match is not None else None
+            code, diagnostics = self.check_code(code_block.code, work_dir, filename, namespace_persists)
+            if diagnostics:
+                output = (f"{static_check_marker} for {filename or 'the code block'}, the code was not executed:\n"
+                          + "".join(f"  {diagnostic}\n" for diagnostic in diagnostics))
+                print("\n" + output)
+                return checked_blocks, CommandLineCodeResult(exit_code=1, output=output)
+            checked_blocks.append(CodeBlock(code=code, language=code_block.language))
+        return checked_blocks, None
+
+
+def get_static_check(static_check):
+    """StaticCheck from the static_check option: None/False (no check), True (defaults) or a dict of StaticCheck arguments."""
+    if not static_check:
+        return None
+    if isinstance(static_check, StaticCheck):
+        return static_check
+    return StaticCheck(**(static_check if isinstance(static_check, dict) else {}))
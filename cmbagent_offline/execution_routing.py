@@ -0,0 +1,227 @@
+# cmbagent/execution_routing.py
+#
+# Rule-based routing after a code execution. The executor_response_formatter
+# makes an LLM call only to pick the arguments of post_execution_transfer, while
+# most of the time they follow from the execution result:
+#   - success -> control,
+#   - ModuleNotFoundError (of a module that is not part of the codebase) -> installer,
+#   - an error raised in camb (classy) -> camb_context (classy_context),
+#   - another python error, or a timeout -> engineer,
+#   - code stopped by the static check (see execution/static_check.py) -> engineer
+#     with its diagnostics (installer if only modules are missing).
+# When the rules are confident, the formatter replies with the post_execution_transfer
+# tool call itself; otherwise (cobaya, classy_sz, no traceback, ...) the LLM is called
+# as before. The number of executions routed each way is counted.
+import os
+import re
+import json
+import uuid
+from collections import Counter, namedtuple
+import autogen
+
+from .tracing import current_span
+from .execution.static_check import static_check_marker
+
+cmbagent_debug = autogen.cmbagent_debug
+
+RoutingDecision = namedtuple("RoutingDecision", ["execution_status", "next_agent_suggestion", "fix_suggestion", "reason"])
+
+# exit code of a timed out execution
+TIMEOUT_EXIT_CODE = 124
+
+_exitcode = re.compile(r"exitcode:\s*(-?\d+)")
+_traceback_location = re.compile(r'File "([^"]+)", line (\d+)')
+_exception_line = re.compile(r"^\s*([A-Za-z_][\w.]*(?:Error|Exception|Interrupt|Exit|Warning))\b:?(.*)$", re.MULTILINE)
+_missing_module = re.compile(r"No module named '([^']+)'")
+
+# packages whose errors are routed to the agent consulting their documentation,
+# as (agent, package directories of the traceback frames, exception names)
+package_context_agents = [
+    ('camb_context', ('/camb/',), ('CAMBError', 'CAMBParamRangeError', 'CAMBValueError', 'CAMBUnknownArgumentError')),
+    ('classy_context', ('/classy', 'classy.pyx'), ('CosmoSevereError', 'CosmoComputationError', 'CosmoError')),
+]
+
+# packages whose errors are left to the LLM (the agents for them are not always in the roster)
+llm_packages = ('/cobaya/', '/classy_sz/', 'classy_sz')
+
+
+def parse_execution_message(text):
+    """
+    Exit code and output of the executor message of a code execution, or (None, None) if text is not one.
+    The exit code of the "Execution results:" / "execution results:" messages is 0 / 1, or 124 after a timeout.
+    """
+    match = _exitcode.search(text)
+    if match is not None:
+        exit_code = int(match.group(1))
+        return exit_code, text[match.end():]
+    stripped = text.lstrip()
+    if stripped.startswith("Execution results:"):
+        return 0, stripped[len("Execution results:"):]
+    if stripped.startswith("execution results:"):
+        output = stripped[len("execution results:"):]
+        return (TIMEOUT_EXIT_CODE if output.rstrip().endswith("Timeout") else 1), output
+    return None, None
+
+
+def _top_level_module(name):
+    return name.split(".")[0]
+
+
+def _is_local_module(module, work_dir):
+    if work_dir is None:
+        return False
+    top = _top_level_module(module)
+    for directory in (work_dir, os.path.join(work_dir, "codebase")):
+        if os.path.exists(os.path.join(directory, top + ".py")) or os.path.isdir(os.path.join(directory, top)):
+            return True
+    return top == "codebase"
+
+
+def classify_execution(exit_code, output, work_dir=None):
+    """
+    Route an execution result (exit code and output of the CodeResult) by rules.
+
+    Args:
+        exit_code (int): Exit code of the execution.
+        output (str): Output of the execution.
+        work_dir (str, optional): Work directory of the code, to tell local modules from missing packages.
+
+    Returns:
+        RoutingDecision, or None if the case is left to the LLM.
+    """
+    # the output of a block stopped by the static check starts with the marker (after "Execution output:")
+    marker_position = output.find(static_check_marker, 0, 100)
+    if exit_code != 0 and marker_position >= 0:
+        return classify_static_check(output[marker_position:])
+
+    has_traceback = "Traceback (most recent call last)" in output
+    if exit_code == 0:
+        # a traceback in a successful run (caught error, warning dumps, ...) is for the LLM to judge
+        if has_traceback:
+            return None
+        return RoutingDecision("success", "control", None, "success")
+
+    if exit_code == TIMEOUT_EXIT_CODE:
+        return RoutingDecision("failure", "engineer",
+                               "The execution timed out: make the code faster (smaller grids, fewer samples, vectorized loops).",
+                               "timeout")
+
+    if not has_traceback:
+        return None
+    exceptions = _exception_line.findall(output)
+    if not exceptions:
+        return None
+    exception, message = exceptions[-1]
+    exception_name = exception.split(".")[-1]
+    frames = _traceback_location.findall(output)
+    innermost = frames[-1] if frames else None
+    location = f' (File "{innermost[0]}", line {innermost[1]})' if innermost else ""
+    error = f"{exception}:{message}".rstrip(":").strip()
+
+    if exception_name in ("ModuleNotFoundError", "ImportError"):
+        missing = _missing_module.search(output)
+        if missing is not None and not _is_local_module(missing.group(1), work_dir):
+            return RoutingDecision("failure", "installer", f"Install the missing module {missing.group(1)}.", "missing module")
+        if missing is not None:
+            return RoutingDecision("failure", "engineer", f"Fix the import of the local module {missing.group(1)}{location}.", "local import error")
+        return None
+
+    paths = [path for path, _ in frames]
+    if any(package in path for path in paths for package in llm_packages) or "classy_sz" in exception:
+        return None
+    for agent, package_dirs, exception_names in package_context_agents:
+        package = agent.split("_")[0]
+        if (exception_name in exception_names or exception.startswith(package + ".")
+                or (innermost is not None and any(package_dir in innermost[0] for package_dir in package_dirs))):
+            return RoutingDecision("failure", agent, f"Fix the {package} error {error}{location}.", f"{package} error")
+
+    return RoutingDecision("failure", "engineer", f"Fix the error {error}{location}.", "python error")
+
+
+def classify_static_check(output):
+    """Route the diagnostics of a code block stopped by the static check."""
+    diagnostics = [line.strip() for line in output.strip().splitlines()[1:] if line.strip()]
+    missing = [_missing_module.search(diagnostic) for diagnostic in diagnostics]
+    if diagnostics and all(missing):
+        modules = ", ".join(match.group(1) for match in missing)
+        return RoutingDecision("failure", "installer", f"Install the missing module(s) {modules}.", "static check")
+    return RoutingDecision("failure", "engineer",
+                           "Fix the problems found before execution (the code was not run): " + "; ".join(diagnostics),
+                           "static check")
+
+
+class ExecutionRouter:
+    """
+    Reply function of the executor_response_formatter routing the execution results by rules (see classify_execution).
+
+    Args:
+        agent_object: The executor_response_formatter (BaseAgent), its work_dir is read at each execution.
+        cmbagent_instance: The CMBAgent, only the agents of its roster are routed to.
+        static_check_only (bool): Only route the code blocks stopped by the static check, the LLM routes the executions.
+    """
+
+    def __init__(self, agent_object, cmbagent_instance, static_check_only=False):
+        self.agent_object = agent_object
+        self.cmbagent_instance = cmbagent_instance
+        self.static_check_only = static_check_only
+        # number of executions routed by each rule, and by the llm
+        self.counts = Counter()
+
+    def route(self, text):
+        exit_code, output = parse_execution_message(text)
+        if exit_code is None:
+            return None
+        decision = classify_execution(exit_code, output, work_dir=getattr(self.agent_object, "work_dir", None))
+        if decision is not None and self.static_check_only and decision.reason != "static check":
+            return None
+        if decision is not None and self.cmbagent_instance.find_agent_object(decision.next_agent_suggestion) is None:
+            return None
+        return decision
+
+    def reply(self, recipient, messages=None, sender=None, config=None):
+        content = messages[-1].get("content") if messages else None
+        decision = self.route(content) if isinstance(content, str) else None
+        span = current_span()
+        if decision is None:
+            self.counts["llm"] += 1
+            if span is not None:
+                span.attributes["routing"] = "llm"
+            return False, None
+
+        self.counts[f"rule: {decision.reason}"] += 1
+        if span is not None:
+            span.attributes["routing"] = decision.reason
+        if cmbagent_debug:
+            print(f"\n\nexecution routed by rule ({decision.reason}) to {decision.next_agent_suggestion}: {self.summary()}")
+        arguments = {"execution_status": decision.execution_status,
+                     "next_agent_suggestion": decision.next_agent_suggestion}
+        if decision.fix_suggestion is not None:
+            arguments["fix_suggestion"] = decision.fix_suggestion
+        return True, {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": "post_execution_transfer", "arguments": json.dumps(arguments)},
+            }],
+        }
+
+    @property
+    def n_routed_by_rules(self):
+        return sum(count for path, count in self.counts.items() if path != "llm")
+
+    def summary(self):
+        total = sum(self.counts.values())
+        if total == 0:
+            return "no execution routed"
+        paths = ", ".join(f"{path}: {count}" for path, count in self.counts.most_common())
+        return f"{self.n_routed_by_rules}/{total} executions routed by rules ({paths})"
+
+
+def add_execution_routing(agent_object, cmbagent_instance, static_check_only=False):
+    """Have the executor_response_formatter route the execution results by rules before calling its LLM. Returns the router."""
+    from autogen import Agent
+    router = ExecutionRouter(agent_object, cmbagent_instance, static_check_only=static_check_only)
+    agent_object.agent.register_reply([Agent, None], router.reply, position=0)
+    return router
@@ -3,6 +3,7 @@ import os
 import re
 import ast
 import base64
+import threading
 from autogen.cmbagent_utils import cmbagent_debug
 from IPython.display import Image as IPImage, display as ip_display
 from IPython.display import Markdown
@@ -10,12 +11,15 @@ from autogen.cmbagent_utils import IMG_WIDTH
 import autogen
 from autogen.agentchat.group import ContextVariables
 from autogen.agentchat.group import AgentTarget, ReplyResult, TerminateTarget
-from autogen import register_function
+from autogen import register_function as autogen_register_function
 from typing import Optional
 import datetime
 import json
 from pathlib import Path
-from .utils import AAS_keywords_dict
+from .utils import get_aas_keywords_dict
+from .codebase_index import get_codebase_index
+from .execution import get_artifact_manifest
+from .tracing import traced
 from .vlm_utils import account_for_external_api_calls, send_image_to_vlm, create_vlm_prompt, call_external_plot_debugger, vlm_model
 
 cmbagent_debug = autogen.cmbagent_debug
@@ -49,46 +53,86 @@ cmbagent_disable_display = autogen.cmbagent_disable_display
 #     )
 
 
-def register_functions_to_agents(cmbagent_instance):
+# agents each registered function can hand off to through its ReplyResult target,
+# keyed by the agent the function is registered to.
+function_hand_off_targets = {
+    'executor_response_formatter': ['terminator', 'plot_judge', 'control', 'engineer', 'classy_sz_agent',
+                                    'camb_agent', 'camb_context', 'classy_context', 'installer'],
+    'plot_judge': ['control', 'plot_debugger'],
+    'plot_debugger': ['control', 'engineer'],
+    'task_recorder': ['planner'],
+    'aas_keyword_finder': ['aas_keyword_finder', 'control'],
+    'plan_recorder': ['terminator', 'plan_reviewer'],
+    'plan_setter': ['planner'],
+    'review_recorder': ['planner'],
+    'control': ['control', 'engineer', 'researcher', 'researcher_response_formatter', 'camb_agent', 'cobaya_agent',
+                'perplexity', 'idea_maker', 'idea_hater', 'classy_sz_agent', 'planck_agent', 'camb_context',
+                'classy_context', 'admin', 'terminator'],
+    'control_starter': ['engineer', 'researcher', 'camb_agent', 'cobaya_agent', 'perplexity', 'idea_maker',
+                        'idea_hater', 'classy_sz_agent', 'planck_agent', 'camb_context', 'classy_context'],
+}
+
+
+def register_functions_to_agents(cmbagent_instance, agent_names=None):
     '''
     This function registers the functions to the agents.
+
+    Only the agents in agent_names (all agents of the roster by default) get their functions registered.
     '''
-    task_recorder = cmbagent_instance.get_agent_from_name('task_recorder')
-    task_improver = cmbagent_instance.get_agent_from_name('task_improver')
-    planner = cmbagent_instance.get_agent_from_name('planner')
-    planner_response_formatter = cmbagent_instance.get_agent_from_name('planner_response_formatter')
-    plan_recorder = cmbagent_instance.get_agent_from_name('plan_recorder')
-    plan_reviewer = cmbagent_instance.get_agent_from_name('plan_reviewer')
-    reviewer_response_formatter = cmbagent_instance.get_agent_from_name('reviewer_response_formatter')
-    review_recorder = cmbagent_instance.get_agent_from_name('review_recorder')
-    researcher = cmbagent_instance.get_agent_from_name('researcher')
-    researcher_response_formatter = cmbagent_instance.get_agent_from_name('researcher_response_formatter')
-    engineer = cmbagent_instance.get_agent_from_name('engineer')
-    engineer_response_formatter = cmbagent_instance.get_agent_from_name('engineer_response_formatter')
-
-    executor = cmbagent_instance.get_agent_from_name('executor')
-    executor_response_formatter = cmbagent_instance.get_agent_from_name('executor_response_formatter')
-    terminator = cmbagent_instance.get_agent_from_name('terminator')
-    control = cmbagent_instance.get_agent_from_name('control')
-    admin = cmbagent_instance.get_agent_from_name('admin')
-    perplexity = cmbagent_instance.get_agent_from_name('perplexity')
-    aas_keyword_finder = cmbagent_instance.get_agent_from_name('aas_keyword_finder')
-    plan_setter = cmbagent_instance.get_agent_from_name('plan_setter')
-    idea_maker = cmbagent_instance.get_agent_from_name('idea_maker')
-    installer = cmbagent_instance.get_agent_from_name('installer')
-    idea_saver = cmbagent_instance.get_agent_from_name('idea_saver')
-    control_starter = cmbagent_instance.get_agent_from_name('control_starter')
-    camb_context = cmbagent_instance.get_agent_from_name('camb_context')
-    classy_context = cmbagent_instance.get_agent_from_name('classy_context')
-    plot_judge = cmbagent_instance.get_agent_from_name('plot_judge')
-    plot_debugger = cmbagent_instance.get_agent_from_name('plot_debugger')
+    if agent_names is None:
+        agent_names = [agent.name for agent in cmbagent_instance.agents]
+    agent_names = set(agent_names)
+
+    def get(name):
+        agent_object = cmbagent_instance.find_agent_object(name)
+        return agent_object.agent if agent_object is not None else None
+
+    def register_function(f, caller, executor, description):
+        # skip agents that are not built yet or already registered
+        if caller is not None and caller.name in agent_names:
+            # the span wrapper keeps the signature, that autogen turns into the tool schema
+            autogen_register_function(traced("function")(f), caller=caller, executor=executor, description=description)
+
+    def add_single_function(agent, f):
+        if agent is not None and agent.name in agent_names:
+            agent._add_single_function(traced("function")(f))
+
+    task_recorder = get('task_recorder')
+    task_improver = get('task_improver')
+    planner = get('planner')
+    planner_response_formatter = get('planner_response_formatter')
+    plan_recorder = get('plan_recorder')
+    plan_reviewer = get('plan_reviewer')
+    reviewer_response_formatter = get('reviewer_response_formatter')
+    review_recorder = get('review_recorder')
+    researcher = get('researcher')
+    researcher_response_formatter = get('researcher_response_formatter')
+    engineer = get('engineer')
+    engineer_response_formatter = get('engineer_response_formatter')
+
+    executor = get('executor')
+    executor_response_formatter = get('executor_response_formatter')
+    terminator = get('terminator')
+    control = get('control')
+    admin = get('admin')
+    perplexity = get('perplexity')
+    aas_keyword_finder = get('aas_keyword_finder')
+    plan_setter = get('plan_setter')
+    idea_maker = get('idea_maker')
+    installer = get('installer')
+    idea_saver = get('idea_saver')
+    control_starter = get('control_starter')
+    camb_context = get('camb_context')
+    classy_context = get('classy_context')
+    plot_judge = get('plot_judge')
+    plot_debugger = get('plot_debugger')
     
     if not cmbagent_instance.skip_rag_agents:
-        classy_sz = cmbagent_instance.get_agent_from_name('classy_sz_agent')
-        classy_sz_response_formatter = cmbagent_instance.get_agent_from_name('classy_sz_response_formatter')
-        camb = cmbagent_instance.get_agent_from_name('camb_agent')
-        camb_response_formatter = cmbagent_instance.get_agent_from_name('camb_response_formatter')
-        planck = cmbagent_instance.get_agent_from_name('planck_agent')
+        classy_sz = get('classy_sz_agent')
+        classy_sz_response_formatter = get('classy_sz_response_formatter')
+        camb = get('camb_agent')
+        camb_response_formatter = get('camb_response_formatter')
+        planck = get('planck_agent')
 
     # print("Perplexity API key: ", os.getenv("PERPLEXITY_API_KEY"))
     # perplexity_search_tool = PerplexitySearchTool(
@@ -136,9 +180,9 @@ def register_functions_to_agents(cmbagent_instance):
         # Transfer executed code from global variable to shared context
         try:
             import cmbagent.vlm_utils
-            if getattr(cmbagent.vlm_utils, "_last_executed_code", None):
-                context_variables["latest_executed_code"] = cmbagent.vlm_utils._last_executed_code
-                cmbagent.vlm_utils._last_executed_code = None  # Prevent reuse
+            if cmbagent.vlm_utils._last_executed_code.get():
+                context_variables["latest_executed_code"] = cmbagent.vlm_utils._last_executed_code.get()
+                cmbagent.vlm_utils._last_executed_code.set(None)  # Prevent reuse
             else:
                 context_variables["latest_executed_code"] = None
         except Exception:
@@ -180,16 +224,13 @@ xxxxxxxxxxxxxxxxxxxxxxxxxx
                 
                 if evaluate_plots:
                     # Check if there are new images that need plot_judge review
-                    data_directory = os.path.join(cmbagent_instance.work_dir, context_variables['database_path'])
-                    image_files = load_plots(data_directory)
-                    displayed_images = context_variables.get("displayed_images", [])
-                    new_images = [img for img in image_files if img not in displayed_images]
+                    new_images = load_new_plots(cmbagent_instance, context_variables)
                     
                     if new_images:
                         # Call VLM to evaluate the latest plot
                         most_recent_image = new_images[-1]
                         context_variables["latest_plot_path"] = most_recent_image
-                        if most_recent_image not in context_variables["displayed_images"]:
+                        if most_recent_image not in displayed_images_index(context_variables):
                             context_variables["displayed_images"].append(most_recent_image)
                         # Handoff to plot_judge
                         return ReplyResult(target=AgentTarget(plot_judge),
@@ -420,7 +461,7 @@ For the next agent suggestion, follow these rules:
 
         # Update displayed_images list
         if "latest_plot_path" in context_variables and "displayed_images" in context_variables:
-            if context_variables["latest_plot_path"] not in context_variables["displayed_images"]:
+            if context_variables["latest_plot_path"] not in displayed_images_index(context_variables):
                 context_variables["displayed_images"].append(context_variables["latest_plot_path"])
 
         if verdict == "continue":
@@ -530,7 +571,7 @@ For the next agent suggestion, follow these rules:
                             context_variables=context_variables)
 
 
-    terminator._add_single_function(terminate_session)
+    add_single_function(terminator, terminate_session)
     # terminator.functions = [terminate_session]
 
 
@@ -553,7 +594,7 @@ For the next agent suggestion, follow these rules:
                             context_variables=context_variables)
 
 
-    task_recorder._add_single_function(record_improved_task)
+    add_single_function(task_recorder, record_improved_task)
 
 
     def record_aas_keywords(aas_keywords: list[str], context_variables: ContextVariables) -> ReplyResult:
@@ -567,6 +608,8 @@ For the next agent suggestion, follow these rules:
         
         # print('aas_keywords: ', aas_keywords)
 
+        AAS_keywords_dict = get_aas_keywords_dict()
+
         for keyword in aas_keywords:
             if keyword not in AAS_keywords_dict:
                 return ReplyResult(target=AgentTarget(aas_keyword_finder), ## loop-back 
@@ -703,7 +746,7 @@ You must not invoke any other agent than the ones listed above.
                            message="Plan constraints have been logged.",
                            context_variables=context_variables)
 
-    plan_setter._add_single_function(record_plan_constraints)
+    add_single_function(plan_setter, record_plan_constraints)
 
 
     def record_review(plan_review: str, context_variables: ContextVariables) -> ReplyResult:
@@ -815,30 +858,12 @@ Now, update the plan accordingly, planner!""",
 
             codes = os.path.join(cmbagent_instance.work_dir, context_variables['codebase_path'])
             # print("loading docstrings...")
-            docstrings = load_docstrings(codes)
+            codebase_index = get_codebase_index(codes)
             # print("docstrings loaded!")
             # print("="*70)
             # print("\n\n")
-            output_str = ""
-            for module, info in docstrings.items():
-                output_str += "-----------\n"
-                output_str += f"Filename: {module}.py\n"
-                output_str += f"File path: {info['file_path']}\n\n"
-
-                # Show parse errors (if any) ✨
-                if "error" in info:
-                    output_str += f"⚠️  Parse error: {info['error']}\n\n"
-
-                output_str += "Available functions:\n"
-
-                if info["functions"]:                          # non-empty dict
-                    for func, doc in info["functions"].items():
-                        output_str += f"function name: {func}\n"
-                        output_str += "````\n"
-                        output_str += f"{doc or '(no docstring)'}\n"
-                        output_str += "````\n\n"
-                else:
-                    output_str += "(none)\n\n"
+            # rendered fragments are cached per module, see codebase_index.py
+            output_str = codebase_index.render()
 
             # Store the full output string in your context variable.
             context_variables["current_codebase"] = output_str
@@ -847,15 +872,11 @@ Now, update the plan accordingly, planner!""",
             # print("="*70)
             # print("\n\n")
 
-            # Load image plots from the "data" directory.
-            data_directory = os.path.join(cmbagent_instance.work_dir, context_variables['database_path'])
-            image_files = load_plots(data_directory)
-    
             # Retrieve the list of images that have been displayed so far.
             displayed_images = context_variables.get("displayed_images", [])
 
-            # Identify new images that haven't been displayed before.
-            new_images = [img for img in image_files if img not in displayed_images]
+            # Identify new images of the "data" directory that haven't been displayed before.
+            new_images = load_new_plots(cmbagent_instance, context_variables)
 
             # Display only the new images.
             for img_file in new_images:
@@ -1005,7 +1026,7 @@ Now, update the plan accordingly, planner!""",
 
             codes = os.path.join(cmbagent_instance.work_dir, context_variables['codebase_path'])
             # print(f"loading docstrings from {codes}...")
-            docstrings = load_docstrings(codes)
+            codebase_index = get_codebase_index(codes)
             # print("docstrings loaded!")
             # print("="*70)
             # print("\n\n")
@@ -1020,26 +1041,8 @@ Now, update the plan accordingly, planner!""",
             #         output_str += "````\n"
             #         output_str += f"{doc}\n"
             #         output_str += "````\n\n"
-            output_str = ""
-            for module, info in docstrings.items():
-                output_str += "-----------\n"
-                output_str += f"Filename: {module}.py\n"
-                output_str += f"File path: {info['file_path']}\n\n"
-
-                # Show parse errors (if any) ✨
-                if "error" in info:
-                    output_str += f"⚠️  Parse error: {info['error']}\n\n"
-
-                output_str += "Available functions:\n"
-
-                if info["functions"]:                          # non-empty dict
-                    for func, doc in info["functions"].items():
-                        output_str += f"function name: {func}\n"
-                        output_str += "````\n"
-                        output_str += f"{doc or '(no docstring)'}\n"
-                        output_str += "````\n\n"
-                else:
-                    output_str += "(none)\n\n"
+            # rendered fragments are cached per module, see codebase_index.py
+            output_str = codebase_index.render()
 
 
 
@@ -1051,15 +1054,11 @@ Now, update the plan accordingly, planner!""",
             # import sys
             # sys.exit()
 
-            # Load image plots from the "data" directory.
-            data_directory = os.path.join(cmbagent_instance.work_dir, context_variables['database_path'])
-            image_files = load_plots(data_directory)
-    
             # Retrieve the list of images that have been displayed so far.
             displayed_images = context_variables.get("displayed_images", [])
 
-            # Identify new images that haven't been displayed before.
-            new_images = [img for img in image_files if img not in displayed_images]
+            # Identify new images of the "data" directory that haven't been displayed before.
+            new_images = load_new_plots(cmbagent_instance, context_variables)
 
             # Display only the new images.
             for img_file in new_images:
@@ -1393,7 +1392,7 @@ def extract_file_path_from_source(source):
         return match.group(1).strip()
     return None
 
-def extract_functions_docstrings_from_file(file_path):
+def extract_functions_docstrings_from_file(file_path, source=None):
     """
     Parses the given Python file and extracts docstrings from all top-level function
     definitions (including methods in classes) without capturing nested (internal) functions.
@@ -1401,14 +1400,16 @@ def extract_functions_docstrings_from_file(file_path):
     
     Parameters:
         file_path (str): Path to the Python file.
+        source (str, optional): Content of the file, if already read.
     
     Returns:
         dict: A dictionary with two keys:
               - "file_path": the file path extracted from the comment.
               - "functions": a dictionary mapping function names to their docstrings.
     """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        source = f.read()
+    if source is None:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            source = f.read()
         
     # Extract the file path from the comment at the top of the file
     file_path_from_comment = extract_file_path_from_source(source)
@@ -1457,22 +1458,49 @@ def load_docstrings(directory: str = "codebase"):
     Loads all top-level function docstrings from Python files in *directory*
     without executing any code.  If a file can’t be parsed, its error is
     stored in an `"error"` field.
+    Only files that changed since the last call are parsed again, see codebase_index.py.
     """
-    all_docstrings = {}
+    return get_codebase_index(directory).docstrings()
 
-    for file in os.listdir(directory):
-        if file.endswith(".py") and not file.startswith("__"):
-            module     = file[:-3]                  # drop '.py'
-            file_path  = os.path.join(directory, file)
-            try:
-                all_docstrings[module] = extract_functions_docstrings_from_file(file_path)
-            except Exception as err:
-                all_docstrings[module] = {
-                    "file_path": file_path,
-                    "functions": {},               # ALWAYS a dict
-                    "error": f"{err.__class__.__name__}: {err}",
-                }
-    return all_docstrings
+
+# set-backed index of context_variables["displayed_images"], keyed by its length and its first
+# and last indexed paths (per thread, concurrent runs each have their own)
+_displayed_images_local = threading.local()
+
+def displayed_images_index(context_variables) -> set:
+    """
+    Set of the displayed images, for O(1) membership tests.
+    Only the paths appended since the previous call are added: the list is often
+    replaced by a longer copy (displayed_images + new_images); it is rebuilt otherwise.
+    """
+    displayed_images = context_variables.get("displayed_images", [])
+    if not hasattr(_displayed_images_local, "index"):
+        _displayed_images_local.index = {"n": 0, "first": None, "last": None, "paths": set()}
+    index = _displayed_images_local.index
+    n = index["n"]
+    if n and len(displayed_images) >= n and displayed_images[0] == index["first"] and displayed_images[n - 1] == index["last"]:
+        index["paths"].update(displayed_images[n:])
+    else:
+        index["paths"] = set(displayed_images)
+    index["n"] = len(displayed_images)
+    index["first"] = displayed_images[0] if displayed_images else None
+    index["last"] = displayed_images[-1] if displayed_images else None
+    return index["paths"]
+
+
+def load_new_plots(cmbagent_instance, context_variables) -> list:
+    """
+    Image files of the data directory not displayed yet, oldest first.
+    Read from the artifact manifest written by the executors, only the records appended since the
+    previous call (see execution/artifacts.py); falls back to scanning the directory when there is no manifest.
+    """
+    data_directory = os.path.join(cmbagent_instance.work_dir, context_variables['database_path'])
+    artifact_manifest = get_artifact_manifest(cmbagent_instance.work_dir)
+    displayed_images = displayed_images_index(context_variables)
+    if artifact_manifest.exists():
+        return artifact_manifest.new_plots(data_directory, displayed_images)
+    image_files = load_plots(data_directory)
+    return [img for img in image_files if img not in displayed_images and os.path.exists(img)]
 
 
 def load_plots(directory: str) -> list:
@@ -1,157 +1,209 @@
 from autogen.agentchat.group import AgentTarget, TerminateTarget, OnCondition, StringLLMCondition
+from autogen.agentchat.group import OnContextCondition, StringContextCondition
 from autogen.cmbagent_utils import cmbagent_debug
 import autogen
 from autogen import GroupChatManager, GroupChat
 from autogen.agentchat.contrib.capabilities.transform_messages import TransformMessages
 from autogen.agentchat.contrib.capabilities.transforms import MessageHistoryLimiter
+from .message_transforms import history_compaction_agents, add_history_compaction
+from .execution_routing import add_execution_routing
+from .local_formatting import local_parsers, add_local_formatting
+from .native_structured import skipped_formatters
 
 cmbagent_debug = autogen.cmbagent_utils.cmbagent_debug
 
-def register_all_hand_offs(cmbagent_instance):
+# after-work hand-offs, as (agent, next agent) pairs.
+# agents that are not part of the roster are skipped at registration.
+after_work_hand_offs = [
+    ('camb_context', 'camb_response_formatter'),
+    ('classy_context', 'classy_response_formatter'),
+    ('summarizer', 'summarizer_response_formatter'),
+    ('summarizer_response_formatter', 'terminator'),
+    ('task_improver', 'task_recorder'),
+    ('plan_setter', 'planner'),
+    ('task_recorder', 'planner'),
+    ('planner', 'planner_response_formatter'),
+    ('planner_response_formatter', 'plan_recorder'),
+    ('plan_recorder', 'plan_reviewer'),
+    ('plan_reviewer', 'reviewer_response_formatter'),
+    ('reviewer_response_formatter', 'review_recorder'),
+    ('review_recorder', 'planner'),
+    ('installer', 'executor_bash'),
+    ('executor_bash', 'executor_response_formatter'),
+    ('aas_keyword_finder', 'control'),
+    ('researcher', 'researcher_response_formatter'),
+    ('researcher_response_formatter', 'researcher_executor'),
+    ('researcher_executor', 'control'),
+    ('engineer_nest', 'executor_response_formatter'),
+    ('engineer', 'engineer_nest'),
+    ('idea_maker', 'idea_maker_nest'),
+    ('idea_maker_nest', 'control'),
+    ('idea_hater', 'idea_hater_response_formatter'),
+    ('idea_hater_response_formatter', 'control'),
+]
+
+# after-work hand-offs only registered when the rag agents are in use
+rag_after_work_hand_offs = [
+    ('camb_agent', 'camb_response_formatter'),
+    ('classy_sz_agent', 'classy_sz_response_formatter'),
+    ('classy_sz_response_formatter', 'control'),
+    ('cobaya_agent', 'cobaya_response_formatter'),
+    ('cobaya_response_formatter', 'control'),
+    ('planck_agent', 'control'),
+]
+
+# agents taking part in the nested chats of engineer_nest and idea_maker_nest
+nested_chat_agents = {
+    'engineer_nest': ['engineer_response_formatter', 'executor'],
+    'idea_maker_nest': ['idea_maker_response_formatter', 'idea_saver'],
+}
+
+# agents control can hand off to through its llm conditions
+control_llm_condition_targets = ['engineer', 'researcher', 'idea_maker', 'idea_hater', 'terminator']
+
+# agents that only see the last message
+last_message_only_agents = [
+    'executor_response_formatter',
+    'planner_response_formatter',
+    'plan_recorder',
+    'reviewer_response_formatter',
+    'review_recorder',
+    'researcher_response_formatter',
+    'researcher_executor',
+    'idea_maker_response_formatter',
+    'idea_hater_response_formatter',
+    'summarizer_response_formatter',
+]
+
+
+def get_hand_off_graph(mode, chat_agent=None, skip_rag_agents=True, native_structured_agents=None):
+    """
+    Static map of every agent to the agents it can hand off to, through after-work
+    hand-offs, nested chats, llm conditions and the ReplyResult targets of the
+    registered functions.
+
+    Args:
+        mode (str): CMBAgent mode.
+        chat_agent (str, optional): Agent the admin hands off to in chat mode.
+        skip_rag_agents (bool): Whether the rag agents are left out.
+        native_structured_agents (set, optional): Agents answering in their formatter's response format
+            (see native_structured.py), their formatter is left out.
+
+    Returns:
+        dict: agent name -> set of agent names.
+    """
+    from .functions import function_hand_off_targets
+
+    graph = {}
+
+    def add(source, target):
+        graph.setdefault(source, set()).add(target)
+
+    for source, target in after_work_hand_offs:
+        add(source, target)
+
+    for formatter in ['camb_response_formatter', 'classy_response_formatter']:
+        add(formatter, 'engineer' if mode == "one_shot" else 'control')
+
+    if not skip_rag_agents:
+        for source, target in rag_after_work_hand_offs:
+            add(source, target)
+
+    for nest, members in nested_chat_agents.items():
+        for member in members:
+            add(nest, member)
+
+    if mode == "chat":
+        add('control', 'admin')
+        if chat_agent is not None:
+            add('admin', chat_agent)
+    else:
+        add('control', 'terminator')
+        for target in control_llm_condition_targets:
+            add('control', target)
+
+    for source, targets in function_hand_off_targets.items():
+        for target in targets:
+            add(source, target)
+
+    # the agents handing off to a skipped formatter hand off to its next agents instead
+    for formatter in skipped_formatters(native_structured_agents):
+        next_agents = graph.pop(formatter, set())
+        for targets in graph.values():
+            if formatter in targets:
+                targets.discard(formatter)
+                targets |= next_agents
+
+    return graph
+
+
+def get_reachable_agents(initial_agents, mode, chat_agent=None, skip_rag_agents=True, native_structured_agents=None):
+    """
+    Names of all the agents that can be reached from initial_agents, including themselves.
+    """
+    if isinstance(initial_agents, str):
+        initial_agents = [initial_agents]
+
+    graph = get_hand_off_graph(mode, chat_agent=chat_agent, skip_rag_agents=skip_rag_agents,
+                               native_structured_agents=native_structured_agents)
+
+    reachable = set()
+    to_visit = list(initial_agents)
+    while to_visit:
+        name = to_visit.pop()
+        if name in reachable:
+            continue
+        reachable.add(name)
+        to_visit.extend(graph.get(name, ()))
+
+    return reachable
+
+
+def register_all_hand_offs(cmbagent_instance, agent_names=None):
+    """
+    Register hand-offs of the agents in agent_names (all agents of the roster by default).
+
+    Only the agents that have been built are looked up, so this can be called again
+    for the agents that are created on first use.
+    """
     if cmbagent_debug:
         print('\nregistering all hand_offs...')
 
-    # Get all agent instances
-    task_improver = cmbagent_instance.get_agent_object_from_name('task_improver')
-    task_recorder = cmbagent_instance.get_agent_object_from_name('task_recorder')   
-    planner = cmbagent_instance.get_agent_object_from_name('planner')
-    planner_response_formatter = cmbagent_instance.get_agent_object_from_name('planner_response_formatter')
-    plan_recorder = cmbagent_instance.get_agent_object_from_name('plan_recorder')
-    plan_reviewer = cmbagent_instance.get_agent_object_from_name('plan_reviewer')
-    reviewer_response_formatter = cmbagent_instance.get_agent_object_from_name('reviewer_response_formatter')
-    review_recorder = cmbagent_instance.get_agent_object_from_name('review_recorder')
-    idea_maker = cmbagent_instance.get_agent_object_from_name('idea_maker')
-    idea_maker_response_formatter = cmbagent_instance.get_agent_object_from_name('idea_maker_response_formatter')
-    idea_hater = cmbagent_instance.get_agent_object_from_name('idea_hater')
-    idea_hater_response_formatter = cmbagent_instance.get_agent_object_from_name('idea_hater_response_formatter')
-    researcher = cmbagent_instance.get_agent_object_from_name('researcher')
-    researcher_response_formatter = cmbagent_instance.get_agent_object_from_name('researcher_response_formatter')
-    engineer = cmbagent_instance.get_agent_object_from_name('engineer')
-    engineer_response_formatter = cmbagent_instance.get_agent_object_from_name('engineer_response_formatter')
-
-    executor = cmbagent_instance.get_agent_object_from_name('executor')
-    researcher_executor = cmbagent_instance.get_agent_object_from_name('researcher_executor')
-    executor_bash = cmbagent_instance.get_agent_object_from_name('executor_bash')
-
-    terminator = cmbagent_instance.get_agent_object_from_name('terminator')
-    control = cmbagent_instance.get_agent_object_from_name('control')
-    perplexity = cmbagent_instance.get_agent_object_from_name('perplexity')
-    admin = cmbagent_instance.get_agent_object_from_name('admin')
-    aas_keyword_finder = cmbagent_instance.get_agent_object_from_name('aas_keyword_finder')
-    executor_response_formatter = cmbagent_instance.get_agent_object_from_name('executor_response_formatter')
-    plan_setter = cmbagent_instance.get_agent_object_from_name('plan_setter')
-    installer = cmbagent_instance.get_agent_object_from_name('installer')
-    engineer_nest = cmbagent_instance.get_agent_object_from_name('engineer_nest')
-    idea_maker_nest = cmbagent_instance.get_agent_object_from_name('idea_maker_nest')
-    idea_saver = cmbagent_instance.get_agent_object_from_name('idea_saver')
-    plot_judge = cmbagent_instance.get_agent_object_from_name('plot_judge')
-    plot_debugger = cmbagent_instance.get_agent_object_from_name('plot_debugger')
-
-    camb_context = cmbagent_instance.get_agent_object_from_name('camb_context')
-    classy_context = cmbagent_instance.get_agent_object_from_name('classy_context')
-
-    summarizer = cmbagent_instance.get_agent_object_from_name('summarizer')
-    summarizer_response_formatter = cmbagent_instance.get_agent_object_from_name('summarizer_response_formatter')
-    
+    if agent_names is None:
+        agent_names = [agent.name for agent in cmbagent_instance.agents]
+    agent_names = set(agent_names)
 
-    mode = cmbagent_instance.mode
+    def get(name):
+        return cmbagent_instance.find_agent_object(name)
 
-    camb_response_formatter = cmbagent_instance.get_agent_object_from_name('camb_response_formatter')
-    camb_context.agent.handoffs.set_after_work(AgentTarget(camb_response_formatter.agent))
-    
+    def set_after_work(source_name, target_name):
+        source = get(source_name)
+        if source is None or source_name not in agent_names:
+            return
+        source.agent.handoffs.set_after_work(AgentTarget(get(target_name).agent))
 
-    if mode == "one_shot":
-        camb_response_formatter.agent.handoffs.set_after_work(AgentTarget(engineer.agent))
-    else:
-        camb_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
+    mode = cmbagent_instance.mode
 
-    classy_response_formatter = cmbagent_instance.get_agent_object_from_name('classy_response_formatter')
-    classy_context.agent.handoffs.set_after_work(AgentTarget(classy_response_formatter.agent))
+    # formatters of the agents with native structured output are skipped
+    skipped = skipped_formatters(getattr(cmbagent_instance, 'native_structured_agents', None))
+    skipped_next = {source_name: target_name for source_name, target_name in after_work_hand_offs if source_name in skipped}
 
-    if mode == "one_shot":
-        classy_response_formatter.agent.handoffs.set_after_work(AgentTarget(engineer.agent))
-    else:
-        classy_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
+    for source_name, target_name in after_work_hand_offs:
+        if source_name in skipped:
+            continue
+        while target_name in skipped_next:
+            target_name = skipped_next[target_name]
+        set_after_work(source_name, target_name)
 
+    for formatter in ['camb_response_formatter', 'classy_response_formatter']:
+        if mode == "one_shot":
+            set_after_work(formatter, 'engineer')
+        else:
+            set_after_work(formatter, 'control')
 
     if not cmbagent_instance.skip_rag_agents:
-
-        classy_sz = cmbagent_instance.get_agent_object_from_name('classy_sz_agent')
-        classy_sz_response_formatter = cmbagent_instance.get_agent_object_from_name('classy_sz_response_formatter')
-        camb = cmbagent_instance.get_agent_object_from_name('camb_agent')
-        planck = cmbagent_instance.get_agent_object_from_name('planck_agent')
-        cobaya = cmbagent_instance.get_agent_object_from_name('cobaya_agent')
-        cobaya_response_formatter = cmbagent_instance.get_agent_object_from_name('cobaya_response_formatter')
-        # camb handoffs
-        camb.agent.handoffs.set_after_work(AgentTarget(camb_response_formatter.agent))
-
-
-        # classy_sz handoffs
-        classy_sz.agent.handoffs.set_after_work(AgentTarget(classy_sz_response_formatter.agent))
-
-        # classy_sz response formatter handoffs
-        classy_sz_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
-        
-        # cobaya handoffs
-        cobaya.agent.handoffs.set_after_work(AgentTarget(cobaya_response_formatter.agent))
-
-        # cobaya response formatter handoffs
-        cobaya_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
-
-
-        # planck handoffs   
-        planck.agent.handoffs.set_after_work(AgentTarget(control.agent))
-
-    # Summarizer handoffs
-    summarizer.agent.handoffs.set_after_work(AgentTarget(summarizer_response_formatter.agent))
-
-    # Summarizer response formatter handoffs
-    summarizer_response_formatter.agent.handoffs.set_after_work(AgentTarget(terminator.agent))
-
-    # Task improver handoffs
-    task_improver.agent.handoffs.set_after_work(AgentTarget(task_recorder.agent))
-    
-    # Plan setter handoffs
-    plan_setter.agent.handoffs.set_after_work(AgentTarget(planner.agent))
-
-    # Task recorder handoffs
-    task_recorder.agent.handoffs.set_after_work(AgentTarget(planner.agent))
-    
-    # Planner handoffs
-    planner.agent.handoffs.set_after_work(AgentTarget(planner_response_formatter.agent))
-    
-    # Planner response formatter handoffs
-    planner_response_formatter.agent.handoffs.set_after_work(AgentTarget(plan_recorder.agent))
-    
-    # Plan recorder handoffs
-    plan_recorder.agent.handoffs.set_after_work(AgentTarget(plan_reviewer.agent))
-    
-    # Plan reviewer handoffs
-    plan_reviewer.agent.handoffs.set_after_work(AgentTarget(reviewer_response_formatter.agent))
-    
-    # Reviewer response formatter handoffs
-    reviewer_response_formatter.agent.handoffs.set_after_work(AgentTarget(review_recorder.agent))
-    
-    # Review recorder handoffs
-    review_recorder.agent.handoffs.set_after_work(AgentTarget(planner.agent))
-    
-    # Installer handoffs
-    installer.agent.handoffs.set_after_work(AgentTarget(executor_bash.agent))
-    
-    # Executor bash handoffs
-    executor_bash.agent.handoffs.set_after_work(AgentTarget(executor_response_formatter.agent))
-
-    # AAS keyword finder handoffs
-    aas_keyword_finder.agent.handoffs.set_after_work(AgentTarget(control.agent))
-
-    # Researcher handoffs
-    researcher.agent.handoffs.set_after_work(AgentTarget(researcher_response_formatter.agent))
-
-    # Researcher response formatter handoffs    
-    researcher_response_formatter.agent.handoffs.set_after_work(AgentTarget(researcher_executor.agent))
-
-    # Researcher executor handoffs
-    researcher_executor.agent.handoffs.set_after_work(AgentTarget(control.agent))
+        for source_name, target_name in rag_after_work_hand_offs:
+            set_after_work(source_name, target_name)
 
     
     ### Transform messages for one shot agents 
@@ -160,116 +212,118 @@ def register_all_hand_offs(cmbagent_instance):
                 MessageHistoryLimiter(max_messages=1),
         ]
     )
-    # context_handling.add_to_agent(executor_manager)
-    context_handling.add_to_agent(executor_response_formatter.agent)
-
-    context_handling.add_to_agent(planner_response_formatter.agent)
-
-    context_handling.add_to_agent(plan_recorder.agent)
-
-    context_handling.add_to_agent(reviewer_response_formatter.agent)
-
-    context_handling.add_to_agent(review_recorder.agent)
-
-    # context_handling.add_to_agent(executor_manager)
-    context_handling.add_to_agent(researcher_response_formatter.agent)
-
-    context_handling.add_to_agent(researcher_executor.agent)
-
-    # context_handling.add_to_agent(executor_manager)
-    context_handling.add_to_agent(idea_maker_response_formatter.agent)
-
-    context_handling.add_to_agent(idea_hater_response_formatter.agent)
-
-    context_handling.add_to_agent(summarizer_response_formatter.agent)
+    for name in last_message_only_agents:
+        if name in agent_names and get(name) is not None:
+            context_handling.add_to_agent(get(name).agent)
+
+    ### Compact the older messages for the agents of the long control loops
+    history_compaction = getattr(cmbagent_instance, 'history_compaction', None)
+    if history_compaction is not None:
+        for name in history_compaction_agents:
+            if name in agent_names and get(name) is not None:
+                get(name).history_compactor = add_history_compaction(get(name).agent, **history_compaction)
+
+    ### Route the execution results by rules, the executor_response_formatter llm is only called for the unclear cases
+    ### (with the static check alone, only the code blocks it stopped are routed by rules, back to the engineer)
+    rule_based_routing = getattr(cmbagent_instance, 'rule_based_routing', False)
+    if rule_based_routing or getattr(cmbagent_instance, 'static_check', None):
+        executor_response_formatter = get('executor_response_formatter')
+        if executor_response_formatter is not None and 'executor_response_formatter' in agent_names:
+            executor_response_formatter.execution_router = add_execution_routing(executor_response_formatter, cmbagent_instance,
+                                                                                 static_check_only=not rule_based_routing)
+
+    ### Parse the engineer, planner and plan_reviewer replies locally, the formatter llm is only called if that fails
+    if getattr(cmbagent_instance, 'local_formatting', False):
+        for name in local_parsers:
+            if name in agent_names and get(name) is not None:
+                get(name).local_formatter = add_local_formatting(get(name))
 
 
     # Nested chat for code execution
-    executor_chat = GroupChat(
-        agents=[
-                engineer_response_formatter.agent, 
-                executor.agent, 
-                ],
-        messages=[],
-        max_round=3,
-        # send_introductions=True,
-        speaker_selection_method = 'round_robin',
-    )
-
-    executor_manager = GroupChatManager(
-        groupchat=executor_chat,
-        llm_config=cmbagent_instance.llm_config,
-        name="engineer_nested_chat",
-
-    )
-
-
-    nested_chats = [
-        {
-            "recipient": executor_manager,
-            # NOTE: when output of executed code is an error, this raised IndexError (list index out of range)
-            "message": lambda recipient, messages, sender, config: f"{messages[-1]['content']}" if messages else "",
-            "max_turns": 1,
-            "summary_method": "last_msg",
-        }#,
-    ]
-
-
-   # create a list of all egents except the engineer:
-    other_agents = [agent for agent in cmbagent_instance.agents if agent != engineer.agent]
+    engineer_nest = get('engineer_nest')
+    if engineer_nest is not None and 'engineer_nest' in agent_names:
+
+        # the engineer_response_formatter is skipped when the engineer has native structured output
+        nested_agents = [name for name in nested_chat_agents['engineer_nest'] if name not in skipped]
+
+        if len(nested_agents) > 1:
+            executor_chat = GroupChat(
+                agents=[get(name).agent for name in nested_agents],
+                messages=[],
+                # the message, then one reply of each agent
+                max_round=len(nested_agents) + 1,
+                # send_introductions=True,
+                speaker_selection_method = 'round_robin',
+            )
+
+            nested_recipient = GroupChatManager(
+                groupchat=executor_chat,
+                llm_config=cmbagent_instance.llm_config,
+                name="engineer_nested_chat",
+
+            )
+        else:
+            # a group chat needs two agents: the already formatted message goes straight to the executor
+            nested_recipient = get(nested_agents[0]).agent
+
+
+        nested_chats = [
+            {
+                "recipient": nested_recipient,
+                # NOTE: when output of executed code is an error, this raised IndexError (list index out of range)
+                "message": lambda recipient, messages, sender, config: f"{messages[-1]['content']}" if messages else "",
+                "max_turns": 1,
+                "summary_method": "last_msg",
+            }#,
+        ]
 
-    engineer_nest.agent.register_nested_chats(
-    trigger=lambda sender: sender not in other_agents,
-    chat_queue=nested_chats
-    )
 
-    engineer_nest.agent.handoffs.set_after_work(AgentTarget(executor_response_formatter.agent))
+       # create a list of all egents except the engineer:
+        engineer = get('engineer')
+        other_agents = [agent for agent in cmbagent_instance.agents if engineer is None or agent != engineer.agent]
 
-    engineer.agent.handoffs.set_after_work(AgentTarget(engineer_nest.agent))
+        engineer_nest.agent.register_nested_chats(
+        trigger=lambda sender: sender not in other_agents,
+        chat_queue=nested_chats
+        )
 
     #### Nested chat for idea generation
+    idea_maker_nest = get('idea_maker_nest')
+    if idea_maker_nest is not None and 'idea_maker_nest' in agent_names:
+
+        idea_maker_chat = GroupChat(
+            agents=[get(name).agent for name in nested_chat_agents['idea_maker_nest']],
+            messages=[],
+            max_round=4,
+            # send_introductions=True,
+            speaker_selection_method = 'round_robin',
+        )
+
+        idea_maker_manager = GroupChatManager(
+            groupchat=idea_maker_chat,
+            llm_config=cmbagent_instance.llm_config,
+            name="idea_maker_manager",
+
+        )
+
+
+        nested_chats = [
+            {
+                "recipient": idea_maker_manager,
+                "message": lambda recipient, messages, sender, config: f"{messages[-1]['content']}",
+                "max_turns": 1,
+                "summary_method": "last_msg",
+            }
+        ]
 
-    idea_maker_chat = GroupChat(
-        agents=[
-                idea_maker_response_formatter.agent, 
-                idea_saver.agent
-                ],
-        messages=[],
-        max_round=4,
-        # send_introductions=True,
-        speaker_selection_method = 'round_robin',
-    )
-
-    idea_maker_manager = GroupChatManager(
-        groupchat=idea_maker_chat,
-        llm_config=cmbagent_instance.llm_config,
-        name="idea_maker_manager",
-
-    )
-
-
-    nested_chats = [
-        {
-            "recipient": idea_maker_manager,
-            "message": lambda recipient, messages, sender, config: f"{messages[-1]['content']}",
-            "max_turns": 1,
-            "summary_method": "last_msg",
-        }
-    ]
-
-    # create a list of all egents except the idea_maker:
-    other_agents = [agent for agent in cmbagent_instance.agents if agent != idea_maker.agent]
-
-    idea_maker_nest.agent.register_nested_chats(
-    trigger=lambda sender: sender not in other_agents,
-    chat_queue=nested_chats
-    )
-
-
-    idea_maker.agent.handoffs.set_after_work(AgentTarget(idea_maker_nest.agent))
-    idea_maker_nest.agent.handoffs.set_after_work(AgentTarget(control.agent))
-
+        # create a list of all egents except the idea_maker:
+        idea_maker = get('idea_maker')
+        other_agents = [agent for agent in cmbagent_instance.agents if idea_maker is None or agent != idea_maker.agent]
 
+        idea_maker_nest.agent.register_nested_chats(
+        trigger=lambda sender: sender not in other_agents,
+        chat_queue=nested_chats
+        )
 
 
     # # idea maker handoffs
@@ -277,35 +331,35 @@ def register_all_hand_offs(cmbagent_instance):
 
     # # idea maker response formatter handoffs
     # idea_maker_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
-
-    # idea haters handoffs
-    idea_hater.agent.handoffs.set_after_work(AgentTarget(idea_hater_response_formatter.agent))
-
-    # idea haters response formatter handoffs
-    idea_hater_response_formatter.agent.handoffs.set_after_work(AgentTarget(control.agent))
-    
     
 
     # Terminator handoffs
-    terminator.agent.handoffs.set_after_work(TerminateTarget())
+    terminator = get('terminator')
+    if terminator is not None and 'terminator' in agent_names:
+        terminator.agent.handoffs.set_after_work(TerminateTarget())
 
 
     if mode == "chat":
 
-        agent_on = cmbagent_instance.get_agent_object_from_name(cmbagent_instance.chat_agent)
-
         # Control handoffs
-        control.agent.handoffs.set_after_work(AgentTarget(admin.agent))
+        set_after_work('control', 'admin')
 
         # Admin handoffs
-        admin.agent.handoffs.set_after_work(AgentTarget(agent_on.agent))
+        set_after_work('admin', cmbagent_instance.chat_agent)
 
         
-    else:  
+    elif get('control') is not None and 'control' in agent_names:
   
 
         # Control handoffs
-        control.agent.handoffs.set_after_work(AgentTarget(terminator.agent))
+        set_after_work('control', 'terminator')
+
+        control = get('control')
+        engineer = get('engineer')
+        researcher = get('researcher')
+        idea_maker = get('idea_maker')
+        idea_hater = get('idea_hater')
+        terminator = get('terminator')
 
         control.agent.handoffs.add_llm_conditions([
 
@@ -344,5 +398,34 @@ def register_all_hand_offs(cmbagent_instance):
         ])
 
 
+    register_budget_hand_offs(cmbagent_instance, agent_names)
+
     if cmbagent_debug:
         print('\nall hand_offs registered...')
+
+
+def register_budget_hand_offs(cmbagent_instance, agent_names):
+    """
+    Hand off to the terminator as soon as the budget_exceeded context variable is set (see cost_ledger.py).
+
+    Context conditions are evaluated before the agent replies, so the agent after the one
+    that went over budget does not make a request. The agents of the nested chats are left
+    out, their chat ends after a few rounds anyway.
+    """
+    terminator = cmbagent_instance.find_agent_object('terminator')
+    if terminator is None:
+        return
+    # all built agents when the terminator is new, else only the new ones
+    if 'terminator' in agent_names:
+        agent_names = [agent.name for agent in cmbagent_instance.agents]
+    nested = {name for members in nested_chat_agents.values() for name in members}
+    for name in agent_names:
+        agent = cmbagent_instance.find_agent_object(name)
+        if agent is None or name == 'terminator' or name in nested:
+            continue
+        agent.agent.handoffs.add_context_condition(
+            OnContextCondition(
+                target=AgentTarget(terminator.agent),
+                condition=StringContextCondition(variable_name="budget_exceeded"),
+            )
+        )
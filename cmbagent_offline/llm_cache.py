@@ -0,0 +1,327 @@
+# cmbagent/llm_cache.py
+#
+# Content-addressed on-disk cache of LLM responses.
+#
+# Most of our calls are deterministic (temperature 1e-5, top_p 0.05 by default):
+# formatters, keyword finders, plan recorders, the VLM criteria generator, ...
+# LLMResponseCache stores their responses in a SQLite database, keyed by the
+# sha256 of the request (model, messages, tools/response_format and sampling
+# parameters), so re-running a benchmark task or resuming a crashed run replays
+# the cached turns. Entries are evicted least-recently-used first when the cache
+# grows over max_size_bytes, and dropped when older than max_age_seconds.
+#
+# It implements autogen's AbstractCache protocol (get/set/close and the context
+# manager). Our autogen fork never looks up the client_cache of the agents, so
+# cache_agent_client puts the cache in front of the OpenAIWrapper of an agent
+# instead: it sits before every client autogen builds for the llm configs of
+# get_model_config (openai, anthropic, google, ollama, ...).
+#
+# Enable it with CMBAgent(llm_cache=True) or a path, or for every run with
+# CMBAGENT_LLM_CACHE=1 (or a path) in the environment.
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+cache_filename = "llm_cache.sqlite"
+
+# 2 GB, 30 days
+MAX_SIZE_BYTES = int(os.environ.get("CMBAGENT_LLM_CACHE_MAX_BYTES", 2 * 1024**3))
+MAX_AGE_SECONDS = float(os.environ.get("CMBAGENT_LLM_CACHE_MAX_AGE", 30 * 24 * 3600))
+
+# eviction is checked every this many writes
+EVICT_EVERY = 100
+
+# open caches, keyed by database path
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache_path():
+    """Path of the LLM response cache, in $CMBAGENT_CACHE_DIR or ~/.cache/cmbagent."""
+    cache_dir = os.environ.get("CMBAGENT_CACHE_DIR",
+                               os.path.join(os.path.expanduser("~"), ".cache", "cmbagent"))
+    return os.path.join(cache_dir, cache_filename)
+
+
+def request_key(request):
+    """Content address of a request: sha256 of its canonical json."""
+    if not isinstance(request, str):
+        request = json.dumps(request, sort_keys=True, default=repr)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite store of LLM responses with size/age based LRU eviction.
+
+    Args:
+        path (str, optional): Database file. Defaults to get_cache_path().
+        max_size_bytes (int, optional): Total size of the stored responses above which the
+            least recently used ones are evicted.
+        max_age_seconds (float, optional): Responses older than this are not returned and evicted.
+    """
+
+    def __init__(self, path=None, max_size_bytes=MAX_SIZE_BYTES, max_age_seconds=MAX_AGE_SECONDS):
+        self.path = os.path.expanduser(path or get_cache_path())
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # sqlite connections can not be shared between threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                               "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, accessed REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # concurrent runs read while another one writes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    # --- AbstractCache protocol
+
+    def get(self, key, default=None):
+        key = request_key(key)
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self._count("misses")
+                return default
+            connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            value = pickle.loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError, AttributeError, EOFError, ImportError) as e:
+            if cmbagent_debug:
+                print(f"llm cache: could not read {key}: {e}")
+            self._count("misses")
+            return default
+        self._count("hits")
+        return value
+
+    def set(self, key, value):
+        key = request_key(key)
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            # e.g. responses holding a client or a lock
+            if cmbagent_debug:
+                print(f"llm cache: response of type {type(value).__name__} not cached: {e}")
+            return
+        now = time.time()
+        try:
+            self._connection().execute("INSERT OR REPLACE INTO responses (key, value, size, created, accessed) "
+                                       "VALUES (?, ?, ?, ?, ?)", (key, data, len(data), now, now))
+        except sqlite3.Error as e:
+            if cmbagent_debug:
+                print(f"llm cache: could not write {key}: {e}")
+            return
+        self._count("writes")
+        if self.writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def close(self):
+        # autogen enters and exits the cache around every request: keep the
+        # connection of this thread open, see close_connection()
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # --- maintenance
+
+    def close_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def evict(self):
+        """Drop the expired responses, then the least recently used ones above max_size_bytes. Returns the number dropped."""
+        connection = self._connection()
+        try:
+            n_evicted = connection.execute("DELETE FROM responses WHERE created < ?",
+                                           (time.time() - self.max_age_seconds,)).rowcount
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                excess = total_size - self.max_size_bytes
+                keys = []
+                for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if excess <= 0:
+                        break
+                    keys.append((key,))
+                    excess -= size
+                connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                n_evicted += len(keys)
+        except sqlite3.Error as e:
+            if cmbagent_debug:
+                print(f"llm cache: eviction failed: {e}")
+            return 0
+        self._count("evictions", n_evicted)
+        if cmbagent_debug and n_evicted:
+            print(f"llm cache: evicted {n_evicted} responses")
+        return n_evicted
+
+    def clear(self):
+        self._connection().execute("DELETE FROM responses")
+
+    def stats(self):
+        """Counters since the cache was opened, with the number and size of the stored responses."""
+        n_entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "evictions": self.evictions, "entries": n_entries, "size_bytes": size}
+
+
+class CacheCounter:
+    """
+    View of an LLMResponseCache counting the hits and misses of one run,
+    when several runs of the process share the cache.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        value = self.cache.get(key, default)
+        with self._lock:
+            if value is default:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def close(self):
+        self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def get_llm_cache(llm_cache=None):
+    """
+    The LLM response cache to use, or None.
+
+    Args:
+        llm_cache (bool, str or LLMResponseCache, optional): True for the default path, a path,
+            a cache, or False for none. Defaults to None, i.e., $CMBAGENT_LLM_CACHE
+            ("1"/"true" for the default path, or a path), no cache if it is not set.
+    """
+    if llm_cache is None:
+        llm_cache = os.environ.get("CMBAGENT_LLM_CACHE", "")
+        if llm_cache.lower() in ("", "0", "false", "no"):
+            return None
+        if llm_cache.lower() in ("1", "true", "yes"):
+            llm_cache = True
+    if llm_cache is False:
+        return None
+    if isinstance(llm_cache, (LLMResponseCache, CacheCounter)):
+        return llm_cache
+    path = os.path.abspath(os.path.expanduser(get_cache_path() if llm_cache is True else str(llm_cache)))
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = LLMResponseCache(path)
+    return cache
+
+
+def cached_create(cache, create, **request):
+    """
+    create(**request) through the cache, for the calls made outside autogen
+    (e.g. with an OpenAI client directly). The request must be json serializable.
+    """
+    if cache is None:
+        return create(**request)
+    response = cache.get(request)
+    if response is None:
+        response = create(**request)
+        cache.set(request, response)
+    return response
+
+
+def _jsonable_config(config):
+    """An llm config for the key of a request: without the api key, response formats as their json schema."""
+    config = {k: v for k, v in config.items() if k != "api_key"}
+    response_format = config.get("response_format")
+    if hasattr(response_format, "model_json_schema"):
+        config["response_format"] = {"name": response_format.__name__, "schema": response_format.model_json_schema()}
+    return config
+
+
+def cache_agent_client(agent, cache):
+    """
+    Serve the completions of an autogen agent from cache (a CacheCounter, or an LLMResponseCache).
+    The create of its OpenAIWrapper is wrapped on the instance, keyed on the llm configs and the
+    create parameters; hits do not reach the client, nor the cost ledger when the cache is set
+    after track_agent_costs.
+    """
+    client = getattr(agent, "client", None)
+    if client is None or not hasattr(client, "create") or getattr(client, "_cmbagent_llm_cache", None) is not None:
+        return agent
+    create = client.create
+
+    @functools.wraps(create)
+    def create_through_cache(**params):
+        request = {"config_list": [_jsonable_config(config) for config in client._config_list],
+                   **{k: v for k, v in params.items() if k not in ("context", "cache", "agent")}}
+        response = cache.get(request)
+        if response is not None:
+            # the bound method is not stored, give it back from the client that made the response
+            config_id = getattr(response, "config_id", 0) or 0
+            response.message_retrieval_function = client._clients[min(config_id, len(client._clients) - 1)].message_retrieval
+            if cmbagent_debug:
+                print(f"llm cache: hit for {agent.name}")
+            return response
+        response = create(**params)
+        message_retrieval = getattr(response, "message_retrieval_function", None)
+        try:
+            if message_retrieval is not None:
+                delattr(response, "message_retrieval_function")
+            cache.set(request, response)
+        finally:
+            if message_retrieval is not None:
+                response.message_retrieval_function = message_retrieval
+        return response
+
+    client.create = create_through_cache
+    client._cmbagent_llm_cache = cache
+    return agent
@@ -0,0 +1,215 @@
+# cmbagent/local_formatting.py
+#
+# Local fast path for the response formatters. A *_response_formatter makes an
+# LLM call to turn the reply of its agent into its response_format model, while
+# the engineer, planner and plan_reviewer already answer in a fixed markdown
+# layout (see their yaml instructions). The formatter first parses the reply
+# locally into the fields of its response_format; the model is validated and
+# its format() is the formatter's reply. The formatter LLM is only called when
+# the reply does not parse, does not validate, or (engineer) the code does not
+# compile cleanly, as the formatter LLM is also in charge of fixing those.
+import os
+import re
+import warnings
+from collections import Counter
+import autogen
+from pydantic import ValidationError
+
+from .tracing import current_span
+
+cmbagent_debug = autogen.cmbagent_debug
+
+_code_block = re.compile(r"```(?:python|py)\s*\n(.*?)```", re.DOTALL)
+_any_code_block = re.compile(r"```")
+_filename_line = re.compile(r"^\s*#\s*filename:\s*(\S+)\s*$")
+_codebase_import = re.compile(r"^\s*(from|import)\s+codebase\b", re.MULTILINE)
+_section = re.compile(r"^\s*\*\*([A-Za-z ]+):\*\*[ \t]*(.*)$", re.MULTILINE)
+_step_header = re.compile(r"^\s*[-*]?\s*\**Step\s+(\d+)\b", re.IGNORECASE)
+_step_field = re.compile(r"^\s*[-*]\s*\**(sub-task|agent in charge|agent|bullet points|instructions|depends on)\**\s*:\s*(.*)$",
+                         re.IGNORECASE)
+_bullet = re.compile(r"^\s*[-*]\s+(.*)$")
+
+
+def _sections(text):
+    """Bold markdown headings (**Name:**) of text -> the text under them."""
+    matches = list(_section.finditer(text))
+    sections = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections[match.group(1).strip().lower()] = (match.group(2) + text[match.end():end]).strip()
+    return sections
+
+
+def python_code_is_clean(code, filename="<engineer>"):
+    """Whether code compiles without syntax errors or warnings (e.g. invalid escape sequences)."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", SyntaxWarning)
+        try:
+            compile(code, filename, "exec")
+        except (SyntaxError, SyntaxWarning, ValueError):
+            return False
+    return True
+
+
+def parse_engineer_response(text, context_variables=None):
+    """
+    Fields of the EngineerResponse of an engineer reply, or None if it does not follow the layout:
+    **Code Explanation:**, optional **Modifications:**, **Python Code:** with a single python block
+    starting with a `# filename:` line.
+    """
+    if len(_any_code_block.findall(text)) != 2:
+        return None
+    match = _code_block.search(text)
+    if match is None:
+        return None
+    code = match.group(1).strip("\n")
+    sections = _sections(text[:match.start()])
+    code_explanation = sections.get("code explanation")
+    if not code_explanation or "python code" not in sections or not code.strip():
+        return None
+
+    filename_match = _filename_line.match(code.splitlines()[0])
+    if filename_match is None:
+        return None
+    path = filename_match.group(1)
+    relative_path = os.path.dirname(path)
+    if not relative_path:
+        codebase_path = context_variables.get("codebase_path") if context_variables is not None else None
+        relative_path = (codebase_path or "codebase").rstrip("/\\")
+    # the formatter llm fixes these
+    if _codebase_import.search(code) or not python_code_is_clean(code, path):
+        return None
+
+    modification_summary = sections.get("modifications")
+    if modification_summary is not None:
+        modification_summary = re.sub(r"^\(optional\)\s*", "", modification_summary, flags=re.IGNORECASE) or None
+    return {
+        "filename": os.path.basename(path),
+        "relative_path": relative_path,
+        "code_explanation": code_explanation,
+        "modification_summary": modification_summary,
+        "python_code": code,
+    }
+
+
+def parse_planner_response(text, context_variables=None):
+    """
+    Fields of the PlannerResponse of a planner reply ("- Step i:" followed by the "* sub-task:", "* agent:",
+    "* bullet points:" and optional "* depends on:" items), or None if it does not follow the layout.
+    """
+    sub_tasks = []
+    current = None
+    field = None
+    for line in text.splitlines():
+        if _step_header.match(line):
+            current = {"bullet_points": []}
+            sub_tasks.append(current)
+            field = None
+            continue
+        if current is None:
+            continue
+        match = _step_field.match(line)
+        if match is not None:
+            field, value = match.group(1).lower(), match.group(2).strip()
+            if field == "sub-task":
+                current["sub_task"] = value
+            elif field in ("agent", "agent in charge"):
+                current["sub_task_agent"] = value.strip("`*").strip()
+            elif field == "depends on":
+                current["depends_on"] = [int(j) for j in re.findall(r"\d+", value)]
+            elif value:
+                current["bullet_points"].append(value)
+            continue
+        bullet = _bullet.match(line)
+        if bullet is not None and field in ("bullet points", "instructions"):
+            current["bullet_points"].append(bullet.group(1).strip())
+        elif line.strip() and field == "sub-task":
+            # sub-task written over several lines
+            current["sub_task"] += " " + line.strip()
+
+    if not sub_tasks or any("sub_task" not in step or "sub_task_agent" not in step for step in sub_tasks):
+        return None
+    return {"sub_tasks": sub_tasks}
+
+
+def parse_reviewer_response(text, context_variables=None):
+    """Fields of the PlanReviewerResponse of a plan_reviewer reply (bullets under **Recommendations:**), or None."""
+    recommendations_text = _sections(text).get("recommendations")
+    if not recommendations_text:
+        return None
+    recommendations = []
+    for line in recommendations_text.splitlines():
+        bullet = _bullet.match(line)
+        if bullet is not None:
+            recommendations.append(bullet.group(1).strip())
+        elif line.strip() and recommendations:
+            recommendations[-1] += " " + line.strip()
+    return {"recommendations": recommendations} if recommendations else None
+
+
+# formatter -> parser of the reply of its agent
+local_parsers = {
+    'engineer_response_formatter': parse_engineer_response,
+    'planner_response_formatter': parse_planner_response,
+    'reviewer_response_formatter': parse_reviewer_response,
+}
+
+
+class LocalFormatter:
+    """
+    Reply function of a response formatter building its response_format model from the reply it formats.
+
+    Args:
+        agent_object: The formatter (BaseAgent), with a response_format in its llm_config.
+        parser: Function of (text, context_variables) returning the fields of the model, or None.
+    """
+
+    def __init__(self, agent_object, parser):
+        self.agent_object = agent_object
+        self.parser = parser
+        self.response_format = agent_object.llm_config['config_list'][0].get('response_format')
+        # number of replies formatted locally and by the llm
+        self.counts = Counter()
+
+    def format(self, text, context_variables=None):
+        """format() of the response_format model built from text, or None."""
+        if self.response_format is None:
+            return None
+        fields = self.parser(text, context_variables)
+        if fields is None:
+            return None
+        try:
+            return self.response_format.model_validate(fields).format()
+        except ValidationError as e:
+            if cmbagent_debug:
+                print(f"\n\nlocal formatting of {self.agent_object.name} failed: {e}")
+            return None
+
+    def reply(self, recipient, messages=None, sender=None, config=None):
+        content = messages[-1].get("content") if messages else None
+        formatted = None
+        if isinstance(content, str):
+            formatted = self.format(content, getattr(recipient, "context_variables", None))
+        path = "llm" if formatted is None else "local"
+        self.counts[path] += 1
+        span = current_span()
+        if span is not None:
+            span.attributes["formatting"] = path
+        if formatted is None:
+            return False, None
+        return True, formatted
+
+    def summary(self):
+        total = sum(self.counts.values())
+        return f"{self.counts['local']}/{total} replies formatted locally"
+
+
+def add_local_formatting(agent_object):
+    """Have a response formatter parse the reply locally before calling its LLM. Returns the LocalFormatter, or None."""
+    from autogen import Agent
+    parser = local_parsers.get(agent_object.name)
+    if parser is None:
+        return None
+    local_formatter = LocalFormatter(agent_object, parser)
+    agent_object.agent.register_reply([Agent, None], local_formatter.reply, position=0)
+    return local_formatter
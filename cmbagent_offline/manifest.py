@@ -0,0 +1,208 @@
+# cmbagent/manifest.py
+#
+# Precompiled agent manifest.
+#
+# Building a roster used to list the agents tree, import every agent module and
+# parse every agent yaml each time a CMBAgent was created. The manifest stores
+# the class paths and the parsed yaml specs (including the instruction templates)
+# of all agents in a single json file, validated against the mtimes of the files
+# it was built from, and kept in memory once loaded.
+#
+# Rebuild it with: cmbagent manifest
+import os
+import json
+import copy
+import hashlib
+import importlib
+import autogen
+
+from cmbagent.utils import path_to_agents
+from cmbagent.version import __version__
+
+cmbagent_debug = autogen.cmbagent_utils.cmbagent_debug
+
+# bump this when the layout of the manifest changes
+MANIFEST_VERSION = 1
+
+# agent_manifest-<hash>.json, see get_manifest_path
+manifest_filename = "agent_manifest.json"
+
+# in-memory manifest, loaded once per process
+_manifest_cache = None
+_agent_class_cache = {}
+
+
+def get_manifest_path():
+    """
+    Path of the agent manifest, in $CMBAGENT_CACHE_DIR or ~/.cache/cmbagent.
+    Named after the agents tree and the version, so installs sharing the cache dir do not rebuild each other's.
+    """
+    cache_dir = os.environ.get("CMBAGENT_CACHE_DIR",
+                               os.path.join(os.path.expanduser("~"), ".cache", "cmbagent"))
+    key = hashlib.sha256(f"{os.path.abspath(path_to_agents)}\0{__version__}".encode()).hexdigest()[:16]
+    name, ext = os.path.splitext(manifest_filename)
+    return os.path.join(cache_dir, f"{name}-{key}{ext}")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _agent_dirs():
+    """(relative directory, is rag) for every directory holding agent modules."""
+    agent_dirs = []
+    for subdir in sorted(os.listdir(path_to_agents)):
+        if subdir == "rag_agents":
+            continue
+        if os.path.isdir(os.path.join(path_to_agents, subdir)):
+            agent_dirs.append((subdir, False))
+    agent_dirs.append(("rag_agents", True))
+    return agent_dirs
+
+
+def build_agent_manifest():
+    """Scan the agents tree and return the manifest as a dict (nothing is written)."""
+    # only needed on a rebuild, a cache hit does not pay for the import of cobaya
+    from cobaya.yaml import yaml_load_file
+
+    manifest = {
+        "manifest_version": MANIFEST_VERSION,
+        "cmbagent_version": __version__,
+        "dirs": {"": _mtime(path_to_agents)},
+        "agents": {},
+    }
+
+    for subdir, rag in _agent_dirs():
+        subdir_path = os.path.join(path_to_agents, subdir)
+        manifest["dirs"][subdir] = _mtime(subdir_path)
+        for filename in sorted(os.listdir(subdir_path)):
+            if not filename.endswith(".py") or filename == "__init__.py" or filename[0] == ".":
+                continue
+            module_name = filename[:-3]  # Remove the .py extension
+            class_name = ''.join([part.capitalize() for part in module_name.split('_')]) + 'Agent'
+            agent_id = os.path.join(subdir, module_name)
+            yaml_path = os.path.join(subdir_path, module_name + ".yaml")
+            manifest["agents"][agent_id] = {
+                "agent_name": module_name,
+                "class_name": class_name,
+                "module_path": f"cmbagent.agents.{subdir}.{module_name}",
+                "rag": rag,
+                "info": yaml_load_file(yaml_path) if os.path.exists(yaml_path) else None,
+                "mtimes": {
+                    filename: _mtime(os.path.join(subdir_path, filename)),
+                    module_name + ".yaml": _mtime(yaml_path),
+                },
+            }
+
+    return manifest
+
+
+def is_manifest_valid(manifest):
+    """Check the manifest against the version and the mtimes of the agents tree."""
+    if manifest.get("manifest_version") != MANIFEST_VERSION:
+        return False
+    if manifest.get("cmbagent_version") != __version__:
+        return False
+    # a directory mtime changes when an agent is added or removed
+    for subdir, mtime in manifest["dirs"].items():
+        if _mtime(os.path.join(path_to_agents, subdir)) != mtime:
+            return False
+    for agent_id, entry in manifest["agents"].items():
+        agent_dir = os.path.dirname(os.path.join(path_to_agents, agent_id))
+        for filename, mtime in entry["mtimes"].items():
+            if _mtime(os.path.join(agent_dir, filename)) != mtime:
+                return False
+    return True
+
+
+def write_agent_manifest(manifest, path=None):
+    """Write the manifest atomically. Returns the path, or None if the cache dir is not writable."""
+    path = path or get_manifest_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        if cmbagent_debug:
+            print(f"could not write agent manifest to {path}: {e}")
+        return None
+    return path
+
+
+def rebuild_agent_manifest(path=None):
+    """Rebuild the manifest from the agents tree, write it and refresh the in-memory copy."""
+    global _manifest_cache
+    manifest = build_agent_manifest()
+    write_agent_manifest(manifest, path)
+    _manifest_cache = manifest
+    return manifest
+
+
+def invalidate_agent_manifest():
+    """Drop the in-memory manifest, e.g. after an agent yaml was edited in this process."""
+    global _manifest_cache
+    _manifest_cache = None
+
+
+def load_agent_manifest(refresh=False):
+    """
+    Return the agent manifest.
+
+    The manifest is read from disk once per process and rebuilt if it is missing,
+    from another version, or older than any file of the agents tree.
+    """
+    global _manifest_cache
+    if _manifest_cache is not None and not refresh:
+        return _manifest_cache
+
+    manifest = None
+    path = get_manifest_path()
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if manifest is None or not is_manifest_valid(manifest):
+        if cmbagent_debug:
+            print(f"rebuilding agent manifest: {path}")
+        return rebuild_agent_manifest(path)
+
+    _manifest_cache = manifest
+    return manifest
+
+
+def get_agent_entries(rag=False):
+    """Manifest entries of the rag (or non-rag) agents, keyed by agent name."""
+    return {entry["agent_name"]: entry
+            for entry in load_agent_manifest()["agents"].values()
+            if entry["rag"] == rag}
+
+
+def load_agent_class(entry):
+    """Import the agent class of a manifest entry (once per process)."""
+    key = (entry["module_path"], entry["class_name"])
+    if key not in _agent_class_cache:
+        module = importlib.import_module(entry["module_path"])
+        _agent_class_cache[key] = getattr(module, entry["class_name"])
+    return _agent_class_cache[key]
+
+
+def load_agent_info(agent_id):
+    """
+    Parsed yaml spec of the agent at agent_id (path of the agent module without extension).
+
+    Returns a copy, since agents edit their info (e.g. the instructions).
+    Agents living outside the agents tree are read from their yaml file.
+    """
+    rel_agent_id = os.path.relpath(agent_id, path_to_agents)
+    entry = load_agent_manifest()["agents"].get(rel_agent_id)
+    if entry is None or entry["info"] is None:
+        from cobaya.yaml import yaml_load_file
+        return yaml_load_file(agent_id + ".yaml")
+    return copy.deepcopy(entry["info"])
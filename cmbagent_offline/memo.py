@@ -0,0 +1,143 @@
+# cmbagent/memo.py
+#
+# Memoization helper for the code written by the engineer. An expensive function
+# (a camb run over a grid, a large data load, ...) decorated with memoize is only
+# computed once across the attempts of a step: its result is saved in the .memo
+# folder of the work_dir (the directory the code is run from), numpy arrays as
+# .npy files loaded back memory-mapped, other results pickled.
+#
+#   from cmbagent.memo import memoize
+#
+#   @memoize
+#   def compute_spectra(H0, ombh2):
+#       ...
+#       return cls
+#
+# The key is the name and source of the function and its arguments (arrays by
+# content), so editing the function or calling it with other arguments recomputes.
+# Only numpy is needed, so importing this module is fast.
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+
+# folder of the memoized results, relative to the directory the code is run from
+memo_dirname = ".memo"
+
+
+def get_memo_dir():
+    """Folder of the memoized results: $CMBAGENT_MEMO_DIR, or .memo in the current directory."""
+    return os.environ.get("CMBAGENT_MEMO_DIR") or os.path.join(os.getcwd(), memo_dirname)
+
+
+def _update_hash(h, value):
+    """Hash value by content: numpy arrays by dtype, shape and bytes, containers recursively, other objects by pickle/repr."""
+    import numpy as np
+    if isinstance(value, np.ndarray):
+        h.update(b"ndarray" + str(value.dtype).encode() + str(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        h.update(type(value).__name__.encode() + str(len(value)).encode())
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(b"dict" + str(len(value)).encode())
+        for key in sorted(value, key=repr):
+            _update_hash(h, key)
+            _update_hash(h, value[key])
+    else:
+        try:
+            h.update(pickle.dumps(value, protocol=4))
+        except Exception:
+            h.update(repr(value).encode())
+
+
+def memo_key(func, args, kwargs):
+    """Key of a call of func: its qualified name, its source and its arguments."""
+    h = hashlib.sha256()
+    h.update(f"{func.__module__}.{func.__qualname__}".encode())
+    try:
+        h.update(inspect.getsource(func).encode())
+    except (OSError, TypeError):
+        h.update(func.__code__.co_code)
+    _update_hash(h, args)
+    _update_hash(h, kwargs)
+    return h.hexdigest()[:32]
+
+
+def _atomic_write(path, write):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _save(path, result):
+    import numpy as np
+    if isinstance(result, np.ndarray) and result.dtype != object:
+        _atomic_write(path + ".npy", lambda f: np.save(f, result))
+    else:
+        _atomic_write(path + ".pkl", lambda f: pickle.dump(result, f, protocol=4))
+
+
+def _load(path, mmap_mode):
+    import numpy as np
+    if os.path.exists(path + ".npy"):
+        return True, np.load(path + ".npy", mmap_mode=mmap_mode)
+    if os.path.exists(path + ".pkl"):
+        with open(path + ".pkl", "rb") as f:
+            return True, pickle.load(f)
+    return False, None
+
+
+def memoize(func=None, *, mmap_mode="r", memo_dir=None):
+    """
+    Decorator caching the results of an expensive function across executions.
+
+    Args:
+        func: The function, its result should only depend on its arguments.
+        mmap_mode (str, optional): Mode of np.load for array results. Defaults to "r", read-only memory map;
+            None loads the array in memory.
+        memo_dir (str, optional): Folder of the results. Defaults to get_memo_dir().
+    """
+    if func is None:
+        return functools.partial(memoize, mmap_mode=mmap_mode, memo_dir=memo_dir)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        directory = memo_dir or get_memo_dir()
+        path = os.path.join(directory, f"{func.__name__}-{memo_key(func, args, kwargs)}")
+        try:
+            found, result = _load(path, mmap_mode)
+        except Exception:
+            # unreadable (e.g. truncated by a killed run), recompute
+            found, result = False, None
+        if found:
+            return result
+        result = func(*args, **kwargs)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _save(path, result)
+        except Exception as e:
+            print(f"memoize: could not save the result of {func.__name__}: {e}")
+        return result
+
+    return wrapper
+
+
+def clear_memo(memo_dir=None):
+    """Remove the memoized results."""
+    directory = memo_dir or get_memo_dir()
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith((".npy", ".pkl")):
+            os.remove(os.path.join(directory, name))
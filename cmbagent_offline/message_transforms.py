@@ -0,0 +1,209 @@
+# cmbagent/message_transforms.py
+#
+# Compaction of the group-chat history seen by the agents of long control loops
+# (engineer, control, researcher), as an autogen message transform: only the
+# messages sent to the LLM are changed, not the chat history itself.
+#
+# The last keep_last messages are left as they are. In the earlier ones:
+#   - a response formatter message that restates the message before it is dropped,
+#   - the code of an attempt whose execution failed is replaced by its diff to the
+#     next version of the same file (or by a one line note if the diff is not shorter),
+#   - the output of a failed execution is replaced by its error signature
+#     (exit code, last traceback location and exception).
+# The tokens saved at each turn are logged, and added to the current trace span.
+import re
+import difflib
+import autogen
+
+from .summary_compaction import count_tokens
+from .tracing import current_span
+
+cmbagent_debug = autogen.cmbagent_debug
+
+# agents whose history is compacted, when history compaction is on
+history_compaction_agents = ['engineer', 'control', 'researcher']
+
+_code_block = re.compile(r"```python\n(.*?)```", re.DOTALL)
+_filename = re.compile(r"#\s*filename:\s*(\S+)")
+_exitcode = re.compile(r"exitcode:\s*(\d+)")
+_traceback_location = re.compile(r'File "([^"]+)", line (\d+)')
+_exception_line = re.compile(r"^\s*([A-Za-z_][\w.]*(Error|Exception|Interrupt|Exit|Warning))\b:?(.*)$", re.MULTILINE)
+
+
+def _content(message):
+    content = message.get("content")
+    return content if isinstance(content, str) else None
+
+
+def _is_plain(message):
+    """Messages that can be changed or dropped without breaking tool call/response pairs."""
+    return _content(message) is not None and not message.get("tool_calls") and message.get("role") != "tool"
+
+
+def _words(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def is_restatement(text, previous, threshold=0.8):
+    """Whether text says about the same as previous (most of its words are in previous)."""
+    words = _words(text)
+    if not words:
+        return False
+    return len(words & _words(previous)) / len(words) >= threshold
+
+
+def execution_failed(text):
+    match = _exitcode.search(text)
+    if match is not None:
+        return match.group(1) != "0"
+    return "Traceback (most recent call last)" in text
+
+
+def error_signature(text):
+    """Exit code, last traceback location and exception of an execution output."""
+    parts = []
+    match = _exitcode.search(text)
+    if match is not None:
+        parts.append(f"exitcode: {match.group(1)} (execution failed)")
+    locations = _traceback_location.findall(text)
+    if locations:
+        path, line = locations[-1]
+        parts.append(f'File "{path}", line {line}')
+    exceptions = _exception_line.findall(text)
+    if exceptions:
+        name, _, message = exceptions[-1]
+        parts.append(f"{name}:{message}".rstrip(":").strip())
+    elif not locations:
+        last_lines = [line for line in text.strip().splitlines() if line.strip() and not _exitcode.search(line)][-2:]
+        parts.extend(last_lines)
+    return "[earlier failed execution, output collapsed]\n" + "\n".join(parts)
+
+
+def _code_of(text):
+    match = _code_block.search(text)
+    if match is None:
+        return None, None
+    code = match.group(1)
+    filename = _filename.search(code)
+    return code, filename.group(1) if filename else None
+
+
+class ChatHistoryCompactor:
+    """
+    Message transform (see autogen's TransformMessages) compacting the older messages of the history.
+
+    Args:
+        keep_last (int): Number of most recent messages left verbatim.
+        drop_restatements (bool): Whether the response formatter restatements are dropped.
+        collapse_failed_attempts (bool): Whether failed code attempts and their outputs are collapsed.
+        restatement_threshold (float): Fraction of the words of a formatter message found in the message before it
+            for it to be a restatement.
+        max_diff_lines (int): Diffs longer than this are replaced by a one line note.
+    """
+
+    def __init__(self, keep_last=6, drop_restatements=True, collapse_failed_attempts=True,
+                 restatement_threshold=0.8, max_diff_lines=40):
+        self.keep_last = keep_last
+        self.drop_restatements = drop_restatements
+        self.collapse_failed_attempts = collapse_failed_attempts
+        self.restatement_threshold = restatement_threshold
+        self.max_diff_lines = max_diff_lines
+        # (tokens before, tokens after) of each turn
+        self.turns = []
+
+    def apply_transform(self, messages):
+        n_old = max(0, len(messages) - self.keep_last)
+        if n_old == 0:
+            self.turns.append((None, None))
+            return messages
+        old, recent = messages[:n_old], messages[n_old:]
+
+        if self.drop_restatements:
+            old = self._drop_restatements(old)
+        if self.collapse_failed_attempts:
+            old = self._collapse_failed_attempts(old, old + recent)
+
+        compacted = old + recent
+        before = sum(count_tokens(_content(message) or "") for message in messages)
+        after = sum(count_tokens(_content(message) or "") for message in compacted)
+        self.turns.append((before, after))
+        span = current_span()
+        if span is not None:
+            span.attributes["history_tokens_before"] = before
+            span.attributes["history_tokens_saved"] = before - after
+        return compacted
+
+    def _drop_restatements(self, messages):
+        kept = []
+        for message in messages:
+            name = message.get("name") or ""
+            if (kept and name.endswith("_response_formatter") and _is_plain(message) and _is_plain(kept[-1])
+                    and is_restatement(_content(message), _content(kept[-1]), self.restatement_threshold)):
+                continue
+            kept.append(message)
+        return kept
+
+    def _collapse_failed_attempts(self, old, messages):
+        # code of every message, to find the next version of a file (also among the recent messages)
+        codes = [_code_of(_content(message) or "") for message in messages]
+        collapsed = []
+        for i, message in enumerate(old):
+            content = _content(message)
+            if content is None or not _is_plain(message):
+                collapsed.append(message)
+                continue
+            code, filename = codes[i]
+            if code is not None and self._next_execution_failed(messages, i):
+                next_code = next((codes[j][0] for j in range(i + 1, len(messages))
+                                  if codes[j][0] is not None and codes[j][1] == filename), None)
+                content = content.replace(code, self._collapse_code(code, filename, next_code), 1)
+                message = dict(message, content=content)
+            elif code is None and ("exitcode:" in content or "Traceback (most recent call last)" in content) and execution_failed(content):
+                message = dict(message, content=error_signature(content))
+            collapsed.append(message)
+        return collapsed
+
+    def _next_execution_failed(self, messages, i):
+        """Whether the first execution output after message i is a failure."""
+        for message in messages[i + 1:]:
+            content = _content(message) or ""
+            if "exitcode:" in content or "Traceback (most recent call last)" in content:
+                return execution_failed(content)
+            if _code_of(content)[0] is not None:
+                # a new version of the code came before any output
+                return False
+        return False
+
+    def _collapse_code(self, code, filename, next_code):
+        n_lines = len(code.splitlines())
+        note = f"# [failed attempt of {filename or 'the script'} collapsed: {n_lines} lines"
+        if next_code is None:
+            return f"{note}]\n"
+        diff = list(difflib.unified_diff(code.splitlines(), next_code.splitlines(),
+                                         fromfile="failed", tofile="next", lineterm="", n=1))
+        if not diff or len(diff) > self.max_diff_lines or len(diff) >= n_lines:
+            return f"{note}, see the next version]\n"
+        return f"{note}, diff to the next version:]\n" + "\n".join(diff) + "\n"
+
+    def get_logs(self, pre_transform_messages, post_transform_messages):
+        before, after = self.turns[-1] if self.turns else (None, None)
+        if before is None or before == after:
+            return "Chat history compaction: nothing to compact.", False
+        n_dropped = len(pre_transform_messages) - len(post_transform_messages)
+        return (f"Chat history compaction: {before - after} tokens saved ({before} -> {after}), "
+                f"{n_dropped} restatements dropped."), True
+
+    @property
+    def tokens_saved(self):
+        return sum(before - after for before, after in self.turns if before is not None)
+
+
+def add_history_compaction(agent, verbose=True, **kwargs):
+    """
+    Compact the history of an autogen agent before each of its replies. Returns the compactor.
+    With verbose, the tokens saved are printed at each turn.
+    """
+    from autogen.agentchat.contrib.capabilities.transform_messages import TransformMessages
+    compactor = ChatHistoryCompactor(**kwargs)
+    TransformMessages(transforms=[compactor], verbose=verbose).add_to_agent(agent)
+    return compactor
@@ -0,0 +1,113 @@
+# cmbagent/native_structured.py
+#
+# Native structured output: instead of handing its reply to a *_response_formatter
+# that makes a second LLM call to fill a response_format model, an agent can be
+# called with that response_format itself, when its provider supports structured
+# output. The reply is then the format() of the model, as the formatter's would be,
+# and the formatter is left out of the hand-off graph (see hand_offs.py).
+#
+# Selected per agent with agent_llm_configs, e.g.
+#   agent_llm_configs = {'engineer': {'model': 'gpt-4.1', ..., 'native_structured_output': True}}
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+# llm_config key selecting the mode, removed from the config sent to the client
+native_structured_key = 'native_structured_output'
+
+# agents that can answer in the response format of their formatter -> the formatter
+native_structured_formatters = {
+    'engineer': 'engineer_response_formatter',
+    'planner': 'planner_response_formatter',
+    'researcher': 'researcher_response_formatter',
+    'summarizer': 'summarizer_response_formatter',
+}
+
+# api types whose autogen client passes response_format to the provider
+# (json schema for openai, response_schema for gemini, format for ollama)
+native_structured_api_types = ['openai', 'google', 'ollama']
+
+# appended to the instructions of the agent, the formatter used to take care of these
+native_structured_instructions = {
+    'engineer': """
+Your reply is given in a structured format: filename (<script_name>.py, keep the same name when fixing a script),
+relative_path ({codebase_path}), code_explanation, modification_summary (only when fixing a previous version)
+and python_code (the code only, ready to execute, without markdown fences).
+Since all files are written in the codebase folder, use relative imports (from filename import function, not from codebase.filename import function).
+""",
+    'planner': """
+Your reply is given in a structured format: the list of sub_tasks, each with its sub_task, sub_task_agent,
+bullet_points and depends_on (the step numbers it depends on, an empty list for none, null if it simply follows the previous step).
+""",
+    'researcher': """
+Your reply is given in a structured format: markdown_block (your notes, without ```markdown fences,
+any code blocks within <code> and </code> tags) and filename ({researcher_filename}).
+""",
+    'summarizer': """
+Your reply is given in a structured format, fill every field of it.
+""",
+}
+
+
+def supports_native_structured_output(config):
+    """Whether the provider of an llm config_list entry supports structured output."""
+    return config.get('api_type') in native_structured_api_types
+
+
+def get_native_structured_agents(agent_llm_configs, default_config=None):
+    """
+    Names of the agents that answer in their formatter's response format.
+
+    Args:
+        agent_llm_configs (dict): Agent name -> config_list entry, with native_structured_output set for the selected agents.
+        default_config (dict, optional): The default config_list entry, completed by the agent configs.
+    """
+    agents = set()
+    for name, agent_config in agent_llm_configs.items():
+        if not agent_config.get(native_structured_key):
+            continue
+        if name not in native_structured_formatters:
+            print(f"native structured output is not available for {name}, it keeps its formatter")
+            continue
+        config = dict(default_config or {})
+        config.update(agent_config)
+        if not supports_native_structured_output(config):
+            print(f"{config.get('api_type')} models do not support structured output, {name} keeps its formatter")
+            continue
+        agents.add(name)
+    return agents
+
+
+def get_native_response_format(agent_name):
+    """The response_format model of the formatter of agent_name."""
+    formatter = native_structured_formatters[agent_name]
+    if formatter == 'engineer_response_formatter':
+        from .agents.engineer_response_formatter.engineer_response_formatter import EngineerResponseFormatterAgent
+        return EngineerResponseFormatterAgent.EngineerResponse
+    if formatter == 'planner_response_formatter':
+        from .agents.planner_response_formatter.planner_response_formatter import PlannerResponse
+        return PlannerResponse
+    if formatter == 'researcher_response_formatter':
+        from .agents.researcher_response_formatter.researcher_response_formatter import ResearcherResponseFormatterAgent
+        return ResearcherResponseFormatterAgent.StructuredMardown
+    from .agents.summarizer_response_formatter.summarizer_response_formatter import SummarizerResponseFormatterAgent
+    return SummarizerResponseFormatterAgent.SummarizerResponse
+
+
+def skipped_formatters(native_structured_agents):
+    """The formatters left out of the hand-off graph."""
+    return {native_structured_formatters[name] for name in native_structured_agents or ()}
+
+
+def select_native_structured(agent_llm_configs, agents):
+    """
+    Set native_structured_output on the configs of the given agents (in place) and return agent_llm_configs.
+
+    Args:
+        agent_llm_configs (dict): Agent name -> config_list entry.
+        agents (list, optional): Names of the agents, e.g. ['engineer', 'planner']; agents without a config are ignored.
+    """
+    for name in agents or ():
+        if name in agent_llm_configs:
+            agent_llm_configs[name][native_structured_key] = True
+    return agent_llm_configs
@@ -0,0 +1,269 @@
+# cmbagent/plan_dag.py
+#
+# Step dependencies of a plan, and a scheduler running the steps of
+# planning_and_control_context_carryover as soon as their dependencies are done.
+#
+# Each sub-task of the plan can list the steps it depends_on. A sub-task without
+# depends_on follows the previous step, so plans written before dependencies
+# existed keep running one step after the other. Steps whose dependencies are all
+# done run concurrently (at most max_parallel_steps at a time), so the wall time
+# of a plan approaches that of its longest chain of dependent steps.
+import os
+import json
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+# in a branch: the files of work_dir it links to, as they were when the step started
+branch_links_filename = ".branch_links.json"
+# in work_dir: the linked files changed while a branch ran
+branch_conflicts_filename = ".branch_conflicts.jsonl"
+
+
+def get_step_dependencies(sub_tasks):
+    """
+    Dependencies of every step of a plan (steps are numbered from 1).
+
+    Args:
+        sub_tasks (list): The sub_tasks of the plan, as in final_plan.json.
+
+    Returns:
+        dict: step -> sorted list of the steps it depends on.
+    """
+    dependencies = {}
+    for step, sub_task in enumerate(sub_tasks, start=1):
+        depends_on = sub_task.get("depends_on") if isinstance(sub_task, dict) else getattr(sub_task, "depends_on", None)
+        if depends_on is None:
+            dependencies[step] = [step - 1] if step > 1 else []
+            continue
+        # a step can only wait for earlier steps, this also rules out cycles
+        valid = sorted({int(j) for j in depends_on if 1 <= int(j) < step})
+        if cmbagent_debug and len(valid) != len(set(depends_on)):
+            print(f"step {step}: ignoring invalid dependencies in {depends_on}")
+        dependencies[step] = valid
+    return dependencies
+
+
+def is_sequential(dependencies):
+    """True if every step waits for the previous one (a plan without parallel steps)."""
+    return all(set(deps) >= {step - 1} - {0} for step, deps in dependencies.items())
+
+
+def critical_path(dependencies, durations=None):
+    """
+    Longest chain of dependent steps.
+
+    Args:
+        dependencies (dict): step -> steps it depends on, see get_step_dependencies.
+        durations (dict, optional): step -> duration. Defaults to 1 per step.
+
+    Returns:
+        tuple: (list of steps of the chain, its total duration)
+    """
+    durations = durations or {}
+    best = {}
+    for step in sorted(dependencies):
+        previous = max(dependencies[step], key=lambda j: best[j][1], default=None)
+        chain, length = best[previous] if previous is not None else ([], 0)
+        best[step] = (chain + [step], length + durations.get(step, 1))
+    return max(best.values(), key=lambda item: item[1], default=([], 0))
+
+
+def run_plan_steps(dependencies, run_step, on_step_done=None, max_parallel_steps=4, done=()):
+    """
+    Run the steps of a plan in dependency order.
+
+    run_step(step) is called for every step once all its dependencies are done,
+    from worker threads if max_parallel_steps > 1 (from the calling thread otherwise).
+    on_step_done(step, result) is always called from the calling thread, one step
+    at a time and in order of completion; it returns False to stop scheduling new
+    steps (the running ones are waited for).
+
+    Args:
+        dependencies (dict): step -> steps it depends on, see get_step_dependencies.
+        run_step (callable): Runs one step, returns its result.
+        on_step_done (callable, optional): Called with each finished step and its result.
+        max_parallel_steps (int, optional): Maximum number of steps running at the same time.
+        done (iterable, optional): Steps already done (e.g. when restarting a plan).
+
+    Returns:
+        list: The steps run, in order of completion.
+    """
+    done = set(done)
+    pending = [step for step in sorted(dependencies) if step not in done]
+    completed = []
+    stop = False
+
+    def ready_steps(running):
+        return [step for step in pending
+                if step not in running and all(j in done or j not in dependencies for j in dependencies[step])]
+
+    if max_parallel_steps <= 1:
+        while pending and not stop:
+            ready = ready_steps(())
+            if not ready:
+                break
+            step = ready[0]
+            result = run_step(step)
+            pending.remove(step)
+            done.add(step)
+            completed.append(step)
+            if on_step_done is not None and on_step_done(step, result) is False:
+                stop = True
+        return completed
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_parallel_steps, thread_name_prefix="plan_step") as pool:
+        while pending or running:
+            if not stop:
+                for step in ready_steps(running.values())[:max_parallel_steps - len(running)]:
+                    if cmbagent_debug:
+                        print(f"plan step {step} started, dependencies {dependencies[step]} done")
+                    running[pool.submit(run_step, step)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in sorted(finished, key=lambda f: running[f]):
+                step = running.pop(future)
+                # a failing step raises here, once the running ones are finished
+                result = future.result()
+                pending.remove(step)
+                done.add(step)
+                completed.append(step)
+                if on_step_done is not None and on_step_done(step, result) is False:
+                    stop = True
+    return completed
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _link_tree(target, directory, links):
+    """
+    Mirror the folders of target in directory, with a link to each file not already in directory.
+    links: link path -> state of the file it links to, filled in.
+    """
+    for root, dirs, files in os.walk(target):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        mirror = os.path.join(directory, os.path.relpath(root, target))
+        os.makedirs(mirror, exist_ok=True)
+        for name in files:
+            link = os.path.join(mirror, name)
+            if not os.path.lexists(link):
+                os.symlink(os.path.join(root, name), link)
+                try:
+                    links[link] = _file_state(link)
+                except OSError:
+                    continue
+
+
+def make_branch_work_dir(branch_dir, work_dir, shared_dirs):
+    """
+    Work directory of a step run concurrently with others.
+
+    The branch keeps its own chats, cost, time and artifact manifest. Its shared_dirs
+    (the data and codebase folders) are folders of its own, with a link to every file
+    of those of work_dir: the step finds the files written by the steps it depends on
+    (they are done when it starts), and its executor only sees the files it writes itself,
+    not those the steps running beside it write meanwhile. merge_branch_work_dir gives
+    the files of the step back to work_dir.
+
+    A file rewritten in place through a link (open("data/x.csv", "w")) is written in
+    work_dir, under the steps running beside it: merge_branch_work_dir reports the linked
+    files that changed while the step ran.
+
+    Args:
+        branch_dir (str or Path): The directory of the step.
+        work_dir (str or Path): The control work directory.
+        shared_dirs (list): Folder names (relative to work_dir) shared by all steps.
+
+    Returns:
+        str: branch_dir
+    """
+    branch_dir = os.path.expanduser(str(branch_dir))
+    os.makedirs(branch_dir, exist_ok=True)
+    links = {}
+    for name in shared_dirs:
+        target = os.path.join(os.path.expanduser(str(work_dir)), name)
+        directory = os.path.join(branch_dir, name)
+        os.makedirs(target, exist_ok=True)
+        try:
+            _link_tree(target, directory, links)
+        except OSError as e:
+            # no symlinks on this file system, the step only sees its own files
+            print(f"could not link the files of {target} in {directory}: {e}")
+    with open(os.path.join(branch_dir, branch_links_filename), "w") as f:
+        json.dump(links, f)
+    return branch_dir
+
+
+def merge_branch_work_dir(branch_dir, work_dir, shared_dirs):
+    """
+    Move the files written by a step in its shared_dirs (see make_branch_work_dir) to work_dir.
+    They are left as links in the branch, so the paths recorded by the step stay valid.
+
+    The files of work_dir the branch links to that changed while the step ran (rewritten
+    through a link by this step or by a step beside it, or replaced by the merge of another
+    step) are conflicts: they are reported and appended to work_dir/.branch_conflicts.jsonl.
+
+    Returns:
+        list: The paths of the files moved, in work_dir.
+    """
+    branch_dir = os.path.expanduser(str(branch_dir))
+    work_dir = os.path.expanduser(str(work_dir))
+    record_branch_conflicts(branch_dir, work_dir)
+    moved = []
+    for name in shared_dirs:
+        directory = os.path.join(branch_dir, name)
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                if os.path.islink(path):
+                    continue
+                target = os.path.join(work_dir, name, os.path.relpath(path, directory))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+                try:
+                    os.symlink(target, path)
+                except OSError:
+                    shutil.copy2(target, path)
+                moved.append(target)
+    return moved
+
+
+def find_branch_conflicts(branch_dir):
+    """The files of work_dir linked by the branch (see make_branch_work_dir) that changed since it was made."""
+    try:
+        with open(os.path.join(branch_dir, branch_links_filename)) as f:
+            links = json.load(f)
+    except (OSError, ValueError):
+        return []
+    conflicts = []
+    for link, state in links.items():
+        try:
+            if _file_state(link) != state:
+                conflicts.append(os.path.realpath(link))
+        except OSError:
+            # removed
+            continue
+    return sorted(conflicts)
+
+
+def record_branch_conflicts(branch_dir, work_dir):
+    """Report the conflicts of a branch and append them to work_dir/.branch_conflicts.jsonl. Returns them."""
+    conflicts = find_branch_conflicts(branch_dir)
+    if conflicts:
+        print(f"\nwarning: files linked by {branch_dir} changed while its step ran (rewritten through a link, "
+              f"the steps run beside it may have read either version):")
+        for path in conflicts:
+            print(f"\t{path}")
+        with open(os.path.join(work_dir, branch_conflicts_filename), "a") as f:
+            f.write("".join(json.dumps({"time": time.time(), "branch": branch_dir, "path": path}) + "\n"
+                            for path in conflicts))
+    return conflicts
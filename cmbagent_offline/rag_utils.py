@@ -1,23 +1,18 @@
 import os
-import importlib
 from openai import OpenAI
 from autogen.cmbagent_utils import cmbagent_debug
 import requests
 import pprint
 from .utils import path_to_assistants,default_chunking_strategy,YAML,update_yaml_preserving_format
+from .manifest import get_agent_entries, load_agent_class, invalidate_agent_manifest
 
 def import_rag_agents():        
+    # agent classes are read from the precompiled manifest, see manifest.py
     imported_rag_agents = {}
-    for filename in os.listdir(path_to_assistants):
-        if filename.endswith(".py") and filename != "__init__.py" and filename[0] != ".":
-            module_name = filename[:-3]  # Remove the .py extension
-            class_name = ''.join([part.capitalize() for part in module_name.split('_')]) + 'Agent'
-            module_path = f"cmbagent.agents.rag_agents.{module_name}"
-            module = importlib.import_module(module_path)
-            agent_class = getattr(module, class_name)
-            imported_rag_agents[class_name] = {}
-            imported_rag_agents[class_name]['agent_class'] = agent_class
-            imported_rag_agents[class_name]['agent_name'] = module_name
+    for module_name, entry in get_agent_entries(rag=True).items():
+        imported_rag_agents[entry['class_name']] = {}
+        imported_rag_agents[entry['class_name']]['agent_class'] = load_agent_class(entry)
+        imported_rag_agents[entry['class_name']]['agent_name'] = module_name
     return imported_rag_agents
 
 
@@ -290,6 +285,9 @@ class {agent_name.capitalize()}Agent(BaseAgent):
         print(f"Created data folder for {agent_name} agent: {agent_data_folder}")
         print(f"Please deposit any relevant files for the {agent_name} agent in this folder.")
 
+    # new agent files, the manifest is rebuilt on next use
+    invalidate_agent_manifest()
+
     # Return a dictionary with the full paths to the agent data folders
     data_folders = {}
     # data_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data')
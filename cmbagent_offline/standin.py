@@ -0,0 +1,362 @@
+# cmbagent/standin.py
+#
+# Record/replay stand-in for the LLM APIs.
+#
+# A local http server speaking the OpenAI chat completions API (/v1/chat/completions)
+# and the ollama chat API (/api/chat). In record mode it forwards every request to
+# the real API and appends the exchange to <fixtures>/exchanges.jsonl; in replay
+# mode it answers from the fixtures only, so one_shot, control and deep_research
+# run end-to-end with no network, optionally with an artificial latency. In stub
+# mode it makes up minimal valid answers (calls the terminating tool when there is
+# one, fills json schemas), to measure the cost of the orchestration itself.
+#
+# With CMBAGENT_LLM_STANDIN set to the url of the stand-in (e.g. http://127.0.0.1:8765/v1),
+# get_model_config and clean_llm_config route every model to it, whatever its api_type.
+# Start one with:
+#   cmbagent standin --fixtures tests/fixtures/one_shot --record --upstream https://api.openai.com
+#   cmbagent standin --fixtures tests/fixtures/one_shot --latency 0.2
+# or from python with start_standin(...).
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+exchanges_filename = "exchanges.jsonl"
+
+# request fields that do not change the response
+_volatile_fields = ("stream", "stream_options", "user", "keep_alive")
+
+
+def standin_key(path, request):
+    """Key of a request: sha256 of the api path and of the canonical json of the request."""
+    request = {k: v for k, v in request.items() if k not in _volatile_fields}
+    endpoint = "ollama" if path.rstrip("/").endswith("/api/chat") else "openai"
+    data = json.dumps([endpoint, request], sort_keys=True, separators=(",", ":"), default=repr)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def route_to_standin(config, url=None):
+    """
+    llm config entry (as made by get_model_config) pointing to the stand-in.
+
+    Every model is served through the OpenAI-compatible endpoint of the stand-in,
+    under its own name, so the fixtures of a recorded session are found again.
+    """
+    url = url or os.environ.get("CMBAGENT_LLM_STANDIN")
+    if not url:
+        return config
+    config = dict(config)
+    config["api_type"] = "openai"
+    config["base_url"] = url
+    # replay does not need a key, record forwards the one of the model
+    if not config.get("api_key") or config["api_key"] == "localhost":
+        config["api_key"] = "standin"
+    return config
+
+
+def fill_json_schema(schema, defs=None, name=""):
+    """Minimal instance of a json schema (first option of unions and enums)."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return fill_json_schema(defs[schema["$ref"].split("/")[-1]], defs, name)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return fill_json_schema(options[0], defs, name)
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return {prop: fill_json_schema(sub, defs, prop) for prop, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [fill_json_schema(schema.get("items", {}), defs, name)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return False
+    if "filename" in name:
+        return "standin.md"
+    # runnable engineer replies: the script is saved in the codebase folder, made by solve
+    if name == "relative_path":
+        return "codebase"
+    if name == "python_code":
+        return "print('stand-in')"
+    return f"stand-in {name}".strip()
+
+
+def stub_response(path, request):
+    """Made up answer to a chat request, in the format of the api of path."""
+    message = {"role": "assistant", "content": None}
+    tools = [tool["function"] for tool in request.get("tools") or [] if "function" in tool]
+    terminating = [tool for tool in tools if "terminat" in tool["name"]]
+    response_format = request.get("response_format") or {}
+    finish_reason = "stop"
+
+    if terminating:
+        tool = terminating[0]
+        message["tool_calls"] = [{
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": tool["name"],
+                         "arguments": json.dumps(fill_json_schema(tool.get("parameters", {})))},
+        }]
+        finish_reason = "tool_calls"
+    elif response_format.get("type") == "json_schema":
+        message["content"] = json.dumps(fill_json_schema(response_format["json_schema"]["schema"]))
+    else:
+        message["content"] = "stand-in reply"
+
+    if path.rstrip("/").endswith("/api/chat"):
+        if message.get("tool_calls"):
+            for call in message["tool_calls"]:
+                call["function"]["arguments"] = json.loads(call["function"]["arguments"])
+        message["content"] = message["content"] or ""
+        return {"model": request.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "message": message, "done": True, "done_reason": "stop",
+                "prompt_eval_count": 10, "eval_count": 10}
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+    }
+
+
+class StandinStore:
+    """Recorded exchanges of a fixtures directory."""
+
+    def __init__(self, fixtures_dir):
+        self.fixtures_dir = str(fixtures_dir) if fixtures_dir is not None else None
+        self.path = os.path.join(self.fixtures_dir, exchanges_filename) if fixtures_dir is not None else None
+        self.lock = threading.Lock()
+        # key -> exchanges with that key, in recorded order
+        self.by_key = {}
+        # model -> exchanges, in recorded order (replay by position when a request differs)
+        self.by_model = {}
+        # replay cursors
+        self._key_counts = {}
+        self._model_counts = {}
+        self.load()
+
+    def load(self):
+        self.by_key, self.by_model = {}, {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        self._add(json.loads(line))
+        except OSError:
+            pass
+
+    def _add(self, exchange):
+        self.by_key.setdefault(exchange["key"], []).append(exchange)
+        self.by_model.setdefault(exchange["model"], []).append(exchange)
+
+    def __len__(self):
+        return sum(len(exchanges) for exchanges in self.by_key.values())
+
+    def record(self, path, request, response, latency):
+        exchange = {"key": standin_key(path, request), "path": path, "model": request.get("model"),
+                    "latency": latency, "request": request, "response": response}
+        with self.lock:
+            os.makedirs(self.fixtures_dir, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(exchange) + "\n")
+            self._add(exchange)
+        return exchange
+
+    def lookup(self, path, request, match_sequence=True):
+        """
+        Recorded exchange for a request: the same request (the n-th time it is seen gets
+        the n-th recorded answer), else, with match_sequence, the next exchange of the model.
+        """
+        key = standin_key(path, request)
+        with self.lock:
+            if key in self.by_key:
+                n = self._key_counts.get(key, 0)
+                self._key_counts[key] = n + 1
+                exchanges = self.by_key[key]
+                return exchanges[min(n, len(exchanges) - 1)]
+            exchanges = self.by_model.get(request.get("model"))
+            if match_sequence and exchanges:
+                n = self._model_counts.get(request.get("model"), 0)
+                self._model_counts[request.get("model")] = n + 1
+                return exchanges[n % len(exchanges)]
+        return None
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send(status, {"error": {"message": message, "type": "standin_error", "code": status}})
+
+    def do_GET(self):
+        # model listings, used by some clients as a health check
+        models = sorted(m for m in self.server.store.by_model if m)
+        if self.path.rstrip("/").endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "standin"} for m in models]})
+        elif self.path.rstrip("/").endswith("/api/tags"):
+            self._send(200, {"models": [{"name": m, "model": m} for m in models]})
+        else:
+            self._error(404, f"unknown path {self.path}")
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if not (path.rstrip("/").endswith("/chat/completions") or path.rstrip("/").endswith("/api/chat")):
+            self._error(404, f"the stand-in only serves chat completions, not {path}")
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if request.get("stream"):
+            self._error(400, "streamed completions are not supported by the stand-in")
+            return
+
+        if server.mode == "stub":
+            if server.latency and server.latency != "recorded":
+                time.sleep(server.latency)
+            self._send(200, stub_response(path, request))
+            return
+
+        if server.mode == "record":
+            start = time.perf_counter()
+            status, response = self._forward(path, request)
+            if status != 200:
+                self._send(status, response)
+                return
+            server.store.record(path, request, response, time.perf_counter() - start)
+            self._send(200, response)
+            return
+
+        exchange = server.store.lookup(path, request, match_sequence=server.match_sequence)
+        if exchange is None:
+            self._error(404, f"no recorded response for model {request.get('model')} "
+                             f"(key {standin_key(path, request)}) in {server.store.path}")
+            return
+        if server.latency == "recorded":
+            time.sleep(exchange.get("latency") or 0)
+        elif server.latency:
+            time.sleep(server.latency)
+        self._send(200, exchange["response"])
+
+    def _forward(self, path, request):
+        server = self.server
+        headers = {"Content-Type": "application/json"}
+        api_key = server.upstream_api_key
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        elif self.headers.get("Authorization") and "standin" not in self.headers["Authorization"]:
+            headers["Authorization"] = self.headers["Authorization"]
+        upstream_request = urllib.request.Request(server.upstream.rstrip("/") + path,
+                                                  data=json.dumps(request).encode(),
+                                                  headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(upstream_request, timeout=server.timeout) as upstream_response:
+                return 200, json.loads(upstream_response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read())
+            except ValueError:
+                return e.code, {"error": {"message": str(e)}}
+        except (urllib.error.URLError, OSError) as e:
+            return 502, {"error": {"message": f"upstream {server.upstream} not reachable: {e}"}}
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    Stand-in LLM server.
+
+    Args:
+        fixtures_dir (str): Directory of exchanges.jsonl (unused in stub mode).
+        mode (str, optional): "replay" (default), "record", or "stub" (made up answers, no fixtures).
+        upstream (str, optional): Base url of the real API in record mode, e.g. https://api.openai.com
+            or http://localhost:11434 for ollama. The request path (/v1/chat/completions, /api/chat) is appended.
+        upstream_api_key (str, optional): Key for the upstream API. Defaults to the key sent by the client.
+        latency (float or "recorded", optional): Delay added to every replayed response, in seconds,
+            or "recorded" for the latency of the recorded call. Defaults to none.
+        match_sequence (bool, optional): In replay mode, answer a request that was not recorded with the
+            next recorded exchange of its model. Defaults to True.
+        host (str, optional): Defaults to 127.0.0.1.
+        port (int, optional): Defaults to 0 (any free port).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixtures_dir, mode="replay", upstream=None, upstream_api_key=None, latency=None,
+                 match_sequence=True, host="127.0.0.1", port=0, timeout=600):
+        if mode not in ("replay", "record", "stub"):
+            raise ValueError(f"unknown stand-in mode {mode!r}, use 'replay', 'record' or 'stub'")
+        if mode == "record" and not upstream:
+            raise ValueError("recording needs the url of the upstream api")
+        super().__init__((host, port), StandinHandler)
+        self.store = StandinStore(fixtures_dir)
+        self.mode = mode
+        self.upstream = upstream
+        self.upstream_api_key = upstream_api_key
+        self.latency = latency
+        self.match_sequence = match_sequence
+        self.timeout = timeout
+        self._thread = None
+        self._saved_env = None
+
+    @property
+    def url(self):
+        """Base url of the OpenAI-compatible endpoint (ollama clients use it without /v1)."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self, set_env=True):
+        """Serve in a background thread. With set_env, the llm configs and OpenAI clients made from now on use the stand-in."""
+        self._thread = threading.Thread(target=self.serve_forever, name="cmbagent_standin", daemon=True)
+        self._thread.start()
+        if set_env:
+            names = ("CMBAGENT_LLM_STANDIN", "OPENAI_BASE_URL", "OLLAMA_HOST")
+            self._saved_env = {name: os.environ.get(name) for name in names}
+            os.environ["CMBAGENT_LLM_STANDIN"] = self.url
+            os.environ["OPENAI_BASE_URL"] = self.url
+            os.environ["OLLAMA_HOST"] = self.url.removesuffix("/v1")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._saved_env is not None:
+            for name, value in self._saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            self._saved_env = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def start_standin(fixtures_dir, mode="replay", **kwargs):
+    """Start a StandinServer in the background and point the llm configs to it. Call .stop() when done."""
+    return StandinServer(fixtures_dir, mode=mode, **kwargs).start()
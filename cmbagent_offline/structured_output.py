@@ -38,6 +38,7 @@ class PlanReviewerResponse(BaseModel):
 class Subtasks(BaseModel):
     sub_task: str = Field(..., description="The sub-task to be performed")
     sub_task_agent:  str = Field(..., description="The name of the agent in charge of the sub-task")
+    depends_on: Optional[list[int]] = Field(None, description="The step numbers whose results this sub-task needs. Empty list if it needs none, null if it simply follows the previous step.")
 
 
 class PlannerResponse(BaseModel):
@@ -48,7 +49,9 @@ class PlannerResponse(BaseModel):
 
     def format(self) -> str:
         plan_output = "\n".join(
-            f"\n- Step {i + 1}:\n\t * sub-task: {step.sub_task}\n\t * agent in charge: {step.sub_task_agent}\n\t" for i, step in enumerate(self.sub_tasks)
+            f"\n- Step {i + 1}:\n\t * sub-task: {step.sub_task}\n\t * agent in charge: {step.sub_task_agent}\n\t"
+            + (f"* depends on: {', '.join(f'Step {j}' for j in step.depends_on) or 'none'}\n\t" if step.depends_on is not None else "")
+            for i, step in enumerate(self.sub_tasks)
         )
         message = f"""
 **PLAN**
@@ -0,0 +1,188 @@
+# cmbagent/summary_compaction.py
+#
+# Token budget for previous_steps_execution_summary, the summaries of the plan
+# steps done so far that are put in the prompts of every later step.
+#
+# The most recent steps are kept verbatim. Older steps are compressed, and when
+# that is not enough the oldest compressed summaries are merged and compressed
+# again (step 1-2, then step 1-4, ...), until the whole fits in the budget.
+# Compressions are cached (in memory, and on disk if a path is given) so that a
+# step summary is compressed only once, also across restarts.
+#
+# The default compressor is extractive and local: it keeps the heading and the
+# most informative lines (numbers, file names, results, errors) of a summary.
+# An LLM summarizer can be passed instead, as summarize(text, max_tokens).
+import os
+import re
+import json
+import hashlib
+import threading
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+summary_cache_filename = "summary_cache.json"
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                # no tiktoken, or its encoding file can not be downloaded (offline)
+                _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens of text with the local tokenizer (about 4 characters per token without tiktoken)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Beginning and end of text, within max_tokens."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    marker = "\n[...]\n"
+    # characters per token of this text, to cut close to the budget
+    ratio = len(text) / count_tokens(text)
+    n_chars = max(0, int((max_tokens - count_tokens(marker)) * ratio))
+    while n_chars > 0:
+        head, tail = text[:n_chars * 2 // 3], text[len(text) - n_chars // 3:]
+        truncated = head.rstrip() + marker + tail.lstrip()
+        if count_tokens(truncated) <= max_tokens:
+            return truncated
+        n_chars = int(n_chars * 0.9)
+    return ""
+
+
+_informative = re.compile(r"\d|[\w-]+\.(png|pdf|jpg|npy|npz|csv|txt|json|py|md|fits|h5|dat)\b"
+                          r"|\b(result|saved|found|error|fail|warning|conclu|value|best|mean|total)", re.IGNORECASE)
+
+
+def extractive_summary(text, max_tokens):
+    """
+    Keep the first line (the "### Step N" heading) and the most informative other
+    lines of text, in their original order, within max_tokens.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return ""
+    heading, body = lines[0], lines[1:]
+    budget = max_tokens - count_tokens(heading) - 1
+    # informative lines first, then the earlier ones
+    ranked = sorted(range(len(body)), key=lambda i: (-len(_informative.findall(body[i])), i))
+    kept = set()
+    for i in ranked:
+        n_tokens = count_tokens(body[i]) + 1
+        if n_tokens <= budget:
+            kept.add(i)
+            budget -= n_tokens
+    summary = "\n".join([heading] + [body[i] for i in sorted(kept)])
+    return truncate_to_tokens(summary, max_tokens)
+
+
+class StepSummaryCompactor:
+    """
+    Join the step summaries into previous_steps_execution_summary within a token budget.
+
+    Args:
+        max_tokens (int): Budget of the joined summaries.
+        keep_recent (int): Number of most recent steps kept verbatim (as long as they fit).
+        summary_tokens (int): Size of a compressed step (or group of steps) summary.
+        cache_path (str, optional): json file where the compressions are kept across restarts.
+        summarize (callable, optional): summarize(text, max_tokens) -> str. Defaults to extractive_summary.
+    """
+
+    def __init__(self, max_tokens=4000, keep_recent=2, summary_tokens=300, cache_path=None, summarize=None):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.summary_tokens = min(summary_tokens, max_tokens)
+        self.cache_path = cache_path
+        self.summarize = summarize or extractive_summary
+        self._lock = threading.Lock()
+        self._cache = {}
+        if cache_path is not None:
+            try:
+                with open(cache_path) as f:
+                    self._cache = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._cache = {}
+
+    def compress(self, text, max_tokens):
+        """Compressed text, computed once per (text, max_tokens)."""
+        key = hashlib.sha256(f"{max_tokens}\0{text}".encode()).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        compressed = self.summarize(text, max_tokens)
+        # an LLM summarizer can overshoot
+        compressed = truncate_to_tokens(compressed, max_tokens)
+        with self._lock:
+            self._cache[key] = compressed
+            if self.cache_path is not None:
+                tmp_path = f"{self.cache_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._cache, f)
+                os.replace(tmp_path, self.cache_path)
+        return compressed
+
+    def compact(self, step_summaries):
+        """
+        Args:
+            step_summaries (dict): step number -> summary of the step.
+
+        Returns:
+            str: the summaries, in step order, within max_tokens.
+        """
+        steps = sorted(step_summaries)
+        n_recent = min(self.keep_recent, len(steps))
+        # blocks: [steps, text, compressed], oldest first
+        blocks = [[[step], step_summaries[step], False] for step in steps]
+        for block in blocks[:len(blocks) - n_recent]:
+            block[1], block[2] = self.compress(block[1], self.summary_tokens), True
+
+        def total(blocks):
+            return sum(count_tokens(text) for _, text, _ in blocks) + 2 * max(0, len(blocks) - 1)
+
+        while total(blocks) > self.max_tokens:
+            compressed = [block for block in blocks if block[2]]
+            if len(compressed) >= 2:
+                # merge the two oldest compressed blocks, one level up
+                first, second = compressed[0], compressed[1]
+                merged_steps = first[0] + second[0]
+                heading = f"### Steps {merged_steps[0]}-{merged_steps[-1]} (summary)"
+                text = self.compress(f"{heading}\n{first[1]}\n{second[1]}", self.summary_tokens)
+                blocks = [block for block in blocks if block is not second]
+                blocks[blocks.index(first)] = [merged_steps, text, True]
+            elif any(not block[2] for block in blocks[:-1]):
+                # compress the oldest verbatim step but the last
+                block = next(block for block in blocks if not block[2])
+                block[1], block[2] = self.compress(block[1], self.summary_tokens), True
+            else:
+                # one compressed digest and the last step: cut the last step to what is left
+                last = blocks[-1]
+                room = self.max_tokens - total(blocks[:-1]) - 2
+                if room <= 0:
+                    return truncate_to_tokens("\n\n".join(text for _, text, _ in blocks), self.max_tokens)
+                last[1] = truncate_to_tokens(last[1], room)
+                break
+
+        joined = "\n\n".join(text for _, text, _ in blocks)
+        if cmbagent_debug:
+            print(f"step summaries: {count_tokens(joined)} tokens in {len(blocks)} blocks "
+                  f"({[block[0] for block in blocks]})")
+        return joined
@@ -0,0 +1,281 @@
+# cmbagent/tracing.py
+#
+# Span tracing of a run: agent turns, LLM requests, registered-function calls
+# (record_status, post_execution_transfer, call_vlm_judge, ...), code executions
+# and external VLM calls.
+#
+# A Tracer is active for the duration of a solve() call (a contextvar, so that
+# concurrent runs and plan steps run in threads keep their own). Spans opened
+# with span() nest under the current one, and cost nothing when no tracer is
+# active. At the end of the run the spans are exported under <work_dir>/traces as
+#   - trace_<name>_<timestamp>.chrome.json: Chrome trace events (chrome://tracing, ui.perfetto.dev)
+#   - trace_<name>_<timestamp>.otlp.json: OTLP/JSON, for any OpenTelemetry backend
+#
+# Enable it with CMBAgent(trace=True) or CMBAGENT_TRACE=1 in the environment.
+import os
+import json
+import time
+import secrets
+import datetime
+import threading
+import functools
+import contextvars
+import contextlib
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+traces_dirname = "traces"
+
+_current_tracer = contextvars.ContextVar("cmbagent_tracer", default=None)
+_current_span = contextvars.ContextVar("cmbagent_span", default=None)
+
+
+def tracing_enabled(trace=None):
+    """trace if given, else $CMBAGENT_TRACE."""
+    if trace is not None:
+        return bool(trace)
+    return os.environ.get("CMBAGENT_TRACE", "").lower() in ("1", "true", "yes")
+
+
+class Span:
+
+    __slots__ = ("name", "category", "span_id", "parent", "start_ns", "end_ns", "thread_id", "attributes", "error")
+
+    def __init__(self, name, category, parent, attributes):
+        self.name = name
+        self.category = category
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+        self.error = None
+
+    @property
+    def duration_s(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Tracer:
+    """Spans of one run."""
+
+    def __init__(self, name="run"):
+        self.name = name
+        self.trace_id = secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name, category, parent=None, **attributes):
+        span = Span(name, category, parent, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def totals(self):
+        """Total time (s) per category, of the spans that are not nested in a span of the same category."""
+        totals = {}
+        for span in self.spans:
+            parent = span.parent
+            while parent is not None and parent.category != span.category:
+                parent = parent.parent
+            if parent is None:
+                totals[span.category] = totals.get(span.category, 0.0) + span.duration_s
+        return totals
+
+    # --- export
+
+    def chrome_trace(self):
+        """Chrome trace-event format (complete events, one row per thread)."""
+        pid = os.getpid()
+        thread_ids = {}
+        events = []
+        for span in self.spans:
+            tid = thread_ids.setdefault(span.thread_id, len(thread_ids) + 1)
+            args = {key: _json_value(value) for key, value in span.attributes.items()}
+            if span.error:
+                args["error"] = span.error
+            events.append({"name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": span.start_ns / 1e3, "dur": ((span.end_ns or time.time_ns()) - span.start_ns) / 1e3,
+                           "args": args})
+        for thread_id, tid in thread_ids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": "main" if tid == 1 else f"thread {tid}"}})
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"run": self.name, "trace_id": self.trace_id}}
+
+    def otlp_trace(self):
+        """OTLP/JSON (ExportTraceServiceRequest) of the spans."""
+        spans = []
+        for span in self.spans:
+            attributes = [{"key": "cmbagent.category", "value": {"stringValue": span.category}}]
+            attributes += [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()]
+            otlp_span = {"traceId": self.trace_id, "spanId": span.span_id, "name": span.name, "kind": 1,
+                         "startTimeUnixNano": str(span.start_ns), "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+                         "attributes": attributes,
+                         "status": {"code": 2, "message": span.error} if span.error else {"code": 1}}
+            if span.parent is not None:
+                otlp_span["parentSpanId"] = span.parent.span_id
+            spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "cmbagent"}},
+                                        {"key": "cmbagent.run", "value": {"stringValue": self.name}}]},
+            "scopeSpans": [{"scope": {"name": "cmbagent.tracing"}, "spans": spans}],
+        }]}
+
+    def export(self, work_dir):
+        """Write both formats under <work_dir>/traces. Returns the two paths."""
+        traces_dir = os.path.join(str(work_dir), traces_dirname)
+        os.makedirs(traces_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        stem = os.path.join(traces_dir, f"trace_{self.name}_{timestamp}")
+        with open(f"{stem}.chrome.json", "w") as f:
+            json.dump(self.chrome_trace(), f)
+        with open(f"{stem}.otlp.json", "w") as f:
+            json.dump(self.otlp_trace(), f)
+        return f"{stem}.chrome.json", f"{stem}.otlp.json"
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def get_tracer():
+    return _current_tracer.get()
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def span(name, category="function", **attributes):
+    """Span around a block, nested in the current span. Yields the span (None when not tracing)."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+    this_span = tracer.start_span(name, category, parent=_current_span.get(), **attributes)
+    token = _current_span.set(this_span)
+    try:
+        yield this_span
+    except BaseException as e:
+        this_span.error = f"{e.__class__.__name__}: {e}"
+        raise
+    finally:
+        this_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def traced(category="function", name=None):
+    """Decorator running the function in a span."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if _current_tracer.get() is None:
+                return f(*args, **kwargs)
+            with span(name or f.__name__, category):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def trace_run(name, work_dir, enabled=True):
+    """
+    Trace the block as one run, and export its spans to <work_dir>/traces when it ends.
+    Yields the tracer (None if not enabled).
+    """
+    if not enabled:
+        yield None
+        return
+    tracer = Tracer(name)
+    tracer_token = _current_tracer.set(tracer)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, "run"):
+            yield tracer
+    finally:
+        _current_span.reset(span_token)
+        _current_tracer.reset(tracer_token)
+        try:
+            paths = tracer.export(work_dir)
+            print(f"\nTrace saved to: {paths[0]}\n")
+        except OSError as e:
+            print(f"could not write the trace of {name}: {e}")
+        if cmbagent_debug:
+            for category, total in sorted(tracer.totals().items(), key=lambda item: -item[1]):
+                print(f"\t{category}: {total:.3f} s")
+
+
+def instrument_agent(agent):
+    """
+    Trace the turns and LLM requests of an autogen agent.
+    The wrappers are set on the instance, and do nothing when no tracer is active.
+    """
+    if getattr(agent, "_cmbagent_traced", False):
+        return agent
+    agent._cmbagent_traced = True
+
+    generate_reply = agent.generate_reply
+
+    @functools.wraps(generate_reply)
+    def traced_generate_reply(*args, **kwargs):
+        if _current_tracer.get() is None:
+            return generate_reply(*args, **kwargs)
+        sender = kwargs.get("sender")
+        with span(agent.name, "turn", sender=getattr(sender, "name", None)):
+            return generate_reply(*args, **kwargs)
+
+    agent.generate_reply = traced_generate_reply
+
+    trace_agent_client(agent)
+    return agent
+
+
+def trace_agent_client(agent):
+    """
+    Trace the LLM requests of an autogen agent. The wrapper is set on its client: autogen builds a
+    new client whenever tools are registered, so this is applied again before each request (see
+    CMBAgent.wrap_agent_client).
+    """
+    client = getattr(agent, "client", None)
+    if client is None or not hasattr(client, "create") or getattr(client, "_cmbagent_traced", False):
+        return agent
+    create = client.create
+
+    @functools.wraps(create)
+    def traced_create(*args, **kwargs):
+        if _current_tracer.get() is None:
+            return create(*args, **kwargs)
+        turn = _current_span.get()
+        with span(f"llm {agent.name}", "llm", agent=agent.name) as llm_span:
+            # time spent in the turn before the request was sent (hooks, transforms, ...)
+            llm_span.attributes["queue_s"] = (llm_span.start_ns - turn.start_ns) / 1e9 if turn is not None else 0.0
+            response = create(*args, **kwargs)
+            latency = (time.time_ns() - llm_span.start_ns) / 1e9
+            llm_span.attributes["latency_s"] = latency
+            # responses are not streamed: the first token comes with the whole response
+            llm_span.attributes["ttft_s"] = latency
+            llm_span.attributes["model"] = getattr(response, "model", None)
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                llm_span.attributes["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+                llm_span.attributes["completion_tokens"] = getattr(usage, "completion_tokens", None)
+            return response
+
+    client.create = traced_create
+    client._cmbagent_traced = True
+    return agent
@@ -0,0 +1,248 @@
+# cmbagent/transcripts.py
+#
+# Streaming chat transcripts: every message appended to a group chat is written
+# as one json line, as soon as it is produced, to <work_dir>/chats/transcript.jsonl
+# (.jsonl.gz or .jsonl.zst when compressed). A crash mid-step loses nothing but
+# the message being written, and the history never has to be dumped at once.
+#
+# transcript.index.json holds the byte offsets of each step (or run) in the
+# transcript, so a step can be read, or paged through, without reading the
+# whole file:
+#   {"file": "transcript.jsonl.gz", "compression": "gzip",
+#    "steps": {"1": {"start": 0, "end": 5321, "messages": 42}, ...}}
+#
+# With compression, each message is its own gzip member (zstd frame), so that
+# reading can start at any offset of the index and the file stays readable up
+# to the last complete message.
+import os
+import itertools
+import json
+import gzip
+import time
+import threading
+import contextvars
+import contextlib
+import autogen
+
+cmbagent_debug = autogen.cmbagent_debug
+
+transcript_name = "transcript"
+
+compression_suffixes = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+# transcript writer of the chat running in this thread
+_active = contextvars.ContextVar("cmbagent_transcript", default=None)
+
+_hook_lock = threading.Lock()
+_hook_installed = False
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd transcripts need the zstandard package (pip install zstandard), or use compression='gzip'")
+    return zstandard
+
+
+def _compress(data, compression):
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return _zstd().ZstdCompressor().compress(data)
+
+
+def _open_stream(f, compression):
+    """Readable decompressed stream of the members (frames) from the current position of f on."""
+    if compression is None:
+        return f
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f)
+    return _zstd().ZstdDecompressor().stream_reader(f, read_across_frames=True)
+
+
+def index_path(chats_dir):
+    return os.path.join(str(chats_dir), f"{transcript_name}.index.json")
+
+
+def load_index(chats_dir):
+    """Index of the transcript in chats_dir, or None if there is none."""
+    try:
+        with open(index_path(chats_dir)) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class TranscriptWriter:
+    """
+    Appends the messages of the chats of a work_dir to its transcript.
+
+    Args:
+        chats_dir (str): Directory of the transcript and its index.
+        compression (str, optional): None, "gzip" or "zstd".
+    """
+
+    def __init__(self, chats_dir, compression=None):
+        if compression not in compression_suffixes:
+            raise ValueError(f"unknown transcript compression {compression}, use one of {list(compression_suffixes)}")
+        if compression == "zstd":
+            _zstd()
+        self.chats_dir = str(chats_dir)
+        self.compression = compression
+        self.filename = transcript_name + compression_suffixes[compression]
+        self.path = os.path.join(self.chats_dir, self.filename)
+        self._lock = threading.Lock()
+        self._file = None
+        self._key = None
+        self._n_messages = 0
+        self._chats = {}
+
+    def _write_index(self, key, entry):
+        index = load_index(self.chats_dir)
+        if index is None or index.get("file") != self.filename:
+            index = {"file": self.filename, "compression": self.compression, "steps": {}}
+        index["steps"][key] = entry
+        tmp_path = index_path(self.chats_dir) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, index_path(self.chats_dir))
+
+    def begin(self, key):
+        """Start the messages of step (or run) key."""
+        with self._lock:
+            os.makedirs(self.chats_dir, exist_ok=True)
+            self._file = open(self.path, "ab")
+            self._key = str(key)
+            self._n_messages = 0
+            self._chats = {}
+            self._start = self._file.tell()
+            # end is None while the step runs: read up to the end of the file
+            self._write_index(self._key, {"start": self._start, "end": None, "messages": 0, "started": time.time()})
+
+    def append(self, message, chat=None):
+        """Write one message (a dict) of the chat with the given label."""
+        record = dict(message)
+        if chat is not None:
+            record["chat"] = chat
+        line = json.dumps(record, default=str).encode() + b"\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(_compress(line, self.compression))
+            # visible to readers (and safe from a crash of the process) right away
+            self._file.flush()
+            self._n_messages += 1
+
+    def end(self):
+        with self._lock:
+            if self._file is None:
+                return
+            end = self._file.tell()
+            self._file.close()
+            self._file = None
+            self._write_index(self._key, {"start": self._start, "end": end, "messages": self._n_messages, "ended": time.time()})
+        if cmbagent_debug:
+            print(f"transcript of {self._key}: {self._n_messages} messages in {self.path}")
+
+    def chat_label(self, groupchat):
+        """main for the first group chat of the step, nested_1, nested_2, ... for the nested chats."""
+        with self._lock:
+            label = self._chats.get(id(groupchat))
+            if label is None:
+                label = "main" if not self._chats else f"nested_{len(self._chats)}"
+                self._chats[id(groupchat)] = label
+            return label
+
+    @contextlib.contextmanager
+    def record(self, key):
+        """Write the messages of the group chats run in the block (in this thread) to the transcript."""
+        install_groupchat_hook()
+        self.begin(key)
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+            self.end()
+
+
+def install_groupchat_hook():
+    """
+    Have GroupChat.append also write the message to the transcript of the current chat, if any.
+    Installed once per process, it does nothing outside of TranscriptWriter.record().
+    """
+    global _hook_installed
+    with _hook_lock:
+        if _hook_installed:
+            return
+        from autogen import GroupChat
+        append = GroupChat.append
+
+        def append_and_record(self, message, speaker):
+            result = append(self, message, speaker)
+            writer = _active.get()
+            if writer is not None and self.messages:
+                try:
+                    writer.append(self.messages[-1], chat=writer.chat_label(self))
+                except (OSError, TypeError, ValueError) as e:
+                    print(f"could not write the message to the transcript {writer.path}: {e}")
+            return result
+
+        append_and_record.__wrapped__ = append
+        GroupChat.append = append_and_record
+        _hook_installed = True
+
+
+def iter_transcript(chats_dir, step=None, chat="main"):
+    """
+    Messages of a transcript, one at a time, read from the offsets of its index.
+
+    Args:
+        chats_dir (str): Directory of the transcript.
+        step (int or str, optional): Step (or run) to read. Defaults to None, i.e., all of them.
+        chat (str, optional): Only the messages of this chat ("main", "nested_1", ...). None for all.
+    """
+    index = load_index(chats_dir)
+    if index is None:
+        return
+    path = os.path.join(str(chats_dir), index["file"])
+    keys = list(index["steps"]) if step is None else [str(step)]
+    with open(path, "rb") as f:
+        for key in keys:
+            entry = index["steps"].get(key)
+            if entry is None:
+                continue
+            f.seek(entry["start"])
+            # a finished step has a known number of messages, a running one is read up to the end of the file
+            n_left = entry["messages"] if entry["end"] is not None else None
+            stream = _open_stream(f, index["compression"])
+            try:
+                for line in stream:
+                    if n_left is not None:
+                        if n_left == 0:
+                            break
+                        n_left -= 1
+                    try:
+                        message = json.loads(line)
+                    except json.JSONDecodeError:
+                        # cut by a crash
+                        continue
+                    if chat is None or message.get("chat", "main") == chat:
+                        yield message
+            except (EOFError, OSError):
+                # last member cut by a crash
+                pass
+
+
+def read_transcript(chats_dir, step=None, start=0, limit=None, chat="main"):
+    """
+    Page of the messages of a transcript: limit messages (all if None) after the first start ones.
+    See iter_transcript for the other arguments.
+
+    Returns:
+        list: the messages.
+    """
+    stop = None if limit is None else start + limit
+    return list(itertools.islice(iter_transcript(chats_dir, step=step, chat=chat), start, stop))
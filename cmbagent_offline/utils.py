@@ -297,6 +297,11 @@ def get_model_config(model, api_keys):
             "api_key": api_keys["OPENAI"],
             "api_type": "openai"
         })
+
+    # offline runs against recorded sessions, see standin.py
+    if os.environ.get("CMBAGENT_LLM_STANDIN"):
+        from cmbagent.standin import route_to_standin
+        config = route_to_standin(config)
     return config
 
 api_keys_env = get_api_keys_from_env()
@@ -341,6 +346,10 @@ def update_yaml_preserving_format(yaml_file, agent_name, new_id, field = 'vector
     with open(yaml_file, 'w') as file:
         yaml.dump(yaml_content, file)
 
+    # the agent manifest holds the parsed yaml, reload it on next use
+    from cmbagent.manifest import invalidate_agent_manifest
+    invalidate_agent_manifest()
+
 def aas_keyword_to_url(keyword):
     """
     Given an AAS keyword, return its IAU Thesaurus URL.
@@ -356,12 +365,28 @@ def aas_keyword_to_url(keyword):
     return dic[keyword]
 
 
-with open(path_to_basedir + '/keywords/aas_kwd_to_url.pkl', 'rb') as file:
-    AAS_keywords_dict = pickle.load(file)
+# the AAS keywords are only unpickled when first needed, not at import
+_aas_keywords_dict = None
+
+def get_aas_keywords_dict():
+    global _aas_keywords_dict
+    if _aas_keywords_dict is None:
+        with open(path_to_basedir + '/keywords/aas_kwd_to_url.pkl', 'rb') as file:
+            _aas_keywords_dict = pickle.load(file)
+    return _aas_keywords_dict
 
-# print(my_dict)
-# Assuming you have already loaded your dictionary into `my_dict`
-AAS_keywords_string = ', '.join(AAS_keywords_dict.keys())
+def get_aas_keywords_string():
+    # print(my_dict)
+    # Assuming you have already loaded your dictionary into `my_dict`
+    return ', '.join(get_aas_keywords_dict().keys())
+
+def __getattr__(name):
+    # AAS_keywords_dict and AAS_keywords_string used to be module constants
+    if name == "AAS_keywords_dict":
+        return get_aas_keywords_dict()
+    if name == "AAS_keywords_string":
+        return get_aas_keywords_string()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 unesco_taxonomy_path = path_to_basedir + '/keywords/unesco_hierarchical.json'
 aaai_keywords_path = path_to_basedir + '/keywords/aaai.md'
@@ -401,6 +426,11 @@ def clean_llm_config(llm_config):
     if llm_config['config_list'][0].get('api_type') == 'groq':
         # Groq works well with most params, just ensure api_key is set
         pass
+
+    # configs made before the stand-in was started (e.g. the module defaults)
+    if os.environ.get("CMBAGENT_LLM_STANDIN"):
+        from cmbagent.standin import route_to_standin
+        llm_config['config_list'][0] = route_to_standin(llm_config['config_list'][0])
     
 
     # if llm_config['config_list'][0]['api_type'] == 'google':
@@ -1,7 +1,6 @@
 import os
 import base64
 import tempfile
-import matplotlib.pyplot as plt
 from typing import Tuple, Literal
 from math import pi
 
@@ -11,6 +10,7 @@ vlm_injection_plot_type: str = "wrong_scalar_amplitude"
 
 def _save_plot_to_files() -> str:
     """Save injected plot to temp file and debug location. All plots named the same."""
+    import matplotlib.pyplot as plt
     with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
         plt.savefig(tmp_file.name, dpi=300, bbox_inches='tight')
         
@@ -40,6 +40,7 @@ def _save_plot_to_files() -> str:
 
 def _execute_injection_code(code: str) -> str:
     """Execute the injection code and return base64 plot."""
+    import matplotlib.pyplot as plt
     namespace = {
         'Class': Class,
         'plt': plt,
@@ -1,4 +1,5 @@
 import base64
+import contextvars
 import json
 import autogen
 from typing import Literal
@@ -8,10 +9,15 @@ from google.genai import types
 from autogen.agentchat.group import ContextVariables
 from pydantic import BaseModel, Field
 from .utils import get_api_keys_from_env
+from .llm_cache import get_llm_cache, cached_create
+from .tracing import traced
+from .cost_ledger import record_external_call
 from .vlm_injections import scientific_context, get_injection_by_name
 
 cmbagent_debug = autogen.cmbagent_debug
-_last_executed_code = None
+# code of the last engineer response, per run: a ContextVar so that concurrent
+# runs (threads) do not read each other's code
+_last_executed_code = contextvars.ContextVar("last_executed_code", default=None)
 
 # VLM model configuration
 # TODO: when refactoring, make a one_shot dictionary argument for all of this
@@ -167,6 +173,7 @@ def generate_wrong_plot_injection(plot_type: str = "wrong_scalar_amplitude"):
     return wrong_code, base64_image
 
 
+@traced("vlm")
 def send_image_to_vlm(base_64_img: str, vlm_prompt: str, inject_wrong_plot: bool | str = False, context_variables: ContextVariables = None) -> tuple[str | OpenAICompletion, str | None]:
     """
     Send the encoded image to a VLM model and return the completion.
@@ -351,6 +358,7 @@ def account_for_external_api_calls(agent, completion, call_type="VLM"):
     
     # Add to agent's cost tracking
     agent_name = getattr(agent, 'name', 'plot_judge')
+    record_external_call(agent_name, model, prompt_tokens, completion_tokens, total_tokens, total_cost, kind=call_type)
     agent.cost_dict["Agent"].append(agent_name)
     agent.cost_dict["Cost"].append(total_cost)
     agent.cost_dict["Prompt Tokens"].append(prompt_tokens)
@@ -427,6 +435,7 @@ def _create_fallback_response(has_code_context: bool = False):
     )
     
 
+@traced("vlm")
 def generate_llm_scientific_criteria(plot_description: str, plot_type: str = "scientific plot"):
     """
     Generate domain-specific scientific criteria using LLM based on plot description.
@@ -480,7 +489,8 @@ Check the following features:
     - If baseline is not flat → indicates improper normalization or stellar variability (invalid for detrended light curves)
 """
 
-        response = client.chat.completions.create(
+        # same plot description, same criteria: replayed from the llm cache when it is enabled
+        response = cached_create(get_llm_cache(), client.chat.completions.create,
             model="gpt-4o",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=800,
@@ -519,6 +529,7 @@ class PlotDebuggerResponse(BaseModel):
     )
 
 
+@traced("vlm")
 def call_external_plot_debugger(task_context: str, vlm_analysis: str, problems: list[str], executed_code: str) -> list[str]:
     """
     Call external Gemini 2.5 Pro to analyze problems and generate targeted fixes.
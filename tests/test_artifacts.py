@@ -0,0 +1,106 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+from autogen.coding.base import CodeBlock
+from cmbagent.execution import ArtifactRecordingCodeExecutor
+from cmbagent.execution.artifacts import get_artifact_manifest, written_names
+from cmbagent.functions import displayed_images_index, load_new_plots
+
+
+def recorded(executor, code):
+   start_ns = time.time_ns()
+   return {os.path.relpath(record["path"], executor.work_dir)
+           for record in executor.record_artifacts(start_ns, [CodeBlock(code=code, language="python")])}
+
+
+def write(work_dir, relpath, text="x"):
+   path = os.path.join(work_dir, relpath)
+   os.makedirs(os.path.dirname(path), exist_ok=True)
+   with open(path, "w") as f:
+      f.write(text)
+
+
+def test_written_names():
+
+   names, patterns = written_names([CodeBlock(code='np.save("data/a.npy", x)\nplt.savefig(f"{out}/plot_{i}.png")\nf"data/spec_{n}.txt"', language="python")])
+   assert "a.npy" in names
+   assert ("", ".png") in patterns and ("spec_", ".txt") in patterns
+   assert written_names([CodeBlock(code="ls data", language="bash")]) is None
+   assert written_names([CodeBlock(code="def (", language="python")]) is None
+
+
+def test_record_artifacts_pruned():
+
+   work_dir = tempfile.mkdtemp()
+   for i in range(20):
+      write(work_dir, f"data/run_{i}/file_{i}.txt")
+   time.sleep(0.1)
+   executor = ArtifactRecordingCodeExecutor(work_dir=work_dir)
+   assert recorded(executor, "") == set()
+   time.sleep(0.1)
+
+   # new files, and a file rewritten in place under a name of the code
+   write(work_dir, "data/run_3/file_3.txt", "y")
+   write(work_dir, "data/run_4/plot_4.png")
+   write(work_dir, "data/spectrum.npy")
+   changed = recorded(executor, 'x = "data/run_3/file_3.txt"\nplt.savefig(f"data/run_4/plot_{i}.png")\nnp.save("data/spectrum.npy", x)')
+   assert changed == {"data/run_3/file_3.txt", "data/run_4/plot_4.png", "data/spectrum.npy"}
+   time.sleep(0.1)
+
+   # rewritten in place under a name the code does not spell out: only seen when every file is checked
+   start_ns = time.time_ns()
+   write(work_dir, "data/run_5/file_5.txt", "y")
+   assert recorded(executor, "x = 1") == set()
+   records = executor.record_artifacts(start_ns, [CodeBlock(code="cp a data/run_5/file_5.txt", language="bash")])
+   assert [os.path.relpath(record["path"], work_dir) for record in records] == ["data/run_5/file_5.txt"]
+
+
+def test_new_plots():
+
+   work_dir = tempfile.mkdtemp()
+   executor = ArtifactRecordingCodeExecutor(work_dir=work_dir)
+   instance = SimpleNamespace(work_dir=work_dir)
+   context = {"database_path": "data", "displayed_images": []}
+   write(work_dir, "data/a.png")
+   write(work_dir, "data/b.png")
+   recorded(executor, "")
+   a, b = (os.path.join(work_dir, "data", name) for name in ("a.png", "b.png"))
+   assert load_new_plots(instance, context) == [a, b]
+
+   # not displayed yet: returned again, with the new ones
+   time.sleep(0.1)
+   write(work_dir, "data/c.png")
+   recorded(executor, "")
+   c = os.path.join(work_dir, "data", "c.png")
+   assert load_new_plots(instance, context) == [a, b, c]
+
+   # the list replaced by a longer copy
+   context["displayed_images"] = context["displayed_images"] + [a, b]
+   assert load_new_plots(instance, context) == [c]
+   context["displayed_images"] = context["displayed_images"] + [c]
+   assert load_new_plots(instance, context) == []
+   assert get_artifact_manifest(work_dir).new_plots() == []
+
+
+def test_displayed_images_index():
+
+   context = {"displayed_images": ["a", "b"]}
+   assert displayed_images_index(context) == {"a", "b"}
+   context["displayed_images"] = context["displayed_images"] + ["c"]
+   assert displayed_images_index(context) == {"a", "b", "c"}
+   context["displayed_images"].append("d")
+   assert displayed_images_index(context) == {"a", "b", "c", "d"}
+   # replaced by another list of the same length
+   context["displayed_images"] = ["e", "f", "g", "h"]
+   assert displayed_images_index(context) == {"e", "f", "g", "h"}
+   context["displayed_images"] = []
+   assert displayed_images_index(context) == set()
+
+
+if __name__ == "__main__":
+   test_written_names()
+   test_record_artifacts_pruned()
+   test_new_plots()
+   test_displayed_images_index()
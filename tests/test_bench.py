@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import tempfile
+
+from cmbagent.cli import main
+
+
+def bench(*args):
+   """Run cmbagent bench with tiny sizes, returns the exit code."""
+   argv = sys.argv
+   sys.argv = ["cmbagent", "bench", "--quick", "--only", "record_status", "load_plots", "checkpoints",
+               "--codebase-sizes", "5", "--data-sizes", "5", *args]
+   try:
+      main()
+   except SystemExit as e:
+      return e.code
+   finally:
+      sys.argv = argv
+   return 0
+
+
+def test_bench_command():
+
+   api_key = os.environ.get("OPENAI_API_KEY")
+   os.environ.setdefault("OPENAI_API_KEY", "stub")
+   directory = tempfile.mkdtemp()
+   output = os.path.join(directory, "results.json")
+   baseline = os.path.join(directory, "baseline.json")
+   try:
+      assert bench("--output", output, "--baseline", baseline, "--save-baseline") == 0
+      with open(output) as f:
+         report = json.load(f)
+      with open(baseline) as f:
+         assert json.load(f) == report
+      assert report["skipped"] == {}
+      assert {"record_status_codebase_5_cold", "record_status_codebase_5_warm"} <= set(report["results"])
+      assert all(result["median_s"] > 0 for result in report["results"].values())
+
+      # against the baseline, with a tolerance the timings can not exceed
+      assert bench("--output", output, "--baseline", baseline, "--tolerance", "1000") == 0
+
+      # a baseline that used far less memory: reported as a regression
+      report["peak_rss_mb"] = 1.0
+      with open(baseline, "w") as f:
+         json.dump(report, f)
+      assert bench("--baseline", baseline) == 1
+   finally:
+      if api_key is None:
+         os.environ.pop("OPENAI_API_KEY", None)
+      else:
+         os.environ["OPENAI_API_KEY"] = api_key
+
+
+if __name__ == "__main__":
+   test_bench_command()
@@ -0,0 +1,45 @@
+from pathlib import Path
+import tempfile
+import time
+
+from cmbagent.checkpoints import CheckpointStore
+
+
+def test_checkpoints_replay():
+
+   context_dir = Path(tempfile.mkdtemp()) / "context"
+   docs = "camb documentation " * 10000
+
+   context = {"camb_context": docs, "plans": ["step 1", "step 2"], "n_attempts": 0,
+              "previous_steps_execution_summary": "\n", "work_dir": Path("/tmp/run")}
+   contexts = [dict(context)]
+
+   checkpoints = CheckpointStore(context_dir)
+   checkpoints.write_step(0, context)
+   for step in range(1, 6):
+      context = dict(context)
+      context["previous_steps_execution_summary"] += f"### Step {step}\ndone\n"
+      context["n_attempts"] = step % 2
+      contexts.append(context)
+      written = checkpoints.write_step(step, context)
+      # the docs are stored once, only the changed keys are written
+      assert "camb_context" not in written
+
+   assert len(list((context_dir / "blobs").iterdir())) == 1
+
+   # restart on a fresh store, as on another node
+   start = time.time()
+   restored = CheckpointStore(context_dir).load_step(3)
+   assert time.time() - start < 0.5
+   assert restored == contexts[3]
+
+   # re-running step 4 from the restored context supersedes the old step 4
+   checkpoints = CheckpointStore(context_dir)
+   checkpoints.load_step(3)
+   retried = dict(contexts[3], n_attempts=7)
+   checkpoints.write_step(4, retried)
+   assert CheckpointStore(context_dir).load_step(4) == retried
+
+
+if __name__ == "__main__":
+   test_checkpoints_replay()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import threading
+
+from cmbagent.codebase_index import get_codebase_index
+
+
+def write_module(directory, i):
+   with open(os.path.join(directory, f"module_{i}.py"), "w") as f:
+      f.write(f"def function_{i}(x):\n    \"\"\"Compute quantity {i}.\"\"\"\n    return x\n")
+
+
+def test_codebase_index_concurrent():
+
+   # steps run concurrently share the index of their codebase
+   directory = tempfile.mkdtemp()
+   indexes = []
+   errors = []
+
+   def step(i):
+      try:
+         for j in range(10):
+            write_module(directory, 10 * i + j)
+            index = get_codebase_index(directory)
+            index.render()
+         indexes.append(index)
+      except Exception as e:
+         errors.append(e)
+
+   threads = [threading.Thread(target=step, args=(i,)) for i in range(8)]
+   for thread in threads:
+      thread.start()
+   for thread in threads:
+      thread.join()
+
+   assert errors == []
+   assert len({id(index) for index in indexes}) == 1
+   rendered = get_codebase_index(directory).render()
+   assert all(f"function name: function_{i}\n" in rendered for i in range(80))
+
+
+if __name__ == "__main__":
+   test_codebase_index_concurrent()
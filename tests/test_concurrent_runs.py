@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cmbagent.standin import StandinServer, StandinHandler
+
+
+# Concurrent one_shot/summarize_document runs against a stub OpenAI-compatible server.
+# Every task carries its own RUN-xxxxxxxx token: a request mentioning two different
+# tokens, or a result holding another run's token, means context leaked between runs.
+
+N_RUNS = int(os.environ.get("CMBAGENT_STRESS_RUNS", "8"))
+STUB_MODEL = "gpt-4.1-mini"
+
+token_re = re.compile(r"RUN-[0-9a-f]{8}")
+
+
+def fill_schema(schema, token, defs=None, name=""):
+   """Minimal instance of a json schema, with the run token in every string."""
+   defs = defs if defs is not None else schema.get("$defs", {})
+   if "$ref" in schema:
+      return fill_schema(defs[schema["$ref"].split("/")[-1]], token, defs, name)
+   for key in ("anyOf", "oneOf", "allOf"):
+      if key in schema:
+         options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+         return fill_schema(options[0], token, defs, name)
+   if "enum" in schema:
+      return schema["enum"][0]
+   kind = schema.get("type", "string")
+   if kind == "object":
+      return {prop: fill_schema(sub, token, defs, prop) for prop, sub in schema.get("properties", {}).items()}
+   if kind == "array":
+      return [fill_schema(schema.get("items", {}), token, defs, name)]
+   if kind == "integer":
+      return 1
+   if kind == "number":
+      return 1.0
+   if kind == "boolean":
+      return False
+   if "filename" in name:
+      return f"{token}.md"
+   return f"stub {name} {token}"
+
+
+class StubLLM(StandinHandler):
+
+   leaks = []
+   n_requests = 0
+   lock = threading.Lock()
+
+   def do_POST(self):
+      request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+      tokens = set(token_re.findall(json.dumps(request.get("messages", []))))
+      with StubLLM.lock:
+         StubLLM.n_requests += 1
+         if len(tokens) > 1:
+            StubLLM.leaks.append(sorted(tokens))
+      token = min(tokens) if tokens else "RUN-00000000"
+
+      message = {"role": "assistant", "content": None}
+      tools = [tool["function"] for tool in request.get("tools", [])]
+      terminating = [tool for tool in tools if "terminat" in tool["name"]]
+      response_format = request.get("response_format") or {}
+
+      if terminating:
+         tool = terminating[0]
+         message["tool_calls"] = [{
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": tool["name"],
+                         "arguments": json.dumps(fill_schema(tool.get("parameters", {}), token))},
+         }]
+         finish_reason = "tool_calls"
+      elif response_format.get("type") == "json_schema":
+         message["content"] = json.dumps(fill_schema(response_format["json_schema"]["schema"], token))
+         finish_reason = "stop"
+      else:
+         message["content"] = f"stub reply for {token}"
+         finish_reason = "stop"
+
+      self._send(200, {
+         "id": f"chatcmpl-{uuid.uuid4().hex}",
+         "object": "chat.completion",
+         "created": int(time.time()),
+         "model": request.get("model", STUB_MODEL),
+         "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+         "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+      })
+
+
+def run_one_shot(token, work_dir):
+   import cmbagent
+   results = cmbagent.one_shot(
+      f"Write a short note about {token}.",
+      max_rounds=20,
+      agent="researcher",
+      researcher_model=STUB_MODEL,
+      engineer_model=STUB_MODEL,
+      plot_judge_model=STUB_MODEL,
+      camb_context_model=STUB_MODEL,
+      default_llm_model=STUB_MODEL,
+      default_formatter_model=STUB_MODEL,
+      work_dir=work_dir,
+      clear_work_dir=True,
+   )
+   return json.dumps({"chat_history": results["chat_history"],
+                      "final_context": dict(results["final_context"].data)}, default=str)
+
+
+def run_summarize_document(token, work_dir):
+   import cmbagent
+   os.makedirs(work_dir, exist_ok=True)
+   document = os.path.join(work_dir, "..", f"{token}.md")
+   with open(document, "w") as f:
+      f.write(f"# Document {token}\n\nThis document is about {token}.\n")
+   summary = cmbagent.summarize_document(document,
+                                         work_dir=work_dir,
+                                         summarizer_model=STUB_MODEL,
+                                         summarizer_response_formatter_model=STUB_MODEL,
+                                         default_llm_model=STUB_MODEL,
+                                         default_formatter_model=STUB_MODEL)
+   return json.dumps(summary, default=str)
+
+
+def test_concurrent_runs(tmp_path=None):
+
+   tmp_path = Path(tmp_path or f"/tmp/cmbagent_concurrent_{uuid.uuid4().hex[:8]}")
+
+   from cmbagent.context import shared_context
+   shared_context_before = json.dumps(shared_context, sort_keys=True, default=str)
+
+   runs = []
+   for i in range(N_RUNS):
+      token = f"RUN-{uuid.uuid4().hex[:8]}"
+      run = run_one_shot if i % 2 == 0 else run_summarize_document
+      runs.append((token, run, str(tmp_path / token / "work")))
+
+   # the stand-in restores OPENAI_BASE_URL, the key is put back here: the tests collected after this one use the real api
+   api_key = os.environ.get("OPENAI_API_KEY")
+   os.environ["OPENAI_API_KEY"] = "stub"
+   try:
+      with StandinServer(None, mode="stub") as server:
+         server.RequestHandlerClass = StubLLM
+         with ThreadPoolExecutor(max_workers=N_RUNS) as pool:
+            outputs = list(pool.map(lambda r: r[1](r[0], r[2]), runs))
+   finally:
+      if api_key is None:
+         del os.environ["OPENAI_API_KEY"]
+      else:
+         os.environ["OPENAI_API_KEY"] = api_key
+
+   assert StubLLM.n_requests > 0
+   assert StubLLM.leaks == [], f"requests mixing runs: {StubLLM.leaks}"
+
+   for (token, _, _), output in zip(runs, outputs):
+      assert token in output
+      assert set(token_re.findall(output)) == {token}, f"{token} saw {set(token_re.findall(output)) - {token}}"
+
+   # the module default context is left untouched
+   assert json.dumps(shared_context, sort_keys=True, default=str) == shared_context_before
+
+
+if __name__ == "__main__":
+   test_concurrent_runs()
@@ -0,0 +1,56 @@
+from cmbagent.context import ContextStore, fork_context
+
+
+def test_fork_context():
+
+   doc = "camb documentation " * 1000
+   context = {"camb_context": doc, "plans": [["step 1"]], "n_attempts": 0, "summary": ("a", "b")}
+   forked = fork_context(context)
+
+   # immutables are shared by reference
+   assert forked["camb_context"] is doc and forked["summary"] is context["summary"]
+   # mutable values are copied
+   forked["plans"][0].append("step 2")
+   forked["plans"].append(["step 3"])
+   assert context["plans"] == [["step 1"]]
+
+
+def test_commit_delta():
+
+   store = ContextStore({"a": "x" * 100, "b": 10**6, "plans": ["step 1"], "gone": 1})
+   context = store.fork()
+   # equal values rebuilt by the step are not changes
+   context["a"] = "".join(["x"] * 100)
+   context["b"] = int("1" + "0" * 6)
+   context["plans"] = ["step 1"]
+   context["new"] = True
+   del context["gone"]
+   assert store.commit(context) == {"new": True}
+   assert "gone" not in store and store["a"] == "x" * 100
+   # an equal value of another type is a change
+   context = store.fork()
+   context["new"] = 1
+   assert store.commit(context) == {"new": 1}
+
+
+def test_commit_concurrent_forks():
+
+   store = ContextStore({"status": "planned", "summary": "", "n_attempts": 1000, "tmp": 0})
+   base = store.snapshot()
+   first, second = store.fork(), store.fork()
+   first["status"] = "step 1 done"
+   first["n_attempts"] = 1001
+   del first["tmp"]
+   # the second step re-sets a key to its forked value, rebuilt
+   second["status"] = "".join(["plan", "ned"])
+   second["summary"] = "step 2 done"
+
+   assert store.commit(first, base=base) == {"status": "step 1 done", "n_attempts": 1001}
+   assert store.commit(second, base=base) == {"summary": "step 2 done"}
+   assert store.data == {"status": "step 1 done", "summary": "step 2 done", "n_attempts": 1001}
+
+
+if __name__ == "__main__":
+   test_fork_context()
+   test_commit_delta()
+   test_commit_concurrent_forks()
@@ -0,0 +1,79 @@
+import tempfile
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+from cmbagent.cost_ledger import CostLedger, read_ledger, aggregate_records, record_external_call, track_agent_costs
+
+
+class Agent:
+
+   def __init__(self, name, tokens=100, cost=0.01):
+      self.name = name
+      self.client = SimpleNamespace(create=lambda **request: SimpleNamespace(
+         model=request["model"], cost=cost,
+         usage=SimpleNamespace(prompt_tokens=tokens - 10, completion_tokens=10, total_tokens=tokens)))
+
+
+def test_cost_ledger():
+
+   path = Path(tempfile.mkdtemp()) / "cost_ledger.jsonl"
+   ledger = CostLedger(path)
+   engineer = track_agent_costs(Agent("engineer"))
+   # not recorded outside of a tracked chat
+   engineer.client.create(model="gpt-4.1")
+
+   with ledger.track(step=1):
+      engineer.client.create(model="gpt-4.1")
+      engineer.client.create(model="gpt-4.1-mini")
+      record_external_call("plot_judge", "gpt-4o", 1000, 50, 1050, 0.003, kind="VLM")
+
+   def step_2():
+      with ledger.track(step=2):
+         engineer.client.create(model="gpt-4.1")
+
+   thread = threading.Thread(target=step_2)
+   thread.start()
+   thread.join()
+
+   summary = ledger.summary()
+   assert summary["totals"]["calls"] == 4 and summary["totals"]["total_tokens"] == 1350
+   assert summary["by_agent"]["engineer"]["calls"] == 3
+   assert summary["by_model"]["gpt-4.1"]["calls"] == 2
+   assert summary["by_step"][2]["calls"] == 1
+   # the file holds the same as the live aggregates
+   records = read_ledger(path)
+   assert [record["kind"] for record in records] == ["llm", "llm", "VLM", "llm"]
+   assert aggregate_records(records)["by_step"][1] == summary["by_step"][1]
+
+
+def test_budgets():
+
+   ledger = CostLedger(Path(tempfile.mkdtemp()) / "cost_ledger.jsonl", budget={"max_cost": 0.045}, step_budget={"max_tokens": 250})
+   engineer = track_agent_costs(Agent("engineer"))
+   reasons = []
+
+   with ledger.track(step=1, on_exceeded=reasons.append) as tracker:
+      engineer.client.create(model="gpt-4.1")
+      engineer.client.create(model="gpt-4.1")
+      assert tracker.exceeded is None
+      engineer.client.create(model="gpt-4.1")
+      assert tracker.exceeded.startswith("token budget exceeded")
+      # called once
+      engineer.client.create(model="gpt-4.1")
+   assert len(reasons) == 1 and ledger.exceeded is None
+
+   # a new step starts with its own token count, until the run goes over its dollar budget
+   with ledger.track(step=2, on_exceeded=reasons.append):
+      engineer.client.create(model="gpt-4.1")
+   assert ledger.exceeded.startswith("cost budget exceeded") and len(reasons) == 2
+
+   # the run is over budget: the next chat ends right away
+   with ledger.track(step=3, on_exceeded=reasons.append) as tracker:
+      assert tracker.exceeded == ledger.exceeded
+   assert len(reasons) == 3
+
+
+if __name__ == "__main__":
+   test_cost_ledger()
+   test_budgets()
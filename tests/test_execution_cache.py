@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+import numpy as np
+from autogen.coding.base import CodeBlock
+from cmbagent.execution import ArtifactRecordingCodeExecutor
+from cmbagent.memo import memoize
+
+
+code = """# filename: codebase/spectrum.py
+import numpy as np
+with open(".n_runs", "a") as f:
+    f.write("x")
+x = np.loadtxt("data/input.txt")
+np.save("data/spectrum.npy", 2 * x)
+print("sum", (2 * x).sum())
+"""
+
+
+def n_runs(work_dir):
+   with open(os.path.join(work_dir, ".n_runs")) as f:
+      return len(f.read())
+
+
+def test_execution_cache():
+
+   work_dir = tempfile.mkdtemp()
+   os.makedirs(os.path.join(work_dir, "data"))
+   os.makedirs(os.path.join(work_dir, "codebase"))
+   np.savetxt(os.path.join(work_dir, "data", "input.txt"), np.arange(3.))
+   executor = ArtifactRecordingCodeExecutor(work_dir=work_dir, execution_cache=True)
+
+   first = executor.execute_code_blocks([CodeBlock(code=code, language="python")])
+   assert first.exit_code == 0 and "sum 6.0" in first.output and n_runs(work_dir) == 1
+
+   # same code (comments do not matter), same inputs: replayed, its outputs restored
+   os.remove(os.path.join(work_dir, "data", "spectrum.npy"))
+   replayed = executor.execute_code_blocks([CodeBlock(code=code.replace("import numpy", "# comment\nimport numpy"), language="python")])
+   assert replayed.output == first.output and n_runs(work_dir) == 1
+   assert np.load(os.path.join(work_dir, "data", "spectrum.npy")).sum() == 6.
+   assert executor.execution_cache.summary() == "1/2 executions replayed from the cache"
+
+   # the script is saved again on a replay, and saved under another name is not the same execution
+   os.remove(os.path.join(work_dir, "codebase", "spectrum.py"))
+   executor.execute_code_blocks([CodeBlock(code=code, language="python")])
+   assert os.path.exists(os.path.join(work_dir, "codebase", "spectrum.py")) and n_runs(work_dir) == 1
+   renamed = executor.execute_code_blocks([CodeBlock(code=code.replace("spectrum.py", "spectrum_v2.py"), language="python")])
+   assert "sum 6.0" in renamed.output and n_runs(work_dir) == 2
+   assert os.path.exists(os.path.join(work_dir, "codebase", "spectrum_v2.py"))
+
+   # the input changed: run again
+   np.savetxt(os.path.join(work_dir, "data", "input.txt"), np.arange(4.))
+   rerun = executor.execute_code_blocks([CodeBlock(code=code, language="python")])
+   assert "sum 12.0" in rerun.output and n_runs(work_dir) == 3
+
+
+def test_memoize():
+
+   memo_dir = tempfile.mkdtemp()
+   calls = []
+
+   @memoize(memo_dir=memo_dir)
+   def expensive(n, scale=1.):
+      calls.append(n)
+      return scale * np.arange(n)
+
+   assert expensive(5).sum() == 10.
+   cached = expensive(5)
+   assert isinstance(cached, np.memmap) and cached.sum() == 10. and calls == [5]
+   assert expensive(5, scale=2.).sum() == 20. and calls == [5, 5]
+
+
+if __name__ == "__main__":
+   test_execution_cache()
+   test_memoize()
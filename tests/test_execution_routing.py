@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+
+from cmbagent.execution_routing import ExecutionRouter, classify_execution, parse_execution_message
+
+
+def traceback_output(frames, error):
+   return ("Traceback (most recent call last):\n"
+           + "".join(f'  File "{path}", line 10, in f\n    x = g()\n' for path in frames)
+           + error + "\n")
+
+
+def test_classify_execution():
+
+   work_dir = tempfile.mkdtemp()
+   os.makedirs(os.path.join(work_dir, "codebase"))
+   open(os.path.join(work_dir, "codebase", "utils.py"), "w").close()
+   script = os.path.join(work_dir, "codebase", "fit.py")
+
+   def route(exit_code, output):
+      decision = classify_execution(exit_code, output, work_dir=work_dir)
+      return decision and decision.next_agent_suggestion
+
+   assert route(0, "chi2 = 1.02\n") == "control"
+   assert route(1, traceback_output([script], "ModuleNotFoundError: No module named 'healpy'")) == "installer"
+   assert route(1, traceback_output([script], "ModuleNotFoundError: No module named 'utils'")) == "engineer"
+   assert route(1, traceback_output([script, "/env/lib/python3.11/site-packages/camb/results.py"], "ValueError: bad lmax")) == "camb_context"
+   assert route(1, traceback_output([script], "classy.CosmoSevereError: Error in Class")) == "classy_context"
+   assert route(1, traceback_output([script, "/env/lib/site-packages/numpy/core/m.py"], "TypeError: bad operand")) == "engineer"
+   assert route(124, "\nTimeout") == "engineer"
+   # left to the llm
+   assert route(1, traceback_output([script, "/env/lib/site-packages/cobaya/run.py"], "LoggedError: bad prior")) is None
+   assert route(1, "Segmentation fault\n") is None
+   assert route(0, "caught:\n" + traceback_output([script], "ValueError: x")) is None
+
+   decision = classify_execution(1, traceback_output([script], "KeyError: 'h'"))
+   assert decision.fix_suggestion == f"Fix the error KeyError: 'h' (File \"{script}\", line 10)."
+
+
+def test_parse_execution_message():
+
+   assert parse_execution_message("Execution results:\n\nExecution output: ok") == (0, "\n\nExecution output: ok")
+   assert parse_execution_message("execution results:\nExecution output: \nstart\n\nTimeout")[0] == 124
+   assert parse_execution_message("exitcode: 1 (execution failed)\nCode output: boom")[0] == 1
+   assert parse_execution_message("Step 2: fit the spectrum.") == (None, None)
+
+
+def test_router_reply():
+
+   class Roster:
+      def find_agent_object(self, name):
+         return object() if name in ("control", "engineer") else None
+
+   class Formatter:
+      work_dir = tempfile.mkdtemp()
+
+   router = ExecutionRouter(Formatter(), Roster())
+   final, reply = router.reply(None, [{"content": "Execution results:\n\nExecution output: done"}])
+   assert final and reply["tool_calls"][0]["function"]["name"] == "post_execution_transfer"
+   assert json.loads(reply["tool_calls"][0]["function"]["arguments"]) == {"execution_status": "success", "next_agent_suggestion": "control"}
+
+   # the installer is not in the roster
+   output = "execution results:\nExecution output: " + traceback_output(["/w/a.py"], "ModuleNotFoundError: No module named 'emcee'")
+   assert router.reply(None, [{"content": output}]) == (False, None)
+   assert router.counts == {"rule: success": 1, "llm": 1}
+   assert router.summary() == "1/2 executions routed by rules (rule: success: 1, llm: 1)"
+
+
+if __name__ == "__main__":
+   test_classify_execution()
+   test_parse_execution_message()
+   test_router_reply()
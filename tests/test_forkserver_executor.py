@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+from autogen.coding import CodeBlock
+
+from cmbagent.execution import ForkServerCodeExecutor
+
+
+def test_forkserver_executor():
+
+   work_dir = tempfile.mkdtemp()
+   executor = ForkServerCodeExecutor(work_dir=work_dir, timeout=5, execution_policies={"python": True}, preload=["numpy"])
+
+   result = executor.execute_code_blocks([CodeBlock(language="python", code="# filename: codebase/a.py\nimport numpy as np\nprint(np.arange(3).sum())")])
+   assert result.exit_code == 0 and "3" in result.output
+   assert result.code_file == os.path.join(work_dir, "codebase", "a.py")
+
+   # each execution is a fresh process
+   result = executor.execute_code_blocks([CodeBlock(language="python", code="print(np)")])
+   assert result.exit_code == 1 and "NameError" in result.output
+
+   result = executor.execute_code_blocks([CodeBlock(language="python", code="import time\ntime.sleep(60)")])
+   assert result.exit_code == 124 and "Timeout" in result.output
+
+   executor.execution_policies["python"] = False
+   result = executor.execute_code_blocks([CodeBlock(language="python", code="print(1)")])
+   assert result.exit_code == 0 and result.output.startswith("Content saved to")
+
+
+def test_forkserver_executor_pool():
+
+   work_dir = tempfile.mkdtemp()
+   executor = ForkServerCodeExecutor(work_dir=work_dir, timeout=30, execution_policies={"python": True}, preload=["numpy"])
+
+   # the script may start its own processes
+   code = "import multiprocessing\nwith multiprocessing.Pool(2) as pool:\n    print(sum(pool.map(abs, [-1, -2, -3])))"
+   result = executor.execute_code_blocks([CodeBlock(language="python", code=code)])
+   assert result.exit_code == 0 and "6" in result.output, result.output
+
+
+if __name__ == "__main__":
+   test_forkserver_executor()
+   test_forkserver_executor_pool()
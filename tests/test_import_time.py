@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+
+# cold `import cmbagent` budget in seconds, override with CMBAGENT_IMPORT_TIME_BUDGET
+IMPORT_TIME_BUDGET = float(os.environ.get("CMBAGENT_IMPORT_TIME_BUDGET", "0.5"))
+
+# these should only be imported when a workflow is first used
+HEAVY_MODULES = ["openai", "pandas", "matplotlib", "cobaya", "IPython", "mistralai", "google.genai", "autogen"]
+
+
+def cold_import(n_runs=3):
+   """Best wall time of `import cmbagent` in a fresh interpreter, and the heavy modules it loaded."""
+   code = (
+      "import sys, time\n"
+      "t = time.perf_counter()\n"
+      "import cmbagent\n"
+      "t = time.perf_counter() - t\n"
+      f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+      "print(t, ','.join(heavy))\n"
+   )
+   timings = []
+   for _ in range(n_runs):
+      out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+      t, _, heavy = out.strip().partition(" ")
+      timings.append(float(t))
+   return min(timings), [m for m in heavy.split(",") if m]
+
+
+def test_import_time():
+
+   import_time, heavy = cold_import()
+
+   print(f"import cmbagent: {import_time:.3f} s (budget {IMPORT_TIME_BUDGET:.3f} s)")
+
+   assert heavy == [], f"import cmbagent pulled in {heavy}"
+   assert import_time < IMPORT_TIME_BUDGET
+
+
+if __name__ == "__main__":
+   test_import_time()
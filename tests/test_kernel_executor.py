@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip("jupyter_client")
+pytest.importorskip("ipykernel")
+
+from autogen.coding import CodeBlock
+
+from cmbagent.execution import KernelCodeExecutor
+
+
+def test_warm_kernel():
+
+   work_dir = tempfile.mkdtemp()
+   executor = KernelCodeExecutor(work_dir=work_dir, timeout=10)
+   try:
+      result = executor.execute_code_blocks([CodeBlock(language="python", code="# filename: codebase/a.py\nx = 41\nprint(x + 1)")])
+      assert result.exit_code == 0 and "42" in result.output
+      assert os.path.exists(os.path.join(work_dir, "codebase", "a.py"))
+
+      # the variables of the previous attempt are still there
+      result = executor.execute_code_blocks([CodeBlock(language="python", code="print(x)")])
+      assert result.exit_code == 0 and "41" in result.output
+
+      result = executor.execute_code_blocks([CodeBlock(language="python", code="raise ValueError('boom')")])
+      assert result.exit_code == 1 and "ValueError: boom" in result.output
+
+      result = executor.execute_code_blocks([CodeBlock(language="python", code="import time\ntime.sleep(60)")])
+      assert result.exit_code == 124
+   finally:
+      executor.stop()
+
+
+if __name__ == "__main__":
+   test_warm_kernel()
@@ -0,0 +1,102 @@
+from pathlib import Path
+import os
+import tempfile
+import time
+
+from cmbagent.llm_cache import LLMResponseCache, CacheCounter, cached_create
+from cmbagent.standin import StandinServer, StandinHandler
+
+STUB_MODEL = "gpt-4.1-mini"
+
+
+def request(i, temperature=1e-5):
+   return {"model": "gpt-4.1-mini", "messages": [{"role": "user", "content": f"question {i}"}],
+           "temperature": temperature, "top_p": 0.05}
+
+
+def test_llm_cache():
+
+   path = Path(tempfile.mkdtemp()) / "llm_cache.sqlite"
+   cache = LLMResponseCache(path, max_size_bytes=10**6)
+
+   assert cache.get(request(0)) is None
+   cache.set(request(0), {"content": "answer 0"})
+   assert cache.get(request(0)) == {"content": "answer 0"}
+   # sampling parameters are part of the key
+   assert cache.get(request(0, temperature=0.7)) is None
+
+   # the cache survives the process, as when resuming a crashed run
+   reopened = LLMResponseCache(path)
+   calls = []
+   response = cached_create(reopened, lambda **r: calls.append(r) or {"content": "new"}, **request(0))
+   assert response == {"content": "answer 0"} and calls == []
+
+   counter = CacheCounter(reopened)
+   counter.get(request(0))
+   counter.get(request(1))
+   assert (counter.hits, counter.misses) == (1, 1)
+
+
+def test_llm_cache_eviction():
+
+   cache = LLMResponseCache(Path(tempfile.mkdtemp()) / "llm_cache.sqlite", max_size_bytes=50_000)
+   for i in range(10):
+      cache.set(request(i), "x" * 10_000)
+      time.sleep(0.01)
+   # keep 0 recently used
+   cache.get(request(0))
+
+   assert cache.evict() > 0
+   assert cache.stats()["size_bytes"] <= 50_000
+   assert cache.get(request(0)) is not None
+   assert cache.get(request(1)) is None
+   assert cache.get(request(9)) is not None
+
+   cache.max_age_seconds = 0
+   cache.evict()
+   assert cache.stats()["entries"] == 0
+
+
+class CountingHandler(StandinHandler):
+
+   n_requests = 0
+
+   def do_POST(self):
+      CountingHandler.n_requests += 1
+      super().do_POST()
+
+
+def test_llm_cache_solve_replay():
+
+   import cmbagent
+   from cmbagent.llm_cache import get_llm_cache
+   os.environ.setdefault("OPENAI_API_KEY", "stub")
+   path = str(Path(tempfile.mkdtemp()) / "llm_cache.sqlite")
+   os.environ["CMBAGENT_LLM_CACHE"] = path
+   work_dir = tempfile.mkdtemp()
+
+   def solve():
+      cmbagent.one_shot("Summarize the CMB.", max_rounds=6, agent="researcher",
+                        engineer_model=STUB_MODEL, researcher_model=STUB_MODEL, plot_judge_model=STUB_MODEL,
+                        camb_context_model=STUB_MODEL, default_llm_model=STUB_MODEL,
+                        default_formatter_model=STUB_MODEL, work_dir=work_dir)
+
+   try:
+      with StandinServer(None, mode="stub") as server:
+         server.RequestHandlerClass = CountingHandler
+         solve()
+         first_requests = CountingHandler.n_requests
+         CountingHandler.n_requests = 0
+         solve()
+   finally:
+      del os.environ["CMBAGENT_LLM_CACHE"]
+
+   assert first_requests > 0
+   # the identical second solve is replayed from the cache
+   assert CountingHandler.n_requests == 0
+   assert get_llm_cache(path).hits >= first_requests
+
+if __name__ == "__main__":
+   test_llm_cache()
+   test_llm_cache_eviction()
+   test_llm_cache_solve_replay()
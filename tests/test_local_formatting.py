@@ -0,0 +1,75 @@
+from cmbagent.agents.planner_response_formatter.planner_response_formatter import PlannerResponse
+from cmbagent.agents.engineer_response_formatter.engineer_response_formatter import EngineerResponseFormatterAgent
+from cmbagent.local_formatting import parse_engineer_response, parse_planner_response, parse_reviewer_response
+
+
+engineer_reply = '''**Code Explanation:**
+
+Computes the sum of the first 1000 natural numbers and plots their histogram.
+
+**Modifications:**
+
+Saved the plot in the data folder.
+
+**Python Code:**
+
+```python
+# filename: codebase/sum_numbers.py
+import numpy as np
+print(np.arange(1, 1001).sum())
+```
+'''
+
+planner_reply = '''**Plan:**
+   - Step 1:
+         * sub-task: Compute the power spectrum
+           for the fiducial cosmology.
+         * agent: engineer
+         * bullet points:
+            - Use camb.
+            - Save the spectra.
+   - Step 2:
+         * sub-task: Discuss the results
+         * agent: researcher
+         * bullet points:
+            - Compare to Planck.
+         * depends on: Step 1
+'''
+
+
+def test_parse_engineer_response():
+
+   fields = parse_engineer_response(engineer_reply)
+   assert fields["filename"] == "sum_numbers.py" and fields["relative_path"] == "codebase"
+   assert fields["modification_summary"] == "Saved the plot in the data folder."
+   formatted = EngineerResponseFormatterAgent.EngineerResponse.model_validate(fields).format()
+   assert "# filename: codebase/sum_numbers.py\nimport numpy as np" in formatted
+
+   # left to the formatter llm
+   assert parse_engineer_response(engineer_reply.replace("# filename: codebase/sum_numbers.py\n", "")) is None
+   assert parse_engineer_response(engineer_reply.replace("import numpy as np", "import numpy as np\nx = '\\s'")) is None
+   assert parse_engineer_response(engineer_reply.replace("print(", "print((")) is None
+   assert parse_engineer_response(engineer_reply + "\n```python\nprint(2)\n```\n") is None
+
+
+def test_parse_planner_response():
+
+   plan = PlannerResponse.model_validate(parse_planner_response(planner_reply))
+   assert [step.sub_task_agent for step in plan.sub_tasks] == ["engineer", "researcher"]
+   assert plan.sub_tasks[0].sub_task == "Compute the power spectrum for the fiducial cosmology."
+   assert plan.sub_tasks[0].bullet_points == ["Use camb.", "Save the spectra."]
+   assert plan.sub_tasks[0].depends_on is None and plan.sub_tasks[1].depends_on == [1]
+
+   assert parse_planner_response("Here is my plan: first compute, then discuss.") is None
+
+
+def test_parse_reviewer_response():
+
+   reply = "**Recommendations:**\n\n- Merge steps 1 and 2,\n  they use the same code.\n- Add a convergence check.\n"
+   assert parse_reviewer_response(reply) == {"recommendations": ["Merge steps 1 and 2, they use the same code.", "Add a convergence check."]}
+
+
+if __name__ == "__main__":
+   test_parse_engineer_response()
+   test_parse_planner_response()
+   test_parse_reviewer_response()
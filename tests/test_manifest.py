@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+
+from cmbagent import manifest
+from cmbagent.utils import path_to_agents
+
+
+def with_agents_tree(test):
+   """Run test on a copy of the agents tree, with the manifest in a temp cache dir."""
+   def run():
+      agents_dir = os.path.join(tempfile.mkdtemp(), "agents")
+      shutil.copytree(path_to_agents, agents_dir, ignore=shutil.ignore_patterns("__pycache__"))
+      cache_dir = os.environ.get("CMBAGENT_CACHE_DIR")
+      os.environ["CMBAGENT_CACHE_DIR"] = tempfile.mkdtemp()
+      manifest.path_to_agents = agents_dir
+      manifest.invalidate_agent_manifest()
+      try:
+         test(agents_dir)
+      finally:
+         manifest.path_to_agents = path_to_agents
+         manifest.invalidate_agent_manifest()
+         if cache_dir is None:
+            del os.environ["CMBAGENT_CACHE_DIR"]
+         else:
+            os.environ["CMBAGENT_CACHE_DIR"] = cache_dir
+   run.__name__ = test.__name__
+   return run
+
+
+def touch(path):
+   stat = os.stat(path)
+   os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@with_agents_tree
+def test_manifest_path(agents_dir):
+
+   # named after the agents tree and the version: installs sharing the cache dir keep their own
+   path = manifest.get_manifest_path()
+   assert os.path.dirname(path) == os.environ["CMBAGENT_CACHE_DIR"]
+   assert os.path.basename(path).startswith("agent_manifest-") and path.endswith(".json")
+   manifest.path_to_agents = path_to_agents
+   assert manifest.get_manifest_path() != path
+   manifest.path_to_agents = agents_dir
+   version = manifest.__version__
+   manifest.__version__ = version + ".dev"
+   try:
+      assert manifest.get_manifest_path() != path
+   finally:
+      manifest.__version__ = version
+   assert manifest.get_manifest_path() == path
+
+
+@with_agents_tree
+def test_manifest_invalidation(agents_dir):
+
+   built = manifest.load_agent_manifest()
+   path = manifest.get_manifest_path()
+   with open(path) as f:
+      assert json.load(f) == built
+   engineer = os.path.join(agents_dir, "engineer", "engineer")
+   assert manifest.load_agent_info(engineer)["name"] == "engineer"
+
+   # read back from disk while nothing changed
+   manifest.invalidate_agent_manifest()
+   mtime = os.stat(path).st_mtime_ns
+   assert manifest.load_agent_manifest() == built and os.stat(path).st_mtime_ns == mtime
+
+   # a yaml, then an agent module, changed: rebuilt
+   for changed in (engineer + ".yaml", engineer + ".py"):
+      touch(changed)
+      manifest.invalidate_agent_manifest()
+      with open(path) as f:
+         assert not manifest.is_manifest_valid(json.load(f))
+      rebuilt = manifest.load_agent_manifest()
+      assert rebuilt["agents"]["engineer/engineer"]["mtimes"][os.path.basename(changed)] == os.stat(changed).st_mtime_ns
+      with open(path) as f:
+         assert manifest.is_manifest_valid(json.load(f))
+
+
+@with_agents_tree
+def test_manifest_check(agents_dir):
+
+   from cmbagent.cli import run_manifest
+
+   def check():
+      try:
+         run_manifest(check=True)
+      except SystemExit as e:
+         return e.code
+      return 0
+
+   assert check() == 1  # no manifest yet
+   run_manifest(check=False)
+   assert check() == 0
+   touch(os.path.join(agents_dir, "engineer", "engineer.yaml"))
+   assert check() == 1  # stale
+
+
+if __name__ == "__main__":
+   test_manifest_path()
+   test_manifest_invalidation()
+   test_manifest_check()
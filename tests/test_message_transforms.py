@@ -0,0 +1,50 @@
+from cmbagent.message_transforms import ChatHistoryCompactor, error_signature
+
+
+def attempt(version, error=None):
+   code = "# filename: codebase/fit.py\nimport numpy as np\n" + "\n".join(f"x{i} = np.arange({i})" for i in range(30)) + f"\nresult = fit(x, order={version})\n"
+   engineer = {"role": "user", "name": "engineer", "content": f"Fitting the spectrum, version {version}.\n\n```python\n{code}```"}
+   formatter = {"role": "user", "name": "engineer_response_formatter",
+                "content": f"**Code Explanation:**\n\nFitting the spectrum, version {version}.\n\n**Python Code:**\n\n```python\n{code}```"}
+   if error:
+      output = ("exitcode: 1 (execution failed)\nCode output: Traceback (most recent call last):\n"
+                + "\n".join(f'  File "/lib/numpy/core/m{i}.py", line {i}, in f' for i in range(20))
+                + f'\n  File "codebase/fit.py", line 32, in <module>\n{error}\n')
+   else:
+      output = "exitcode: 0 (execution succeeded)\nCode output: chi2 = 1.02\n"
+   return [engineer, formatter, {"role": "user", "name": "engineer_nest", "content": output}]
+
+
+def test_chat_history_compaction():
+
+   messages = [{"role": "user", "name": "control", "content": "Step 2: fit the spectrum."}]
+   messages += attempt(1, "ValueError: order must be positive") + attempt(2, "NameError: name 'fit' is not defined") + attempt(3)
+
+   compactor = ChatHistoryCompactor(keep_last=3)
+   compacted = compactor.apply_transform(messages)
+
+   # the last attempt is untouched, the formatter restatements before it are dropped
+   assert compacted[-3:] == messages[-3:]
+   assert [message["name"] for message in compacted[:-3]] == ["control", "engineer", "engineer_nest", "engineer", "engineer_nest"]
+   # failed code becomes a diff to the next version, failed outputs their error signature
+   assert "diff to the next version" in compacted[1]["content"] and "-result = fit(x, order=1)" in compacted[1]["content"]
+   assert compacted[2]["content"].endswith('File "codebase/fit.py", line 32\nValueError: order must be positive')
+
+   before, after = compactor.turns[-1]
+   assert after < before / 2
+   log, had_effect = compactor.get_logs(messages, compacted)
+   assert had_effect and f"{before - after} tokens saved" in log
+
+   # nothing to compact in a short history
+   assert compactor.apply_transform(messages[:2]) == messages[:2]
+
+
+def test_error_signature():
+
+   assert error_signature("exitcode: 1 (execution failed)\nCode output: boom") == \
+      "[earlier failed execution, output collapsed]\nexitcode: 1 (execution failed)\nCode output: boom"
+
+
+if __name__ == "__main__":
+   test_chat_history_compaction()
+   test_error_signature()
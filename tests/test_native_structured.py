@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+from cmbagent.hand_offs import get_hand_off_graph, get_reachable_agents
+from cmbagent.native_structured import get_native_structured_agents, get_native_response_format, select_native_structured
+from cmbagent.standin import StandinServer
+
+STUB_MODEL = "gpt-4.1-mini"
+
+
+def test_get_native_structured_agents():
+
+   agent_llm_configs = select_native_structured({
+      'engineer': {'model': 'gpt-4.1', 'api_type': 'openai'},
+      'researcher': {'model': 'claude-sonnet-4-20250514', 'api_type': 'anthropic'},
+      'planner': {'model': 'gemini-2.5-flash', 'api_type': 'google'},
+      'plot_judge': {'model': 'gpt-4o', 'api_type': 'openai'},
+   }, ['engineer', 'researcher', 'plot_judge', 'summarizer'])
+
+   # anthropic has no structured output, the plot_judge has no formatter, the summarizer has no config
+   assert get_native_structured_agents(agent_llm_configs) == {'engineer'}
+   # the planner config is completed by the default one
+   agent_llm_configs['planner']['native_structured_output'] = True
+   del agent_llm_configs['planner']['api_type']
+   assert get_native_structured_agents(agent_llm_configs, {'api_type': 'ollama'}) == {'engineer', 'planner'}
+
+   assert get_native_response_format('planner').__name__ == 'PlannerResponse'
+
+
+def test_hand_off_graph_skips_formatter():
+
+   graph = get_hand_off_graph("planning_and_control", native_structured_agents={'planner'})
+   assert 'planner_response_formatter' not in graph
+   assert 'plan_recorder' in graph['planner'] and 'planner_response_formatter' not in graph['planner']
+
+   reachable = get_reachable_agents("plan_setter", "planning_and_control", native_structured_agents={'planner'})
+   assert 'planner' in reachable and 'plan_recorder' in reachable
+   assert 'planner_response_formatter' not in reachable
+
+
+def test_one_shot_native_engineer():
+
+   import cmbagent
+   os.environ.setdefault("OPENAI_API_KEY", "stub")
+   with StandinServer(None, mode="stub"):
+      results = cmbagent.one_shot("Compute 1+1.",
+                                  max_rounds=12,
+                                  agent="engineer",
+                                  engineer_model=STUB_MODEL,
+                                  researcher_model=STUB_MODEL,
+                                  plot_judge_model=STUB_MODEL,
+                                  camb_context_model=STUB_MODEL,
+                                  default_llm_model=STUB_MODEL,
+                                  default_formatter_model=STUB_MODEL,
+                                  work_dir=tempfile.mkdtemp(),
+                                  native_structured_agents=["engineer"])
+
+   names = [message.get("name") for message in results["chat_history"]]
+   assert "engineer_response_formatter" not in names
+   # the structured reply of the engineer went straight to the executor
+   execution = results["chat_history"][names.index("engineer_nest")]["content"]
+   assert execution.startswith("Execution results:") and "stand-in" in execution
+
+
+if __name__ == "__main__":
+   test_get_native_structured_agents()
+   test_hand_off_graph_skips_formatter()
+   test_one_shot_native_engineer()
@@ -0,0 +1,175 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from cmbagent.context import ContextStore
+from cmbagent.execution import ArtifactRecordingCodeExecutor
+from cmbagent.plan_dag import get_step_dependencies, is_sequential, critical_path, run_plan_steps
+from cmbagent.plan_dag import make_branch_work_dir, merge_branch_work_dir, find_branch_conflicts, branch_conflicts_filename
+
+
+STEP_TIME = 0.2
+
+
+def test_step_dependencies():
+
+   # plans without depends_on run one step after the other
+   sequential = get_step_dependencies([{"sub_task": "a"}, {"sub_task": "b"}, {"sub_task": "c"}])
+   assert sequential == {1: [], 2: [1], 3: [2]}
+   assert is_sequential(sequential)
+
+   # forward and self references are dropped
+   dependencies = get_step_dependencies([{"depends_on": []}, {"depends_on": []}, {"depends_on": [1, 2, 3, 5]}, {"depends_on": [1]}])
+   assert dependencies == {1: [], 2: [], 3: [1, 2], 4: [1]}
+   assert not is_sequential(dependencies)
+   assert critical_path(dependencies) == ([1, 3], 2)
+
+
+def test_run_plan_steps():
+
+   # 1 and 2 are independent, 3 needs both, 4 only needs 1
+   dependencies = {1: [], 2: [], 3: [1, 2], 4: [1]}
+   started, finished = {}, {}
+   lock = threading.Lock()
+
+   def run_step(step):
+      with lock:
+         started[step] = time.perf_counter()
+         assert all(j in finished for j in dependencies[step])
+      time.sleep(STEP_TIME)
+      return step * 10
+
+   def on_step_done(step, result):
+      assert result == step * 10
+      finished[step] = time.perf_counter()
+
+   t = time.perf_counter()
+   completed = run_plan_steps(dependencies, run_step, on_step_done, max_parallel_steps=4)
+   elapsed = time.perf_counter() - t
+
+   assert sorted(completed) == [1, 2, 3, 4]
+   # wall time is that of the longest chain (2 steps), not of the 4 steps
+   assert elapsed < 3 * STEP_TIME
+   assert started[3] >= max(finished[1], finished[2])
+
+   # with a single slot, the steps run in order in the calling thread
+   order = []
+   run_plan_steps(dependencies, lambda step: order.append((step, threading.current_thread())), max_parallel_steps=1)
+   assert [step for step, _ in order] == [1, 2, 3, 4]
+   assert all(thread is threading.current_thread() for _, thread in order)
+
+   # restart: done steps are skipped, a False from on_step_done stops new steps (3 is never started)
+   assert sorted(run_plan_steps(dependencies, lambda step: step, lambda step, result: False, max_parallel_steps=4, done=[1])) == [2, 4]
+
+
+def test_branch_merge():
+
+   store = ContextStore({"a": 0, "b": 0, "summary": ""})
+
+   base_1, fork_1 = store.snapshot(), store.fork()
+   base_2, fork_2 = store.snapshot(), store.fork()
+   fork_1["a"] = 1
+   fork_2["b"] = 2
+
+   store.commit(fork_1, base=base_1)
+   delta = store.commit(fork_2, base=base_2)
+
+   # the second branch does not undo the first one
+   assert delta == {"b": 2}
+   assert store["a"] == 1 and store["b"] == 2
+
+
+def test_fork_while_committing():
+
+   store = ContextStore({f"key_{i}": [i] for i in range(200)})
+   errors = []
+
+   def fork_steps():
+      try:
+         for _ in range(200):
+            with store.lock:
+               base, fork = store.snapshot(), store.fork()
+            assert base.keys() == fork.keys()
+      except Exception as e:
+         errors.append(e)
+
+   threads = [threading.Thread(target=fork_steps) for _ in range(4)]
+   for thread in threads:
+      thread.start()
+   # the finished steps commit new keys from the main thread meanwhile
+   for i in range(2000):
+      store.commit({f"new_{i}": [i]}, base={})
+   for thread in threads:
+      thread.join()
+   assert errors == []
+
+
+def test_branch_work_dirs():
+
+   control_dir = tempfile.mkdtemp()
+   os.makedirs(os.path.join(control_dir, "data"))
+   with open(os.path.join(control_dir, "data", "step_1.txt"), "w") as f:
+      f.write("1")
+
+   branch_2 = make_branch_work_dir(os.path.join(control_dir, "branches", "step_2"), control_dir, ["data/", "codebase/"])
+   branch_3 = make_branch_work_dir(os.path.join(control_dir, "branches", "step_3"), control_dir, ["data/", "codebase/"])
+   # the files of the steps they depend on
+   with open(os.path.join(branch_2, "data", "step_1.txt")) as f:
+      assert f.read() == "1"
+
+   executor = ArtifactRecordingCodeExecutor(work_dir=branch_2)
+   # step 1 finished before step 2 started
+   time.sleep(0.1)
+   start_ns = time.time_ns()
+   for branch, name in ((branch_2, "step_2.txt"), (branch_3, "step_3.txt")):
+      with open(os.path.join(branch, "data", name), "w") as f:
+         f.write(name)
+   # step 3 runs beside step 2: its file is not recorded by the executor of step 2
+   assert [os.path.basename(record["path"]) for record in executor.record_artifacts(start_ns)] == ["step_2.txt"]
+
+   assert merge_branch_work_dir(branch_2, control_dir, ["data/", "codebase/"]) == [os.path.join(control_dir, "data/", "step_2.txt")]
+   assert os.path.islink(os.path.join(branch_2, "data", "step_2.txt"))
+   branch_4 = make_branch_work_dir(os.path.join(control_dir, "branches", "step_4"), control_dir, ["data/", "codebase/"])
+   assert sorted(os.listdir(os.path.join(branch_4, "data"))) == ["step_1.txt", "step_2.txt"]
+
+
+def test_branch_conflicts():
+
+   control_dir = tempfile.mkdtemp()
+   os.makedirs(os.path.join(control_dir, "data"))
+   with open(os.path.join(control_dir, "data", "x.csv"), "w") as f:
+      f.write("step 1")
+   with open(os.path.join(control_dir, "data", "y.csv"), "w") as f:
+      f.write("step 1")
+   branches = [make_branch_work_dir(os.path.join(control_dir, "branches", f"step_{step}"), control_dir, ["data/"])
+               for step in (2, 3)]
+
+   # two steps run side by side rewrite the same input in place, through their links
+   def step(branch):
+      with open(os.path.join(branch, "data", "x.csv"), "w") as f:
+         f.write(os.path.basename(branch))
+
+   threads = [threading.Thread(target=step, args=(branch,)) for branch in branches]
+   for thread in threads:
+      thread.start()
+   for thread in threads:
+      thread.join()
+
+   x = os.path.join(control_dir, "data", "x.csv")
+   for branch in branches:
+      assert find_branch_conflicts(branch) == [os.path.realpath(x)]
+      assert merge_branch_work_dir(branch, control_dir, ["data/"]) == []
+   with open(os.path.join(control_dir, branch_conflicts_filename)) as f:
+      conflicts = [json.loads(line) for line in f]
+   assert [(c["branch"], c["path"]) for c in conflicts] == [(branch, os.path.realpath(x)) for branch in branches]
+
+
+if __name__ == "__main__":
+   test_step_dependencies()
+   test_run_plan_steps()
+   test_branch_merge()
+   test_fork_while_committing()
+   test_branch_work_dirs()
+   test_branch_conflicts()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+from cmbagent.standin import StandinServer
+
+STUB_MODEL = "gpt-4.1-mini"
+
+
+def transit_hooks(cmbagent_instance):
+   from cmbagent.cmbagent import is_transit_hook
+   return {agent.name: sum(map(is_transit_hook, agent.agent.hook_lists["process_all_messages_before_reply"]))
+           for agent in cmbagent_instance.agents}
+
+
+def test_roster_reset():
+
+   from cmbagent.cmbagent import CMBAgent
+   from cmbagent.utils import get_api_keys_from_env, get_model_config
+   os.environ.setdefault("OPENAI_API_KEY", "stub")
+   api_keys = get_api_keys_from_env()
+   config = get_model_config(STUB_MODEL, api_keys)
+
+   with StandinServer(None, mode="stub"):
+      cmbagent = CMBAgent(initial_agent="researcher", mode="one_shot", work_dir=tempfile.mkdtemp(),
+                          agent_llm_configs={"researcher": config, "engineer": config},
+                          api_keys=api_keys, default_llm_model=STUB_MODEL, default_formatter_model=STUB_MODEL)
+
+      def solve():
+         cmbagent.solve("Summarize the CMB.", max_rounds=6, initial_agent="researcher", mode="one_shot",
+                        shared_context={"max_n_attempts": 1})
+
+      solve()
+      first = transit_hooks(cmbagent)
+      assert first and all(n == 1 for n in first.values())
+
+      # a reused roster does not pile up the hooks of the previous chats
+      for _ in range(2):
+         cmbagent.reset(work_dir=tempfile.mkdtemp())
+         solve()
+      assert transit_hooks(cmbagent) == first
+
+
+if __name__ == "__main__":
+   test_roster_reset()
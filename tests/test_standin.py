@@ -0,0 +1,75 @@
+import json
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cmbagent.standin import StandinServer, route_to_standin
+
+
+class Upstream(BaseHTTPRequestHandler):
+
+   n_requests = 0
+
+   def log_message(self, *args):
+      pass
+
+   def do_POST(self):
+      request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+      Upstream.n_requests += 1
+      body = json.dumps({"id": f"chatcmpl-{Upstream.n_requests}", "object": "chat.completion", "model": request["model"],
+                         "choices": [{"index": 0, "finish_reason": "stop",
+                                      "message": {"role": "assistant", "content": f"answer {Upstream.n_requests}"}}],
+                         "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}).encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+
+def chat(url, content, model="gpt-4.1-mini"):
+   request = urllib.request.Request(f"{url}/chat/completions", method="POST", headers={"Content-Type": "application/json"},
+                                    data=json.dumps({"model": model, "messages": [{"role": "user", "content": content}]}).encode())
+   with urllib.request.urlopen(request) as response:
+      return json.loads(response.read())["choices"][0]["message"]["content"]
+
+
+def test_record_replay():
+
+   fixtures = tempfile.mkdtemp()
+   upstream = ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+   threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+   with StandinServer(fixtures, mode="record", upstream=f"http://127.0.0.1:{upstream.server_address[1]}") as recorder:
+      recorded = [chat(recorder.url, "plan"), chat(recorder.url, "code"), chat(recorder.url, "plan")]
+   upstream.shutdown()
+   assert recorded == ["answer 1", "answer 2", "answer 3"]
+
+   # replay with no upstream: identical requests get the recorded answers, in order
+   with StandinServer(fixtures, latency=0.05, match_sequence=False) as replayer:
+      t = time.perf_counter()
+      assert [chat(replayer.url, "plan"), chat(replayer.url, "code"), chat(replayer.url, "plan")] == recorded
+      assert time.perf_counter() - t >= 0.15
+      try:
+         chat(replayer.url, "something else")
+         assert False, "strict replay answered an unrecorded request"
+      except urllib.error.HTTPError as e:
+         assert e.code == 404
+
+   assert Upstream.n_requests == 3
+
+
+def test_route_to_standin():
+
+   config = {"model": "llama3.2", "api_key": "localhost", "api_type": "ollama"}
+   routed = route_to_standin(config, "http://127.0.0.1:8765/v1")
+   assert routed == {"model": "llama3.2", "api_key": "standin", "api_type": "openai", "base_url": "http://127.0.0.1:8765/v1"}
+   assert config["api_type"] == "ollama"
+
+
+if __name__ == "__main__":
+   test_record_replay()
+   test_route_to_standin()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+from autogen.coding.base import CodeBlock
+from cmbagent.execution import ArtifactRecordingCodeExecutor
+from cmbagent.execution.static_check import StaticCheck, fix_indentation, fix_data_paths
+from cmbagent.execution_routing import classify_execution, parse_execution_message
+
+
+def test_fixes():
+
+   code = "import numpy as np\nfor i in range(3):\n    x = i\n     print(x)\n"
+   fixed, lines = fix_indentation(code)
+   assert lines == [4] and "\n    print(x)" in fixed
+   assert fix_indentation("x = (1,\n")[1] == []
+
+   fixed, fixes = fix_data_paths('plt.savefig("../data/plot.png")\ndata_dir = "./data"\n')
+   assert fixed == 'plt.savefig("data/plot.png")\ndata_dir = "data/"\n' and len(fixes) == 2
+
+
+def test_check_code():
+
+   work_dir = tempfile.mkdtemp()
+   os.makedirs(os.path.join(work_dir, "codebase"))
+   open(os.path.join(work_dir, "codebase", "utils.py"), "w").close()
+   check = StaticCheck()
+
+   code = ("# filename: codebase/fit.py\nimport os\nfrom utils import f\ntry:\n    import not_a_module_b\nexcept ImportError:\n    pass\n"
+           "def g(a, *args):\n    return [a + y for y in args], os.sep\nprint(g(1, 2), f)\n")
+   assert check.check_code(code, work_dir, "codebase/fit.py")[1] == []
+
+   _, diagnostics = check.check_code("import not_a_module_a\nprint(np.pi)\n", work_dir)
+   assert diagnostics == ["line 2: NameError: name 'np' is not defined",
+                          "line 1: ModuleNotFoundError: No module named 'not_a_module_a' in the execution environment"]
+   # a warm kernel keeps the names of the previous executions
+   assert check.check_code("print(np.pi)\n", work_dir, namespace_persists=True)[1] == []
+   assert check.check_code("print((1)\n", work_dir)[1][0].startswith("line 1: SyntaxError")
+
+
+def test_executor_stops_code():
+
+   work_dir = tempfile.mkdtemp()
+   executor = ArtifactRecordingCodeExecutor(work_dir=work_dir, static_check=True)
+   result = executor.execute_code_blocks([CodeBlock(code="# filename: a.py\nopen('ran', 'w')\nprint(undefined_x)\n", language="python")])
+   assert result.exit_code == 1 and not os.path.exists(os.path.join(work_dir, "ran"))
+
+   # routed back to the engineer, as the executor message
+   exit_code, output = parse_execution_message("execution results:\nExecution output: " + result.output)
+   decision = classify_execution(exit_code, output)
+   assert decision.next_agent_suggestion == "engineer" and decision.reason == "static check"
+   assert "name 'undefined_x' is not defined" in decision.fix_suggestion
+
+
+if __name__ == "__main__":
+   test_fixes()
+   test_check_code()
+   test_executor_stops_code()
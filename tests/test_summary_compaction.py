@@ -0,0 +1,54 @@
+import tempfile
+from pathlib import Path
+
+from cmbagent.summary_compaction import StepSummaryCompactor, count_tokens, extractive_summary
+
+
+def step_summary(step):
+   filler = "\n".join(f"The engineer then looked at option {chr(97 + i % 26)} again and discussed it at length." for i in range(30))
+   return f"### Step {step}\n{filler}\nSaved the power spectrum to data/cl_step_{step}.npy, best fit H0 = 67.{step}"
+
+
+def test_compaction_budget():
+
+   summaries = {step: step_summary(step) for step in range(1, 11)}
+   calls = []
+
+   def summarize(text, max_tokens):
+      calls.append(text)
+      return extractive_summary(text, max_tokens)
+
+   cache_path = Path(tempfile.mkdtemp()) / "summary_cache.json"
+   compactor = StepSummaryCompactor(max_tokens=2000, keep_recent=2, summary_tokens=100, cache_path=cache_path, summarize=summarize)
+
+   for n_steps in range(1, 11):
+      joined = compactor.compact({step: summaries[step] for step in range(1, n_steps + 1)})
+      assert count_tokens(joined) <= 2000
+      # the last two steps are verbatim
+      assert summaries[n_steps] in joined
+      if n_steps > 1:
+         assert summaries[n_steps - 1] in joined
+      # the results of old steps survive the compression
+      assert "cl_step_1.npy" in joined
+
+   # each step is compressed once, whatever the number of later steps
+   n_calls = len(calls)
+   compactor.compact(summaries)
+   assert len(calls) == n_calls
+   # also after a restart
+   restarted = StepSummaryCompactor(max_tokens=2000, keep_recent=2, summary_tokens=100, cache_path=cache_path, summarize=summarize)
+   assert restarted.compact(summaries) == compactor.compact(summaries)
+   assert len(calls) == n_calls
+
+
+def test_small_budget():
+
+   summaries = {step: step_summary(step) for step in range(1, 5)}
+   joined = StepSummaryCompactor(max_tokens=300, keep_recent=2, summary_tokens=100).compact(summaries)
+   assert count_tokens(joined) <= 300
+   assert joined.startswith("### Step")
+
+
+if __name__ == "__main__":
+   test_compaction_budget()
+   test_small_budget()
@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from cmbagent.tracing import instrument_agent, span, trace_run, traced
+
+STUB_MODEL = "gpt-4.1-mini"
+
+
+class Agent:
+
+   def __init__(self, name):
+      self.name = name
+      self.client = SimpleNamespace(create=lambda **request: SimpleNamespace(
+         model=request["model"], usage=SimpleNamespace(prompt_tokens=10, completion_tokens=2)))
+
+   def generate_reply(self, messages=None, sender=None):
+      with span("pre-processing", "hook"):
+         pass
+      return self.client.create(model="gpt-4.1-mini", messages=messages)
+
+
+@traced()
+def record_status(current_status: str) -> str:
+   return current_status
+
+
+def test_trace_run():
+
+   work_dir = tempfile.mkdtemp()
+   engineer = instrument_agent(Agent("engineer"))
+   # not traced outside of a run
+   engineer.generate_reply([])
+   assert record_status("done") == "done"
+
+   with trace_run("one_shot", work_dir) as tracer:
+      engineer.generate_reply([], sender=SimpleNamespace(name="control"))
+      record_status("in progress")
+      thread = threading.Thread(target=lambda: record_status("unseen"))
+      thread.start()
+      thread.join()
+
+   assert [(s.name, s.category) for s in tracer.spans] == [
+      ("one_shot", "run"), ("engineer", "turn"), ("pre-processing", "hook"), ("llm engineer", "llm"), ("record_status", "function")]
+   run, turn, _, llm, function = tracer.spans
+   assert turn.parent is run and llm.parent is turn and function.parent is run
+   assert llm.attributes["model"] == "gpt-4.1-mini" and llm.attributes["prompt_tokens"] == 10
+   assert llm.attributes["queue_s"] >= 0 and llm.attributes["ttft_s"] == llm.attributes["latency_s"]
+
+   chrome, otlp = sorted(f"{work_dir}/traces/{name}" for name in os.listdir(f"{work_dir}/traces"))
+   events = json.load(open(chrome))["traceEvents"]
+   assert sum(event["ph"] == "X" for event in events) == 5
+   spans = json.load(open(otlp))["resourceSpans"][0]["scopeSpans"][0]["spans"]
+   assert {s["spanId"] for s in spans} >= {s["parentSpanId"] for s in spans if "parentSpanId" in s}
+
+
+def test_span_error():
+
+   with trace_run("step_1", tempfile.mkdtemp()) as tracer:
+      try:
+         with span("code execution", "code"):
+            raise RuntimeError("boom")
+      except RuntimeError:
+         pass
+   assert tracer.spans[1].error == "RuntimeError: boom"
+   assert tracer.otlp_trace()["resourceSpans"][0]["scopeSpans"][0]["spans"][1]["status"]["code"] == 2
+
+
+def test_trace_solve():
+
+   import cmbagent
+   from cmbagent.cost_ledger import ledger_filename, read_ledger
+   from cmbagent.standin import StandinServer
+   os.environ.setdefault("OPENAI_API_KEY", "stub")
+   work_dir = tempfile.mkdtemp()
+   os.environ["CMBAGENT_TRACE"] = "1"
+   try:
+      with StandinServer(None, mode="stub"):
+         cmbagent.one_shot("Plot a sine wave.", max_rounds=12, agent="engineer",
+                           engineer_model=STUB_MODEL, researcher_model=STUB_MODEL, plot_judge_model=STUB_MODEL,
+                           camb_context_model=STUB_MODEL, default_llm_model=STUB_MODEL,
+                           default_formatter_model=STUB_MODEL, work_dir=work_dir)
+   finally:
+      del os.environ["CMBAGENT_TRACE"]
+
+   # the agents with registered functions (control, the formatters) get a new client when they are
+   # added to the group chat: their requests are traced all the same
+   costed = {record["agent"] for record in read_ledger(os.path.join(work_dir, "cost", ledger_filename))}
+   traces_dir = os.path.join(work_dir, "traces")
+   traced_agents = set()
+   for name in os.listdir(traces_dir):
+      if name.endswith(".chrome.json"):
+         events = json.load(open(os.path.join(traces_dir, name)))["traceEvents"]
+         traced_agents.update(event["name"].removeprefix("llm ") for event in events if event.get("cat") == "llm")
+   assert "control" in costed
+   assert costed <= traced_agents
+
+
+if __name__ == "__main__":
+   test_trace_run()
+   test_span_error()
+   test_trace_solve()
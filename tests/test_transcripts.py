@@ -0,0 +1,55 @@
+import os
+import tempfile
+
+from cmbagent.transcripts import TranscriptWriter, iter_transcript, load_index, read_transcript
+
+
+def write_steps(chats_dir, compression, n_steps=3, n_messages=50):
+   writer = TranscriptWriter(chats_dir, compression=compression)
+   for step in range(1, n_steps + 1):
+      writer.begin(step)
+      for i in range(n_messages):
+         writer.append({"role": "user", "name": "engineer", "content": f"step {step} message {i} " + "x" * 200}, chat="main")
+         if i % 10 == 0:
+            writer.append({"role": "user", "name": "executor", "content": f"nested {step} {i}"}, chat="nested_1")
+      writer.end()
+   return writer
+
+
+def test_transcript_pages():
+
+   sizes = {}
+   for compression in [None, "gzip"]:
+      chats_dir = tempfile.mkdtemp()
+      writer = write_steps(chats_dir, compression)
+      sizes[compression] = os.path.getsize(writer.path)
+
+      index = load_index(chats_dir)
+      assert index["steps"]["2"]["messages"] == 55
+      page = read_transcript(chats_dir, step=2, start=10, limit=5)
+      assert [message["content"].split(" x")[0] for message in page] == [f"step 2 message {i}" for i in range(10, 15)]
+      assert len(read_transcript(chats_dir, step=3)) == 50
+      assert len(read_transcript(chats_dir, chat=None)) == 165
+      assert [message["content"] for message in iter_transcript(chats_dir, step=1, chat="nested_1")][:2] == ["nested 1 0", "nested 1 10"]
+
+   assert sizes["gzip"] < sizes[None]
+
+
+def test_crash_mid_step():
+
+   chats_dir = tempfile.mkdtemp()
+   writer = TranscriptWriter(chats_dir, compression="gzip")
+   writer.begin(1)
+   for i in range(5):
+      writer.append({"content": f"message {i}"})
+   # the process dies: no end(), and the last message is half written
+   writer._file.write(b"\x1f\x8b\x08\x00garbage")
+   writer._file.flush()
+
+   assert load_index(chats_dir)["steps"]["1"]["end"] is None
+   assert [message["content"] for message in read_transcript(chats_dir, step=1)] == [f"message {i}" for i in range(5)]
+
+
+if __name__ == "__main__":
+   test_transcript_pages()
+   test_crash_mid_step()